@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark: deriva de los encodings según la alineación del pipeline facial
+
+Cada imagen pasa por FacePipeline con locator="hog" (ojos por landmarks dlib +
+HOG, el pipeline con el que se enroló la galería) y con locator="mediapipe"
+(ojos y caja de MediaPipe). Reporta:
+
+- Distancia entre los dos encodings de la misma imagen (p50 / p95 / máx)
+- Latencia del pipeline por modo
+- Con --db-url e imágenes en subdirectorios por user_id: distancia de cada
+  encoding a la muestra más cercana del propio usuario en la galería guardada,
+  su diferencia entre modos y cuántas imágenes cambian de lado del umbral
+  FACE_RECOGNITION_THRESHOLD
+
+Solo lee la BD (galería en memoria, sin escribir): sirve la de producción o una copia.
+
+Uso:
+    python -m backend.benchmarks.bench_alignment --images fotos/
+    python -m backend.benchmarks.bench_alignment --images fotos_por_usuario/ --db-url postgresql://...
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG")
+
+
+def load_labeled_images(directory: str) -> List[Tuple[Optional[int], bytes]]:
+    """
+    Imágenes del directorio (user_id = None) y de sus subdirectorios cuyo
+    nombre es un user_id (p.ej. fotos/12/a.jpg → 12).
+    """
+    items = []
+    for sub in [directory] + sorted(glob.glob(os.path.join(directory, "*", ""))):
+        name = os.path.basename(os.path.normpath(sub))
+        user_id = int(name) if sub != directory and name.isdigit() else None
+        if sub != directory and user_id is None:
+            continue
+        for ext in _EXTENSIONS:
+            for path in sorted(glob.glob(os.path.join(sub, ext))):
+                with open(path, "rb") as f:
+                    items.append((user_id, f.read()))
+    return items
+
+
+def _summary(values: List[float]) -> Dict:
+    arr = np.asarray(values, dtype=np.float64)
+    if arr.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(arr.size),
+        "p50": round(float(np.percentile(arr, 50)), 4),
+        "p95": round(float(np.percentile(arr, 95)), 4),
+        "max": round(float(arr.max()), 4),
+        "mean": round(float(arr.mean()), 4),
+    }
+
+
+def encode_all(frames: List[np.ndarray], locator: str) -> Tuple[List[Optional[np.ndarray]], List[float]]:
+    from backend.recognition.face_extraction import FacePipeline, create_face_detector
+
+    pipeline = FacePipeline(create_face_detector(), locator=locator)
+    pipeline.warm_up()
+    encodings, latencies = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        out = pipeline.run(frame, require_quality_check=False)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        encodings.append(np.asarray(out["encoding"], dtype=np.float32) if out["status"] == "ok" else None)
+    return encodings, latencies
+
+
+def gallery_distances(user_ids: List[Optional[int]],
+                      encodings: List[Optional[np.ndarray]]) -> List[Optional[float]]:
+    """Distancia de cada encoding a la muestra más cercana de su usuario en la galería guardada"""
+    from backend.db.database import SessionLocal
+    from backend.recognition.face_gallery import FaceGallery
+
+    gallery = FaceGallery(mode="full", backend="exact")
+    db = SessionLocal()
+    try:
+        out = []
+        for user_id, encoding in zip(user_ids, encodings):
+            if user_id is None or encoding is None:
+                out.append(None)
+                continue
+            matrix, _ = gallery.snapshot(db, user_id)
+            out.append(float(np.min(np.linalg.norm(matrix - encoding, axis=1))) if matrix.shape[0] else None)
+        return out
+    finally:
+        db.close()
+
+
+def run(args) -> Dict:
+    # La BD se elige antes de importar backend.db (el engine se crea al importar)
+    if args.db_url:
+        os.environ["DATABASE_URL"] = args.db_url
+    from backend.recognition.face_service import RECOGNITION_THRESHOLD
+    from backend.recognition.image_preprocess import decode_frame
+
+    labeled = load_labeled_images(args.images)
+    pairs = [(user_id, decode_frame(data)) for user_id, data in labeled]
+    pairs = [(user_id, frame) for user_id, frame in pairs if frame is not None]
+    if not pairs:
+        raise SystemExit(f"No hay imágenes legibles en {args.images}")
+    user_ids = [user_id for user_id, _ in pairs]
+    frames = [frame for _, frame in pairs]
+
+    legacy, legacy_ms = encode_all(frames, "hog")
+    fast, fast_ms = encode_all(frames, "mediapipe")
+    both = [i for i, (a, b) in enumerate(zip(legacy, fast)) if a is not None and b is not None]
+    shift = [float(np.linalg.norm(legacy[i] - fast[i])) for i in both]
+
+    report: Dict = {
+        "images": len(frames),
+        "encoded": {"hog": sum(e is not None for e in legacy), "mediapipe": sum(e is not None for e in fast)},
+        "latency_ms": {"hog": _summary(legacy_ms), "mediapipe": _summary(fast_ms)},
+        "hog_vs_mediapipe_distance": _summary(shift),
+        "threshold": RECOGNITION_THRESHOLD,
+    }
+
+    print(f"\n📐 {len(frames)} imágenes | encodings hog={report['encoded']['hog']} "
+          f"mediapipe={report['encoded']['mediapipe']}")
+    print(f"   latencia p50: hog {report['latency_ms']['hog'].get('p50', 0):.1f} ms | "
+          f"mediapipe {report['latency_ms']['mediapipe'].get('p50', 0):.1f} ms")
+    print(f"   distancia hog↔mediapipe (misma imagen): {report['hog_vs_mediapipe_distance']}")
+
+    if args.db_url and any(u is not None for u in user_ids):
+        d_legacy = gallery_distances(user_ids, legacy)
+        d_fast = gallery_distances(user_ids, fast)
+        rows = [(a, b) for a, b in zip(d_legacy, d_fast) if a is not None and b is not None]
+        crossed = sum((a <= RECOGNITION_THRESHOLD) != (b <= RECOGNITION_THRESHOLD) for a, b in rows)
+        report["gallery"] = {
+            "hog": _summary([a for a, _ in rows]),
+            "mediapipe": _summary([b for _, b in rows]),
+            "delta": _summary([b - a for a, b in rows]),
+            "threshold_crossings": int(crossed),
+        }
+        print(f"   distancia a la galería del usuario: hog {report['gallery']['hog']}")
+        print(f"                                       mediapipe {report['gallery']['mediapipe']}")
+        print(f"   delta (mediapipe - hog): {report['gallery']['delta']} | "
+              f"cambian de lado del umbral {RECOGNITION_THRESHOLD}: {crossed}/{len(rows)}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deriva de encodings entre alineación dlib (hog) y MediaPipe")
+    parser.add_argument("--images", required=True,
+                        help="Directorio con JPEG/PNG; subdirectorios con nombre = user_id para comparar con la galería")
+    parser.add_argument("--db-url", help="BD con la galería enrolada (solo lectura)")
+    parser.add_argument("--json", help="Guardar el reporte completo en este archivo")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+        print(f"💾 Reporte guardado en {args.json}")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark: motores de F0 para analizar_voz_audio (yin / praat vs pyin)
+
+Cada clip pasa por el mismo preprocesado que el análisis (pasa-altos 80 Hz +
+VAD) y luego por cada motor de pitch_estimation. Reporta:
+
+- Latencia por clip: mediana y p95, y speedup contra pyin
+- pitch_mean / pitch_std por motor y su diferencia con pyin (y con el F0 real
+  en los clips sintéticos)
+- Acuerdo de las reglas del score que dependen del pitch (fuera de rango y
+  monotonía según UMBRALES_TONO)
+- Silencio digital (ceros, sin VAD): frames marcados con voz por motor, que
+  deben ser 0
+
+Uso:
+    python -m backend.benchmarks.bench_pitch                    # voces sintéticas por género
+    python -m backend.benchmarks.bench_pitch --audio grabaciones/ --gender femenino
+    python -m backend.benchmarks.bench_pitch --engines yin,praat --repeat 5
+"""
+
+import argparse
+import glob
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import librosa
+import numpy as np
+
+from backend.services.pitch_estimation import estimar_f0
+from backend.services.voice_activity import detectar_actividad_voz
+from backend.services.voice_analysis_service import (
+    SAMPLE_RATE,
+    UMBRALES_TONO,
+    butter_highpass_filter,
+)
+
+# F0 base de las voces sintéticas por género
+_SYNTHETIC_F0 = {"masculino": 120.0, "femenino": 210.0, "neutro": 170.0}
+
+
+def synthetic_voice(f0_base: float, seconds: float, seed: int) -> Tuple[np.ndarray, float, float]:
+    """
+    Vocal con armónicos, vibrato lento y pausas + ruido de fondo.
+
+    Returns:
+        (señal, pitch_mean real, pitch_std real) sobre los tramos con voz
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    vibrato = rng.uniform(0.05, 0.15)
+    f0 = f0_base * (1 + vibrato * np.sin(2 * np.pi * rng.uniform(0.2, 0.5) * t))
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voiced = np.sin(2 * np.pi * rng.uniform(0.3, 0.6) * t) > -0.3
+    signal = sum((0.6 / k) * np.sin(k * phase) for k in range(1, 9))
+    y = 0.3 * signal * voiced + 0.003 * rng.standard_normal(t.size)
+    return y.astype(np.float32), float(f0[voiced].mean()), float(f0[voiced].std())
+
+
+def load_audio(directory: str) -> List[Tuple[str, np.ndarray]]:
+    paths = sorted(
+        p for ext in ("*.wav", "*.webm", "*.ogg", "*.mp3", "*.m4a")
+        for p in glob.glob(os.path.join(directory, ext))
+    )
+    return [(os.path.basename(p), librosa.load(p, sr=SAMPLE_RATE)[0]) for p in paths]
+
+
+def _pitch_stats(f0: np.ndarray) -> Tuple[float, float]:
+    valid = f0[~np.isnan(f0)]
+    if valid.size == 0:
+        return 0.0, 0.0
+    return float(np.mean(valid)), float(np.std(valid))
+
+
+def _score_flags(mean: float, std: float, umbral: Dict) -> Tuple[bool, bool]:
+    """Las dos reglas de analizar_voz_audio que dependen del pitch"""
+    return mean < umbral["bajo"] or mean > umbral["alto"], std < umbral["monotonia"]
+
+
+def check_silence(engines: List[str], seconds: float = 2.0) -> None:
+    """
+    Silencio digital seguido de un tono: sin VAD, ningún frame del tramo de
+    ceros puede salir con voz (en YIN la CMND de una señal nula es 0/0).
+    """
+    n = int(SAMPLE_RATE * seconds)
+    t = np.arange(n) / SAMPLE_RATE
+    y = np.concatenate([np.zeros(n), 0.3 * np.sin(2 * np.pi * 150.0 * t)]).astype(np.float32)
+    umbral = UMBRALES_TONO["neutro"]
+    # Frames cuyo centro cae en el tramo nulo, con margen para la ventana de
+    # análisis más larga (pyin: 2048 muestras)
+    silent_seconds = seconds - 0.1
+    print(f"\n🔇 Silencio digital ({seconds:.1f} s de ceros + tono de 150 Hz, sin VAD)")
+    for engine in engines:
+        f0 = np.asarray(estimar_f0(y, SAMPLE_RATE, umbral, engine)["f0"], dtype=np.float64)
+        times = np.arange(f0.size) * (2 * seconds) / max(f0.size, 1)
+        silent = times < silent_seconds
+        voiced = int(np.sum(~np.isnan(f0[silent])))
+        tone = f0[times > seconds + 0.1]
+        mark = "✅" if voiced == 0 else "❌"
+        print(f"   {mark} {engine:<7} frames con voz en el silencio: {voiced}/{int(silent.sum())} | "
+              f"F0 del tono {np.nanmedian(tone) if np.any(~np.isnan(tone)) else float('nan'):.1f} Hz")
+
+
+def run(clips: List[Tuple[str, str, np.ndarray, Optional[Tuple[float, float]]]],
+        engines: List[str], repeat: int) -> None:
+    print(f"📊 {len(clips)} clips, motores {engines}, {repeat} repeticiones")
+
+    latencies: Dict[str, List[float]] = {e: [] for e in engines}
+    rows = []
+    for name, gender, audio, truth in clips:
+        umbral = UMBRALES_TONO[gender]
+        y = butter_highpass_filter(audio, 80, SAMPLE_RATE)
+        actividad = detectar_actividad_voz(y, SAMPLE_RATE)
+
+        stats = {}
+        for engine in engines:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                f0 = estimar_f0(y, SAMPLE_RATE, umbral, engine, actividad)["f0"]
+                latencies[engine].append((time.perf_counter() - start) * 1000.0)
+            stats[engine] = _pitch_stats(f0)
+        rows.append((name, gender, truth, stats))
+
+    reference = "pyin" if "pyin" in engines else engines[0]
+    base = np.median(latencies[reference])
+    print(f"\n   {'motor':<7} {'p50 ms':>9} {'p95 ms':>9} {'x vs ' + reference:>10}")
+    for engine in engines:
+        p50 = np.median(latencies[engine])
+        p95 = np.percentile(latencies[engine], 95)
+        print(f"   {engine:<7} {p50:>9.1f} {p95:>9.1f} {base / p50 if p50 > 0 else float('inf'):>10.1f}")
+
+    print(f"\n   {'clip':<22} {'género':<10} " + " ".join(f"{e + ' mean/std':>18}" for e in engines)
+          + f" {'real mean/std':>16}")
+    for name, gender, truth, stats in rows:
+        cells = " ".join(f"{stats[e][0]:>9.1f}/{stats[e][1]:<8.1f}" for e in engines)
+        real = f"{truth[0]:>8.1f}/{truth[1]:<7.1f}" if truth else f"{'-':>16}"
+        print(f"   {name[:22]:<22} {gender:<10} {cells} {real}")
+
+    for engine in engines:
+        if engine == reference:
+            continue
+        d_mean = [abs(s[engine][0] - s[reference][0]) for _, _, _, s in rows]
+        d_std = [abs(s[engine][1] - s[reference][1]) for _, _, _, s in rows]
+        agree = np.mean([
+            _score_flags(*s[engine], UMBRALES_TONO[g]) == _score_flags(*s[reference], UMBRALES_TONO[g])
+            for _, g, _, s in rows
+        ])
+        print(f"✅ {engine} vs {reference}: |Δ mean| mediana {np.median(d_mean):.1f} Hz, "
+              f"|Δ std| mediana {np.median(d_std):.1f} Hz, reglas del score iguales en {agree:.0%}")
+
+    synthetic = [(t, s) for _, _, t, s in rows if t]
+    for engine in engines:
+        if synthetic:
+            err = [abs(s[engine][0] - t[0]) for t, s in synthetic]
+            print(f"🎯 {engine}: error de pitch_mean contra el F0 real, mediana {np.median(err):.1f} Hz")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de motores de F0")
+    parser.add_argument("--audio", help="Directorio con grabaciones (por defecto, voces sintéticas)")
+    parser.add_argument("--gender", default="neutro", choices=sorted(UMBRALES_TONO),
+                        help="Género de las grabaciones de --audio")
+    parser.add_argument("--clips", type=int, default=3, help="Clips sintéticos por género")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--engines", default="pyin,yin,praat")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.audio:
+        clips = [(name, args.gender, y, None) for name, y in load_audio(args.audio)]
+    else:
+        clips = []
+        for gender, f0_base in _SYNTHETIC_F0.items():
+            for i in range(args.clips):
+                y, mean, std = synthetic_voice(f0_base * (1 + 0.05 * (i - 1)), args.seconds, seed=i)
+                clips.append((f"sintético-{gender}-{i}", gender, y, (mean, std)))
+    if not clips:
+        raise SystemExit("No se encontraron grabaciones")
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    run(clips, engines, max(1, args.repeat))
+    check_silence(engines)
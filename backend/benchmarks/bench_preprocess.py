@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Benchmark: detección sobre una copia reducida + decodificación reducida (opt-in)
+
+Compara la ruta original (imdecode completo, calidad y MediaPipe a resolución
+completa) con:
+- la ruta por defecto: frame completo, MediaPipe sobre una copia reducida a
+  FACE_DETECT_MAX_SIDE y cajas proyectadas al frame completo para el recorte
+- la decodificación IMREAD_REDUCED_* (FACE_DECODE_MAX_SIDE, opt-in), donde
+  calidad, recorte y encoding corren sobre el frame reducido
+
+Latencia: mediana y p95 por etapa.
+Precisión: acuerdo de la decisión de calidad, IoU de las cajas y, si está
+face_recognition, distancia entre encodings. Además verifica con un detector
+stub que la caja detectada en la copia reducida (y en la decodificación
+reducida) cae sobre el mismo recorte del frame completo.
+
+Uso:
+    python -m backend.benchmarks.bench_preprocess                  # frames sintéticos 1920x1080
+    python -m backend.benchmarks.bench_preprocess --images fotos/  # JPEG/PNG reales
+    python -m backend.benchmarks.bench_preprocess --repeat 50
+"""
+
+import argparse
+import glob
+import os
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import cv2
+import numpy as np
+
+from backend.recognition.image_preprocess import (
+    DECODE_MAX_SIDE,
+    DETECT_MAX_SIDE,
+    QUALITY_MAX_SIDE,
+    decode_frame,
+)
+
+# Lado objetivo de la decodificación reducida cuando FACE_DECODE_MAX_SIDE=0 (por defecto)
+_REDUCED_DECODE_SIDE = DECODE_MAX_SIDE or 640
+
+try:
+    from backend.recognition import face_extraction
+    EXTRACTION_AVAILABLE = True
+except ImportError:
+    face_extraction = None
+    EXTRACTION_AVAILABLE = False
+
+
+def synthetic_frames(count: int, width: int = 1920, height: int = 1080, seed: int = 0) -> List[bytes]:
+    """JPEGs con un 'rostro' dibujado (óvalo + ojos + boca) sobre fondo con ruido"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        img = rng.integers(40, 90, (height, width, 3), dtype=np.uint8)
+        cx = int(width * rng.uniform(0.35, 0.65))
+        cy = int(height * rng.uniform(0.4, 0.6))
+        r = int(min(width, height) * rng.uniform(0.15, 0.25))
+        cv2.ellipse(img, (cx, cy), (int(r * 0.8), r), 0, 0, 360, (150, 170, 200), -1)
+        for dx in (-0.3, 0.3):
+            cv2.circle(img, (int(cx + dx * r), int(cy - 0.2 * r)), max(2, r // 10), (40, 30, 30), -1)
+        cv2.ellipse(img, (cx, int(cy + 0.45 * r)), (r // 3, r // 10), 0, 0, 180, (60, 50, 120), -1)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        frames.append(buf.tobytes())
+    return frames
+
+
+def load_images(directory: str) -> List[bytes]:
+    paths = sorted(
+        p for ext in ("*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG")
+        for p in glob.glob(os.path.join(directory, ext))
+    )
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+def _timed(fn: Callable, items: list, repeat: int) -> Dict:
+    """Ejecuta fn sobre cada item `repeat` veces; retorna resultados (última pasada) + latencias"""
+    samples = []
+    results = []
+    for r in range(repeat):
+        results = []
+        for item in items:
+            start = time.perf_counter()
+            results.append(fn(item))
+            samples.append((time.perf_counter() - start) * 1000.0)
+    arr = np.asarray(samples)
+    return {
+        "results": results,
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+    }
+
+
+def _row(name: str, full: Dict, reduced: Dict) -> None:
+    speedup = full["p50_ms"] / reduced["p50_ms"] if reduced["p50_ms"] > 0 else float("inf")
+    print(f"   {name:<10} {full['p50_ms']:>9.2f} {full['p95_ms']:>9.2f}   "
+          f"{reduced['p50_ms']:>9.2f} {reduced['p95_ms']:>9.2f}   x{speedup:.1f}")
+
+
+def _box_iou(a, b) -> float:
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class _SquareDetector:
+    """Stub de MediaPipe: caja relativa de los píxeles blancos de la imagen que recibe"""
+
+    def __init__(self):
+        self.seen_shape = None
+
+    def process(self, rgb):
+        self.seen_shape = rgb.shape
+        ys, xs = np.nonzero(rgb.min(axis=2) > 200)
+        if xs.size == 0:
+            return SimpleNamespace(detections=[])
+        h, w = rgb.shape[:2]
+        box = SimpleNamespace(xmin=xs.min() / w, ymin=ys.min() / h,
+                              width=(xs.max() + 1 - xs.min()) / w, height=(ys.max() + 1 - ys.min()) / h)
+        location = SimpleNamespace(relative_bounding_box=box, relative_keypoints=[])
+        return SimpleNamespace(detections=[SimpleNamespace(location_data=location)])
+
+
+def check_box_mapping(width: int = 1280, height: int = 720) -> bool:
+    """
+    Un cuadrado blanco en un JPEG width x height: la caja detectada sobre la copia
+    reducida (FACE_DETECT_MAX_SIDE) y sobre la decodificación IMREAD_REDUCED_*
+    proyectadas al frame completo deben recortar el mismo cuadrado.
+    """
+    true_box = (500, 200, 740, 440)
+    img = np.random.default_rng(0).integers(40, 90, (height, width, 3), dtype=np.uint8)
+    cv2.rectangle(img, true_box[:2], (true_box[2] - 1, true_box[3] - 1), (255, 255, 255), -1)
+    data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+    full = decode_frame(data, max_side=0)
+    reduced = decode_frame(data, max_side=_REDUCED_DECODE_SIDE)
+
+    detector = _SquareDetector()
+    cases = []
+    # Ruta por defecto: MediaPipe ve la copia reducida, la caja sale en píxeles del frame completo
+    d = face_extraction._detect(detector, full, max_side=DETECT_MAX_SIDE or 640)
+    cases.append(("copia reducida", detector.seen_shape, d["box"] if d else None))
+    # Decodificación reducida: la caja en píxeles reducidos se escala al frame completo
+    d = face_extraction._detect(detector, reduced, max_side=0)
+    sx, sy = full.shape[1] / reduced.shape[1], full.shape[0] / reduced.shape[0]
+    cases.append(("decode reducido", reduced.shape,
+                  (d["box"][0] * sx, d["box"][1] * sy, d["box"][2] * sx, d["box"][3] * sy) if d else None))
+
+    ok = True
+    for name, seen, box in cases:
+        if box is None:
+            print(f"   ❌ {name}: sin detección")
+            ok = False
+            continue
+        x1, y1, x2, y2 = (int(round(v)) for v in box)
+        crop = full[max(0, y1):y2, max(0, x1):x2]
+        iou = _box_iou(true_box, (x1, y1, x2, y2))
+        white = float(np.mean(crop.min(axis=2) > 200)) if crop.size else 0.0
+        passed = iou >= 0.97 and white >= 0.95
+        ok = ok and passed
+        print(f"   {'✅' if passed else '❌'} {name}: detector vio {seen[1]}x{seen[0]}, caja {x1, y1, x2, y2} "
+              f"vs real {true_box} (IoU {iou:.3f}), recorte {white:.0%} del cuadrado")
+    return ok
+
+
+def run(images: List[bytes], repeat: int) -> None:
+    print(f"📊 {len(images)} imágenes, {repeat} repeticiones")
+    print(f"   FACE_DECODE_MAX_SIDE={DECODE_MAX_SIDE} FACE_QUALITY_MAX_SIDE={QUALITY_MAX_SIDE} "
+          f"FACE_DETECT_MAX_SIDE={DETECT_MAX_SIDE}")
+    print(f"   {'etapa':<10} {'full p50':>9} {'full p95':>9}   {'red. p50':>9} {'red. p95':>9}   speedup")
+
+    # 1) Decodificación (reducida = IMREAD_REDUCED_*, opt-in)
+    full_dec = _timed(lambda b: cv2.imdecode(np.frombuffer(b, np.uint8), cv2.IMREAD_COLOR), images, repeat)
+    red_dec = _timed(lambda b: decode_frame(b, max_side=_REDUCED_DECODE_SIDE), images, repeat)
+    _row("decode", full_dec, red_dec)
+    full_frames, red_frames = full_dec["results"], red_dec["results"]
+
+    if not EXTRACTION_AVAILABLE:
+        print("⚠️  face_recognition/mediapipe no disponibles: solo se mide la decodificación")
+        return
+
+    # 2) Calidad (full: gris a resolución original; reducida: sobre el frame decodificado reducido)
+    full_q = _timed(lambda f: face_extraction.assess_image_quality(f, max_side=0), full_frames, repeat)
+    red_q = _timed(lambda f: face_extraction.assess_image_quality(f, max_side=0), red_frames, repeat)
+    _row("quality", full_q, red_q)
+
+    # 3) Detección MediaPipe: a resolución completa vs copia reducida del frame completo (por defecto)
+    detector = face_extraction.create_face_detector()
+    full_d = _timed(lambda f: face_extraction._detect(detector, f, max_side=0), full_frames, repeat)
+    red_d = _timed(lambda f: face_extraction._detect(detector, f), full_frames, repeat)
+    _row("detect", full_d, red_d)
+
+    # 4) Pipeline completo (detección → encoding) sobre el frame completo
+    pipeline = face_extraction.FacePipeline(detector)
+    full_e = _timed(
+        lambda f: pipeline.run(f, False, detection=face_extraction._detect(detector, f, max_side=0)),
+        full_frames, repeat,
+    )
+    red_e = _timed(lambda f: pipeline.run(f, False), full_frames, repeat)
+    _row("pipeline", full_e, red_e)
+
+    # Precisión
+    agree = np.mean([
+        a["is_acceptable"] == b["is_acceptable"] for a, b in zip(full_q["results"], red_q["results"])
+    ])
+    print(f"✅ Calidad: decisión igual en {agree:.1%} de las imágenes con decodificación reducida")
+
+    ious = [_box_iou(a["box"], b["box"]) for a, b in zip(full_d["results"], red_d["results"])
+            if a is not None and b is not None]
+    detected = sum(d is not None for d in full_d["results"]), sum(d is not None for d in red_d["results"])
+    print(f"✅ Detección: {detected[0]} (full) vs {detected[1]} (copia reducida) rostros; "
+          f"IoU media {np.mean(ious) if ious else float('nan'):.3f}")
+
+    def _dists(a_results, b_results):
+        return [
+            float(np.linalg.norm(a["encoding"] - b["encoding"]))
+            for a, b in zip(a_results, b_results)
+            if a["status"] == "ok" and b["status"] == "ok"
+        ]
+
+    # Encoding con toda la imagen decodificada reducida (opt-in): no comparable con la galería
+    red_dec_e = [pipeline.run(f, False) for f in red_frames]
+    for name, dists in (("detección reducida", _dists(full_e["results"], red_e["results"])),
+                        ("decodificación reducida", _dists(full_e["results"], red_dec_e))):
+        if dists:
+            print(f"✅ Encoding con {name}: distancia contra full media {np.mean(dists):.4f}, "
+                  f"máx {np.max(dists):.4f} (umbral de reconocimiento 0.50)")
+        else:
+            print(f"⚠️  Encoding con {name}: sin encodings comparables")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de decodificación y reescalado de frames")
+    parser.add_argument("--images", help="Directorio con JPEG/PNG (por defecto, frames sintéticos)")
+    parser.add_argument("--count", type=int, default=20, help="Frames sintéticos a generar")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    images = load_images(args.images) if args.images else synthetic_frames(args.count)
+    if not images:
+        raise SystemExit("No se encontraron imágenes")
+    run(images, max(1, args.repeat))
+    if EXTRACTION_AVAILABLE:
+        print("\n📐 Caja detectada en reducido → recorte del frame completo")
+        if not check_box_mapping():
+            raise SystemExit(1)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: evaluación de calidad de una ráfaga
+
+Compara cuatro variantes sobre la misma ráfaga:
+- legacy:  implementación anterior (gris, Laplaciano y std a resolución completa)
+- single:  assess_image_quality en un loop
+- records: assess_image_quality_records (por frame: Laplaciano CV_16S + sumElems/norm;
+           umbrales vectorizados sobre el registro)
+- stacked: referencia con la ráfaga apilada (un cvtColor y un Laplaciano para todos
+           los frames); muestra que apilar no compensa las copias
+
+Reporta mediana/p95 por ráfaga y la coincidencia de métricas y decisiones.
+
+Uso:
+    python -m backend.benchmarks.bench_quality
+    python -m backend.benchmarks.bench_quality --frames 16 --width 1280 --height 720 --repeat 50
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List
+
+import cv2
+import numpy as np
+
+from backend.recognition.face_extraction import (
+    _mean_var,
+    assess_image_quality,
+    assess_image_quality_records,
+    quality_info,
+)
+from backend.recognition.image_preprocess import QUALITY_MAX_SIDE
+
+
+def legacy_assess_image_quality(frame) -> Dict:
+    """Versión anterior de assess_image_quality (referencia, resolución completa)"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    brightness = np.mean(gray)
+    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    contrast = gray.std()
+    height, width = frame.shape[:2]
+
+    score = 0
+    score += 0 if brightness < 60 or brightness > 200 else 25
+    score += 0 if laplacian_var < 50 else 25
+    score += 0 if contrast < 20 else 25
+    score += 0 if width < 200 or height < 200 else 25
+    return {"score": score, "brightness": brightness, "sharpness": laplacian_var,
+            "contrast": contrast, "is_acceptable": score >= 50}
+
+
+def stacked_metrics(frames: List[np.ndarray]) -> np.ndarray:
+    """(brillo, contraste, nitidez) [n, 3] con una sola pasada de gris y Laplaciano sobre la pila"""
+    n, (h, w) = len(frames), frames[0].shape[:2]
+    gray = cv2.cvtColor(np.stack(frames).reshape(n * h, w, 3), cv2.COLOR_BGR2GRAY).reshape(n, h, w)
+    # Una fila reflejada (REFLECT_101) arriba y abajo de cada frame: el Laplaciano no cruza frames
+    padded = np.empty((n, h + 2, w), np.uint8)
+    padded[:, 1:-1], padded[:, 0], padded[:, -1] = gray, gray[:, 1], gray[:, -2]
+    lap = cv2.Laplacian(padded.reshape(n * (h + 2), w), cv2.CV_16S).reshape(n, h + 2, w)[:, 1:-1]
+    out = np.empty((n, 3))
+    for i in range(n):
+        mean, var = _mean_var(gray[i])
+        out[i] = mean, var ** 0.5, _mean_var(lap[i])[1]
+    return out
+
+
+def burst(count: int, width: int, height: int, seed: int = 0) -> List[np.ndarray]:
+    """Ráfaga sintética: ruido con distintos niveles de desenfoque y brillo"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        blur = 1 + 2 * (i % 4)
+        img = cv2.GaussianBlur(img, (blur, blur), 0)
+        img = cv2.convertScaleAbs(img, alpha=rng.uniform(0.3, 1.2), beta=rng.uniform(-40, 60))
+        frames.append(img)
+    return frames
+
+
+def _timed(fn: Callable, repeat: int) -> Dict:
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    arr = np.asarray(samples)
+    return {"result": result, "p50_ms": float(np.percentile(arr, 50)), "p95_ms": float(np.percentile(arr, 95))}
+
+
+def run(frames: List[np.ndarray], repeat: int) -> None:
+    h, w = frames[0].shape[:2]
+    print(f"📊 Ráfaga de {len(frames)} frames {w}x{h}, {repeat} repeticiones, FACE_QUALITY_MAX_SIDE={QUALITY_MAX_SIDE}")
+
+    legacy = _timed(lambda: [legacy_assess_image_quality(f) for f in frames], repeat)
+    single = _timed(lambda: [assess_image_quality(f) for f in frames], repeat)
+    records = _timed(lambda: assess_image_quality_records(frames), repeat)
+    stacked = _timed(lambda: stacked_metrics(frames), repeat)
+
+    base = legacy["p50_ms"]
+    for name, r in (("legacy", legacy), ("single", single), ("records", records), ("stacked", stacked)):
+        speedup = base / r["p50_ms"] if r["p50_ms"] > 0 else float("inf")
+        print(f"   {name:<7} p50 {r['p50_ms']:>8.2f} ms   p95 {r['p95_ms']:>8.2f} ms   x{speedup:.1f} vs legacy")
+
+    # Records vs single: mismas métricas
+    record_infos = [quality_info(r) for r in records["result"]]
+    max_diff = max(
+        abs(a[k] - b[k])
+        for a, b in zip(single["result"], record_infos)
+        for k in ("brightness", "sharpness", "contrast")
+    )
+    print(f"✅ records vs single: diferencia máxima de métricas {max_diff:.2e}")
+
+    # Con FACE_QUALITY_MAX_SIDE=0 las métricas deben coincidir con legacy (umbrales calibrados así)
+    sharp_diff = max(abs(a["sharpness"] - b["sharpness"]) / max(a["sharpness"], 1e-9)
+                     for a, b in zip(legacy["result"], record_infos))
+    print(f"✅ records vs legacy: diferencia relativa máxima de nitidez {sharp_diff:.2e}")
+    agree = np.mean([a["is_acceptable"] == b["is_acceptable"] for a, b in zip(legacy["result"], record_infos)])
+    score_agree = np.mean([a["score"] == b["score"] for a, b in zip(legacy["result"], record_infos)])
+    print(f"✅ records vs legacy: decisión igual en {agree:.1%}, score igual en {score_agree:.1%}")
+    stacked_diff = np.max(np.abs(stacked["result"][:, 2] - records["result"]["sharpness"])
+                          / np.maximum(records["result"]["sharpness"], 1e-9))
+    print(f"✅ stacked vs records: diferencia relativa máxima de nitidez {stacked_diff:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark de assess_image_quality sobre una ráfaga")
+    parser.add_argument("--frames", type=int, default=8)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    run(burst(max(1, args.frames), args.width, args.height), max(1, args.repeat))
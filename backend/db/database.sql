@@ -412,6 +412,16 @@ COMMENT ON COLUMN face_encodings.capture_method IS 'Método de captura: registra
 COMMENT ON COLUMN face_encodings.image_metadata IS 'Metadata de la imagen: brightness, sharpness, contrast, size';
 COMMENT ON COLUMN face_encodings.is_active IS 'Permite soft delete de encodings obsoletos';
 
+-- =====================================================
+--  MIGRACIÓN: encodings en formato binario (2.0-f32)
+--  128 float32 little-endian = 512 bytes por fila.
+--  Rellenar filas existentes con:
+--    python -m backend.db.migrate_face_encodings_binary
+-- =====================================================
+ALTER TABLE face_encodings ADD COLUMN IF NOT EXISTS encoding_blob BYTEA;
+ALTER TABLE face_encodings ALTER COLUMN encoding_data DROP NOT NULL;
+COMMENT ON COLUMN face_encodings.encoding_blob IS 'Encoding float32 binario (512 bytes), encoding_version = 2.0-f32';
+
 -- Verificar que la tabla se creó correctamente
 SELECT 'Tabla face_encodings creada exitosamente' AS status;
 
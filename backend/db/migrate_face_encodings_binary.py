@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Migración: face_encodings.encoding_data (JSON) → encoding_blob (float32, 512 bytes)
+
+Reescribe en lotes las filas que aún no tienen blob. Es idempotente y se puede
+ejecutar con el servidor en marcha: los workers leen ambos formatos.
+
+Uso:
+    python -m backend.db.migrate_face_encodings_binary
+    python -m backend.db.migrate_face_encodings_binary --batch-size 2000
+    python -m backend.db.migrate_face_encodings_binary --drop-json   # tras el rollover
+"""
+
+import argparse
+
+import numpy as np
+from sqlalchemy import null, update
+
+from backend.db.database import SessionLocal, engine
+from backend.db import models
+from backend.db.schema_upgrades import apply_schema_upgrades
+from backend.recognition.encoding_format import (
+    ENCODING_DIM,
+    ENCODING_VERSION_F32,
+    pack_encoding,
+)
+
+
+def migrate_to_binary(batch_size: int = 1000) -> int:
+    """Rellena encoding_blob en lotes. Retorna el número de filas migradas."""
+    db = SessionLocal()
+    migrated = 0
+    skipped = 0
+    last_id = 0
+
+    try:
+        while True:
+            rows = db.query(
+                models.FaceEncoding.id,
+                models.FaceEncoding.encoding_data,
+            ).filter(
+                models.FaceEncoding.encoding_blob.is_(None),
+                models.FaceEncoding.id > last_id,
+            ).order_by(models.FaceEncoding.id).limit(batch_size).all()
+
+            if not rows:
+                break
+
+            params = []
+            for encoding_id, encoding_data in rows:
+                last_id = encoding_id
+                arr = np.asarray(encoding_data or [], dtype=np.float32)
+                if arr.shape != (ENCODING_DIM,):
+                    skipped += 1
+                    continue
+                params.append({
+                    "id": encoding_id,
+                    "encoding_blob": pack_encoding(arr),
+                    "encoding_version": ENCODING_VERSION_F32,
+                })
+
+            if params:
+                # UPDATE masivo por clave primaria (executemany)
+                db.execute(update(models.FaceEncoding), params)
+                db.commit()
+                migrated += len(params)
+                print(f"   ... {migrated} filas migradas (último id {last_id})")
+
+        print(f"✅ Migración completa: {migrated} filas, {skipped} omitidas (JSON inválido)")
+        return migrated
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error en migración: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def drop_legacy_json() -> int:
+    """Borra el JSON legacy de las filas que ya tienen blob (solo tras el rollover)."""
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(models.FaceEncoding)
+            .where(
+                models.FaceEncoding.encoding_blob.is_not(None),
+                models.FaceEncoding.encoding_data.is_not(None),
+            )
+            .values(encoding_data=null())
+        )
+        db.commit()
+        print(f"✅ JSON legacy eliminado en {result.rowcount} filas")
+        return result.rowcount
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migra encodings faciales a formato binario float32")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop-json", action="store_true", help="Elimina encoding_data en filas ya migradas")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("  MIGRACIÓN: face_encodings JSON → float32 binario")
+    print("=" * 70)
+
+    apply_schema_upgrades(engine)
+    migrate_to_binary(max(1, args.batch_size))
+    if args.drop_json:
+        drop_legacy_json()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Boolean, Float, Text, JSON, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, ForeignKey, Boolean, Float, Text, JSON, Enum
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -37,7 +37,9 @@ class FaceEncoding(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     
-    encoding_data = Column(JSON, nullable=False)
+    # "1.0": JSON array (legacy) | "2.0-f32": 128 float32 little-endian en encoding_blob (512 bytes)
+    encoding_data = Column(JSON, nullable=True)
+    encoding_blob = Column(LargeBinary, nullable=True)
     encoding_version = Column(String(20), default="1.0")
     quality_score = Column(Float, nullable=True)
     
@@ -51,6 +53,19 @@ class FaceEncoding(Base):
     
     user = relationship("User", back_populates="face_encodings")
 
+
+class FaceGalleryState(Base):
+    """
+    Epoch de la galería facial.
+    Cada alta/baja de encodings incrementa `version`; los workers comparan
+    este valor con su copia en memoria para saber si deben recargarla.
+    """
+    __tablename__ = "face_gallery_state"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # ==========================================
 # USUARIOS Y ADMINISTRADORES
 # ==========================================
@@ -188,11 +203,21 @@ class VoiceExerciseSession(Base):
     hnr = Column(Float, nullable=True)
     score = Column(Float, nullable=True)
     risk_level = Column(Enum(VoiceRiskLevel), nullable=True, index=True)
+    # Motor de F0 que calculó pitch_mean/pitch_std (yin | praat | pyin). NULL = análisis
+    # anterior con librosa.pyin sin sr (F0 ~1.38x a 16 kHz): no comparable con los nuevos
+    pitch_engine = Column(String(20), nullable=True)
     
     # Metadatos de la sesión
     duration_seconds = Column(Integer, nullable=True)
     completed = Column(Boolean, default=False, index=True)
     notes = Column(Text, nullable=True)
+
+    # Análisis asíncrono: pending → processing → done | failed (las sesiones síncronas nacen en done)
+    analysis_status = Column(String(20), default="done", server_default="done", nullable=False, index=True)
+    analysis_error = Column(Text, nullable=True)
+    # Worker que lo procesa ("host:pid") y vencimiento de su lease (UTC); lease vencido = worker muerto
+    analysis_owner = Column(String(64), nullable=True)
+    analysis_lease_until = Column(DateTime, nullable=True)
     
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
@@ -0,0 +1,85 @@
+"""Idempotent schema upgrades for existing databases.
+
+`Base.metadata.create_all` creates missing tables but never alters tables
+that already exist. The statements here add the columns introduced after
+the initial schema so that production databases created with an older
+version keep working. Safe to run on every startup.
+"""
+
+from __future__ import annotations
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import DateTime, LargeBinary
+
+
+def _has_column(engine: Engine, table: str, column: str) -> bool:
+    inspector = inspect(engine)
+    if not inspector.has_table(table):
+        return False
+    return any(c["name"] == column for c in inspector.get_columns(table))
+
+
+def _is_nullable(engine: Engine, table: str, column: str) -> bool:
+    with engine.connect() as conn:
+        nullable = conn.execute(
+            text(
+                "SELECT is_nullable FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+            ),
+            {"table": table, "column": column},
+        ).scalar()
+    return nullable != "NO"
+
+
+def _upgrade_face_encodings_binary(engine: Engine) -> None:
+    # encoding_blob: 128 float32 (512 bytes), formato "2.0-f32"
+    if not _has_column(engine, "face_encodings", "encoding_blob"):
+        blob_type = LargeBinary().compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE face_encodings ADD COLUMN encoding_blob {blob_type}"))
+        print("✅ Columna face_encodings.encoding_blob agregada")
+
+    # encoding_data (JSON legacy) pasa a ser opcional
+    if engine.dialect.name == "postgresql" and not _is_nullable(engine, "face_encodings", "encoding_data"):
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE face_encodings ALTER COLUMN encoding_data DROP NOT NULL"))
+
+
+def _upgrade_voice_sessions_async(engine: Engine) -> None:
+    # Sesiones existentes quedan como análisis terminado
+    if not _has_column(engine, "voice_exercise_sessions", "analysis_status"):
+        with engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE voice_exercise_sessions "
+                "ADD COLUMN analysis_status VARCHAR(20) NOT NULL DEFAULT 'done'"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_voice_exercise_sessions_analysis_status "
+                "ON voice_exercise_sessions (analysis_status)"
+            ))
+        print("✅ Columna voice_exercise_sessions.analysis_status agregada")
+
+    if not _has_column(engine, "voice_exercise_sessions", "analysis_error"):
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE voice_exercise_sessions ADD COLUMN analysis_error TEXT"))
+
+    # Motor de F0 de cada análisis (NULL en las sesiones anteriores)
+    if not _has_column(engine, "voice_exercise_sessions", "pitch_engine"):
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE voice_exercise_sessions ADD COLUMN pitch_engine VARCHAR(20)"))
+
+    # Dueño y lease del trabajo en curso (recuperación sin pisar workers vivos)
+    if not _has_column(engine, "voice_exercise_sessions", "analysis_owner"):
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE voice_exercise_sessions ADD COLUMN analysis_owner VARCHAR(64)"))
+
+    if not _has_column(engine, "voice_exercise_sessions", "analysis_lease_until"):
+        lease_type = DateTime().compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE voice_exercise_sessions ADD COLUMN analysis_lease_until {lease_type}"))
+
+
+def apply_schema_upgrades(engine: Engine) -> None:
+    _upgrade_face_encodings_binary(engine)
+    _upgrade_voice_sessions_async(engine)
@@ -1,7 +1,7 @@
-from fastapi import FastAPI, Depends, Request, UploadFile, File, HTTPException, status, Form, APIRouter
+from fastapi import FastAPI, Depends, Request, UploadFile, File, HTTPException, status, Form, Header, APIRouter, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel, validator, Field, EmailStr
 from typing import List, Optional
 import numpy as np
@@ -12,18 +12,35 @@ import asyncio
 from backend.trends.trend_service import analyze_trends
 import json
 import os
+import threading
 
 
-# Importar el servicio de análisis de voz
-from backend.services.voice_analysis_service import procesar_audio_archivo
+# Análisis de voz (librosa/parselmouth se importan en el pool, no en el worker web)
+from backend.services.voice_analysis_pool import (
+    get_voice_analysis_pool,
+    VoiceQueueFull,
+    VoiceAnalysisTimeout,
+    VoiceJobCancelled,
+)
+from backend.services.pitch_estimation import F0_ENGINE
+from backend.services.audio_decoding import cargar_pcm, wav_float32, StreamDecoder, AudioDecodeError
+from backend.services.voice_session_jobs import (
+    get_voice_session_jobs,
+    aplicar_analisis,
+    sesion_a_dict,
+    estado_job,
+    eventos_job,
+    guardar_audio,
+    PENDING as VOICE_JOB_PENDING,
+)
 
-from backend.voice.transcription_service import TranscriptionService
+from backend.voice.transcription_service import TranscriptionService, SAMPLE_RATE as AUDIO_SAMPLE_RATE
 from backend.voice.tts_service import TTSService
 
 # -----------------------------
 # IMPORTS DE TU PROYECTO
 # -----------------------------
-from backend.db.database import Base, engine, get_db
+from backend.db.database import Base, engine, get_db, SessionLocal
 from backend.db import models
 from sqlalchemy.orm import Session
 from sqlalchemy import text
@@ -34,10 +51,28 @@ from backend.assessments.phq_gad_service import (
 )
 
 
-from backend.recognition.face_service import FaceRecognitionService
+from backend.recognition.face_service import (
+    FaceRecognitionService,
+    get_face_recognition_service,
+    warm_up_face_service,
+    face_readiness,
+)
+from backend.recognition.face_gallery import get_face_gallery, ensure_gallery_state, bump_gallery_epoch
+from backend.recognition.face_engine_pool import get_face_engine_pool, FACE_ENGINE_PROCESSES
+from backend.recognition.image_preprocess import decode_frame
+from backend.recognition.encoding_cache import content_key
+from backend.uploads import (
+    FACE_UPLOAD_MAX_BYTES,
+    VOICE_UPLOAD_MAX_BYTES,
+    UploadLimitMiddleware,
+    UploadTooLarge,
+    read_upload,
+    upload_stats,
+)
 from backend.auth import hash_password, verify_password, create_access_token, decode_access_token
 from backend.db.init_admin import init_super_admin
 from backend.db.seed_exercises import seed_exercises_if_empty
+from backend.db.schema_upgrades import apply_schema_upgrades
 
 # -----------------------------
 # SERVICIO EMAIL
@@ -121,17 +156,68 @@ def _startup_db_init():
     if not (has_direct_url or has_pg_vars or has_postgres_vars):
         print("⚠️  DB env vars not found (DATABASE_URL/PG*). Skipping DB init.")
         print("⚠️  Railway: add a Postgres plugin and reference its DATABASE_URL (or PG* vars) into this backend service.")
+        _start_face_warmup(with_gallery=False)
         return
 
     try:
         Base.metadata.create_all(bind=engine)
+        apply_schema_upgrades(engine)
         seed_exercises_if_empty()
         init_super_admin()
+
+        db = SessionLocal()
+        try:
+            ensure_gallery_state(db)
+        finally:
+            db.close()
     except Exception as e:
         # Don't crash the whole app if the DB isn't reachable (common in misconfigured deployments).
         # Railway: ensure the Postgres plugin is attached and DATABASE_URL/PG* vars exist.
         print("❌ DB startup init failed. The API will start, but DB-backed endpoints may not work.")
         print(f"❌ DB error: {e}")
+        _start_face_warmup(with_gallery=False)
+        return
+
+    _start_face_warmup(with_gallery=True)
+
+
+# Warm-up de reconocimiento facial al iniciar el worker (detector, encode de prueba, galería).
+# Por defecto corre en segundo plano: /health responde enseguida y /health/ready da 503 hasta terminar.
+FACE_WARMUP = os.getenv("FACE_WARMUP", "1").strip() == "1"
+FACE_WARMUP_BLOCKING = os.getenv("FACE_WARMUP_BLOCKING", "0").strip() == "1"
+
+
+def _face_warmup(with_gallery: bool):
+    db = SessionLocal() if with_gallery else None
+    try:
+        warm_up_face_service(db)
+    finally:
+        if db is not None:
+            db.close()
+
+
+def _start_face_warmup(with_gallery: bool):
+    if not FACE_WARMUP:
+        return
+    if FACE_WARMUP_BLOCKING:
+        _face_warmup(with_gallery)
+    else:
+        threading.Thread(target=_face_warmup, args=(with_gallery,), name="face-warmup", daemon=True).start()
+
+
+@app.on_event("startup")
+async def _startup_voice_pool():
+    get_voice_analysis_pool().start()
+    await get_voice_session_jobs().start()
+
+
+@app.on_event("shutdown")
+async def _shutdown_face_engine():
+    pool = get_face_engine_pool()
+    if pool is not None:
+        pool.shutdown()
+    await get_voice_session_jobs().shutdown()
+    get_voice_analysis_pool().shutdown()
 
 # 🔥 SERVIR ARCHIVOS ESTÁTICOS DEL FRONTEND
 #app.mount("/static", StaticFiles(directory="frontend"), name="static")
@@ -180,6 +266,20 @@ def _parse_cors_origins_env(var_name: str) -> list[str]:
 ALLOWED_ORIGINS = sorted(set([o.rstrip("/") for o in _default_allowed_origins] + _parse_cors_origins_env("CORS_ORIGINS")))
 ALLOWED_ORIGIN_REGEX = (os.getenv("CORS_ALLOW_ORIGIN_REGEX") or "").strip() or None
 
+# Máximo de Content-Length por ruta de subida (413 sin leer el cuerpo).
+# Las rutas con ráfagas de frames se agregan junto a sus endpoints.
+UPLOAD_ROUTE_LIMITS = {
+    "/face/register": FACE_UPLOAD_MAX_BYTES,
+    "/face/recognize": FACE_UPLOAD_MAX_BYTES,
+    "/face/recognize/check": FACE_UPLOAD_MAX_BYTES,
+    "/voice/transcribe": VOICE_UPLOAD_MAX_BYTES,
+    "/api/voice/analyze": VOICE_UPLOAD_MAX_BYTES,
+    "/api/voice/analyze-transcribe": VOICE_UPLOAD_MAX_BYTES,
+    "/api/voice/sessions": VOICE_UPLOAD_MAX_BYTES,
+}
+# Se registra antes que CORS para que las respuestas 413 también lleven las cabeceras CORS
+app.add_middleware(UploadLimitMiddleware, limits=UPLOAD_ROUTE_LIMITS)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,  # ✅ Solo orígenes específicos
@@ -193,8 +293,9 @@ app.add_middleware(
 # -----------------------------
 # INICIALIZAR RECONOCIMIENTO FACIAL
 # -----------------------------
-def get_face_service(db: Session = Depends(get_db)) -> FaceRecognitionService:
-    return FaceRecognitionService(db)
+def get_face_service() -> FaceRecognitionService:
+    # Motor único por worker; la sesión de BD se pasa a cada llamada
+    return get_face_recognition_service()
 
 try:
     transcription_service = TranscriptionService()
@@ -294,6 +395,33 @@ class SessionEndRequest(BaseModel):
 def health():
     return {"status": "ok"}
 
+
+@app.get("/health/ready")
+def health_ready():
+    """Readiness: 200 cuando el reconocimiento facial de este worker está caliente, 503 si no"""
+    readiness = face_readiness()
+    if readiness["status"] != "ready" and FACE_WARMUP:
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
+
+
+@app.get("/health/uploads")
+def health_uploads():
+    """Subidas de este worker: buffers reutilizados, spill a disco y picos de memoria"""
+    return upload_stats()
+
+
+@app.get("/health/face")
+def health_face(face_service: FaceRecognitionService = Depends(get_face_service)):
+    """Reconocimiento facial de este worker: galería (y deriva de prototipos), presencia y caché de encodings"""
+    return face_service.runtime_stats()
+
+
+@app.get("/health/voice")
+def health_voice():
+    """Cola de análisis de voz de este worker: en curso, rechazados (429), timeouts y cancelados"""
+    return {**get_voice_analysis_pool().stats(), "jobs": get_voice_session_jobs().stats()}
+
 # ============================================================
 #  LOGIN ADMINISTRADOR
 # ============================================================
@@ -579,14 +707,10 @@ async def register_face(
     if file.content_type not in ["image/jpeg", "image/png", "image/jpg"]:
         raise HTTPException(status_code=400, detail="Solo se aceptan imágenes JPEG o PNG")
 
-    contents = await file.read()
-    if len(contents) > 5 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="La imagen es demasiado grande (máximo 5MB)")
-    if len(contents) < 1000:
-        raise HTTPException(status_code=400, detail="La imagen es demasiado pequeña")
-
-    npimg = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
+    with await read_upload(file, FACE_UPLOAD_MAX_BYTES) as upload:
+        if upload.size < 1000:
+            raise HTTPException(status_code=400, detail="La imagen es demasiado pequeña")
+        frame = decode_frame(upload.view())
     if frame is None:
         raise HTTPException(status_code=400, detail="No se pudo procesar la imagen")
 
@@ -607,7 +731,8 @@ async def register_face(
     db.refresh(user)
 
     # 2) Registrar encoding con user.id
-    result = face_service.register(user.id, frame)
+    async with face_recognition_semaphore:
+        result = await run_in_threadpool(face_service.register, db, user.id, frame)
 
     if not result.get("success"):
         # Rollback lógico: borrar usuario si no se pudo registrar el rostro
@@ -756,11 +881,12 @@ from fastapi.concurrency import run_in_threadpool
 # Estos límites son por-proceso (por worker). Útil para evitar saturación de CPU/RAM
 # cuando varios usuarios envían análisis de voz/transcripción al mismo tiempo.
 FACE_RECOGNITION_CONCURRENCY = int(os.getenv("FACE_RECOGNITION_CONCURRENCY", "1"))
-VOICE_ANALYSIS_CONCURRENCY = int(os.getenv("VOICE_ANALYSIS_CONCURRENCY", "1"))
 VOICE_TRANSCRIBE_CONCURRENCY = int(os.getenv("VOICE_TRANSCRIBE_CONCURRENCY", "2"))
 
-face_recognition_semaphore = asyncio.Semaphore(max(1, FACE_RECOGNITION_CONCURRENCY))
-voice_analysis_semaphore = asyncio.Semaphore(max(1, VOICE_ANALYSIS_CONCURRENCY))
+# Con el pool de procesos (FACE_ENGINE_PROCESSES > 0) cada proceso tiene su propio detector,
+# así que se permiten tantas extracciones simultáneas como procesos.
+face_recognition_semaphore = asyncio.Semaphore(max(1, FACE_RECOGNITION_CONCURRENCY, FACE_ENGINE_PROCESSES))
+# El análisis de voz se acota en su propio pool (VOICE_ANALYSIS_CONCURRENCY + VOICE_ANALYSIS_QUEUE_MAX)
 voice_transcribe_semaphore = asyncio.Semaphore(max(1, VOICE_TRANSCRIBE_CONCURRENCY))
 
 @app.post("/face/recognize/check")
@@ -768,29 +894,211 @@ async def recognize_face_check(
     request: Request,
     file: UploadFile = File(...),
     expected_user_id: Optional[int] = Form(None),
+    session_key: Optional[str] = Form(None),
+    debug: bool = Form(False),
+    db: Session = Depends(get_db),
     face_service: FaceRecognitionService = Depends(get_face_service),
 ):
     if not file.content_type or not file.content_type.startswith("image/"):
         return {"found": False, "user": None, "confidence": 0}
 
-    file_bytes = await file.read()
-    if len(file_bytes) < 5000:
-        return {"found": False, "user": None, "confidence": 0}
-
-    np_img = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+    with await read_upload(file, FACE_UPLOAD_MAX_BYTES) as upload:
+        if upload.size < 5000:
+            return {"found": False, "user": None, "confidence": 0}
+        frame_key = content_key(upload.view())
+        np_img = decode_frame(upload.view())
     if np_img is None:
         return {"found": False, "user": None, "confidence": 0}
 
     # Face recognition usa librerías nativas (dlib/opencv/mediapipe) que pueden no ser thread-safe.
     # Limitamos concurrencia por worker para evitar crashes tipo "corrupted double-linked list".
     async with face_recognition_semaphore:
+        if expected_user_id is not None:
+            # Polls de presencia: seguimiento por (usuario, session_key). Sin session_key no hay
+            # atajo: detrás del proxy todos los clientes comparten IP y compartirían el seguimiento
+            return await run_in_threadpool(
+                face_service.check_presence,
+                db,
+                np_img,
+                expected_user_id,
+                session_key,
+                debug,
+                frame_key=frame_key,
+            )
         return await run_in_threadpool(
             face_service.recognize,
+            db,
             np_img,
             True,
             expected_user_id,
+            debug,
+            frame_key=frame_key,
         )
 
+# Máximo de frames por ráfaga en /face/recognize/batch
+FACE_BATCH_MAX_FRAMES = int(os.getenv("FACE_BATCH_MAX_FRAMES", "8"))
+UPLOAD_ROUTE_LIMITS["/face/recognize/batch"] = FACE_UPLOAD_MAX_BYTES * FACE_BATCH_MAX_FRAMES
+
+
+@app.post("/face/recognize/batch")
+async def recognize_face_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    expected_user_id: Optional[int] = Form(None),
+    fusion: str = Form("mean"),
+    debug: bool = Form(False),
+    db: Session = Depends(get_db),
+    face_service: FaceRecognitionService = Depends(get_face_service),
+):
+    """
+    Reconoce una ráfaga de N frames en un solo request.
+    Devuelve el resultado por frame y una decisión fusionada:
+    - fusion="mean": usuario con menor distancia media entre los frames válidos
+    - fusion="majority": usuario reconocido en más de la mitad de los frames válidos
+    """
+    if fusion not in ("mean", "majority"):
+        raise HTTPException(status_code=400, detail="fusion debe ser 'mean' o 'majority'")
+    if len(files) > FACE_BATCH_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"Máximo {FACE_BATCH_MAX_FRAMES} frames por ráfaga")
+
+    frames = []
+    frame_keys = []
+    for file in files:
+        if not file.content_type or not file.content_type.startswith("image/"):
+            continue
+        try:
+            upload = await read_upload(file, FACE_UPLOAD_MAX_BYTES)
+        except UploadTooLarge:
+            continue
+        with upload:
+            np_img = decode_frame(upload.view()) if upload.size >= 5000 else None
+            if np_img is not None:
+                frames.append(np_img)
+                frame_keys.append(content_key(upload.view()))
+
+    if not frames:
+        return {"found": False, "user": None, "confidence": 0, "frames": [], "skipped_frames": len(files)}
+
+    async with face_recognition_semaphore:
+        result = await run_in_threadpool(
+            face_service.recognize_batch,
+            db,
+            frames,
+            True,
+            expected_user_id,
+            fusion,
+            debug,
+            frame_keys,
+        )
+
+    result["skipped_frames"] = len(files) - len(frames)
+    return result
+
+
+# Máximo de frames por ráfaga en /face/enroll
+FACE_ENROLL_MAX_FRAMES = int(os.getenv("FACE_ENROLL_MAX_FRAMES", "12"))
+UPLOAD_ROUTE_LIMITS["/face/enroll"] = FACE_UPLOAD_MAX_BYTES * FACE_ENROLL_MAX_FRAMES
+
+
+def _payload_token(authorization: Optional[str]) -> dict:
+    """Payload del header 'Authorization: Bearer <token>' o 401"""
+    scheme, _, token = (authorization or "").partition(" ")
+    payload = decode_access_token(token.strip()) if scheme.lower() == "bearer" and token.strip() else None
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido o ausente",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return payload
+
+
+def _es_admin(payload: dict, db: Session) -> bool:
+    """El token dice admin y la cuenta sigue siendo admin en la BD"""
+    if not payload.get("is_admin"):
+        return False
+    return db.query(models.User).filter(
+        models.User.id == payload.get("user_id"),
+        models.User.is_admin == True
+    ).first() is not None
+
+
+def verificar_token_admin(authorization: Optional[str], db: Session) -> dict:
+    payload = _payload_token(authorization)
+    if not _es_admin(payload, db):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Acceso denegado")
+    return payload
+
+
+def verificar_token_usuario(authorization: Optional[str], user_id: int, db: Session) -> dict:
+    """
+    Valida el Bearer token: debe ser del propio usuario o de un admin activo.
+    Sin esto cualquiera podría agregar su rostro a otra cuenta y entrar como ella.
+    """
+    payload = _payload_token(authorization)
+    if payload.get("user_id") == user_id or _es_admin(payload, db):
+        return payload
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Acceso denegado")
+
+
+@app.get("/face/stats")
+def face_stats(
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    face_service: FaceRecognitionService = Depends(get_face_service),
+):
+    """Estadísticas del reconocimiento facial (usuarios enrolados + contadores del worker). Solo admin."""
+    verificar_token_admin(authorization, db)
+    return face_service.get_stats(db)
+
+
+@app.post("/face/enroll")
+async def enroll_face(
+    user_id: int = Form(...),
+    files: List[UploadFile] = File(...),
+    max_samples: Optional[int] = Form(None),
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    face_service: FaceRecognitionService = Depends(get_face_service),
+):
+    """
+    Enrola a un usuario existente con una ráfaga corta de frames:
+    se eligen las mejores muestras distintas (calidad) y se guardan en una sola transacción.
+    Requiere el token del propio usuario o de un admin (Authorization: Bearer).
+    """
+    verificar_token_usuario(authorization, user_id, db)
+
+    if len(files) > FACE_ENROLL_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"Máximo {FACE_ENROLL_MAX_FRAMES} frames por ráfaga")
+
+    frames = []
+    frame_keys = []
+    for file in files:
+        if file.content_type not in ["image/jpeg", "image/png", "image/jpg"]:
+            continue
+        try:
+            upload = await read_upload(file, FACE_UPLOAD_MAX_BYTES)
+        except UploadTooLarge:
+            continue
+        with upload:
+            np_img = decode_frame(upload.view()) if upload.size >= 1000 else None
+            if np_img is not None:
+                frames.append(np_img)
+                frame_keys.append(content_key(upload.view()))
+
+    if not frames:
+        raise HTTPException(status_code=400, detail="No se recibieron imágenes válidas")
+
+    kwargs = {"max_samples": max_samples} if max_samples else {}
+    async with face_recognition_semaphore:
+        result = await run_in_threadpool(face_service.enroll, db, user_id, frames, frame_keys=frame_keys, **kwargs)
+
+    if not result.get("success"):
+        raise HTTPException(status_code=400, detail=result.get("message", "No se pudo enrolar el rostro"))
+
+    result["skipped_frames"] = len(files) - len(frames)
+    return result
+
 # ============================================================
 # ENDPOINTS DE SESIONES (CORREGIDOS SIN ROUTER)
 # ============================================================
@@ -970,6 +1278,7 @@ async def check_active_session(user_id: int, db: Session = Depends(get_db)):
 async def recognize_face(
     request: Request,
     file: UploadFile = File(...),
+    debug: bool = Form(False),
     db: Session = Depends(get_db),
     face_service: FaceRecognitionService = Depends(get_face_service),
 ):
@@ -982,25 +1291,32 @@ async def recognize_face(
     if file.content_type not in ["image/jpeg", "image/png", "image/jpg"]:
         return {"found": False, "user": None, "confidence": 0}
 
-    file_bytes = await file.read()
-    if len(file_bytes) < 5000:
-        return {"found": False, "user": None, "confidence": 0}
-
-    np_img = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+    with await read_upload(file, FACE_UPLOAD_MAX_BYTES) as upload:
+        if upload.size < 5000:
+            return {"found": False, "user": None, "confidence": 0}
+        frame_key = content_key(upload.view())
+        np_img = decode_frame(upload.view())
     if np_img is None:
         return {"found": False, "user": None, "confidence": 0}
 
-    result = face_service.recognize(np_img)
+    async with face_recognition_semaphore:
+        result = await run_in_threadpool(
+            face_service.recognize, db, np_img, True, None, debug, frame_key=frame_key
+        )
 
     if not result.get("found"):
         return result
 
+    # Desglose por etapa (debug=true o FACE_PIPELINE_DEBUG=1)
+    timings = {"timings_ms": result["timings_ms"]} if "timings_ms" in result else {}
+
     if result.get("user") is None:
         return {
             "found": True,
             "user": None,
             "confidence": result.get("confidence", 0),
-            "new_user": True
+            "new_user": True,
+            **timings,
         }
 
     username = result["user"]
@@ -1025,7 +1341,8 @@ async def recognize_face(
         "user_id": user_id,
         "confidence": result.get("confidence", 0),
         "session_id": session.id,
-        "login_complete": True
+        "login_complete": True,
+        **timings,
     }
 
 # ============================================================
@@ -1162,7 +1479,7 @@ def register_face_live(
         if not ok or frame is None:
             return {"success": False, "message": "No se pudo acceder a la cámara"}
 
-        result = face_service.register(user_id, frame)
+        result = face_service.register(db, user_id, frame)
         return result
     finally:
         cap.release()
@@ -1380,7 +1697,9 @@ async def admin_delete_user(
 
     # ✅ En DB, face_encodings debe borrarse por ON DELETE CASCADE
     db.delete(user)
+    epoch = bump_gallery_epoch(db)
     db.commit()
+    get_face_gallery().remove_user(target_user_id, epoch)
 
     return {"success": True, "message": f"Usuario {user.full_name} eliminado"}
 
@@ -1424,14 +1743,156 @@ async def transcribe_audio(file: UploadFile = File(...)):
     if not transcription_service:
         raise HTTPException(status_code=500, detail="Servicio de transcripción no disponible")
     
-    audio_bytes = await file.read()
-
-    async with voice_transcribe_semaphore:
-        result = await run_in_threadpool(transcription_service.transcribe, audio_bytes)
+    with await read_upload(file, VOICE_UPLOAD_MAX_BYTES) as upload:
+        async with voice_transcribe_semaphore:
+            result = await run_in_threadpool(transcription_service.transcribe, upload.view())
     
     return result
 
 
+# Transcripción en tiempo real (por worker): duración máxima, silencio del cliente y conexiones simultáneas
+VOICE_STREAM_MAX_SECONDS = float(os.getenv("VOICE_STREAM_MAX_SECONDS", "30"))
+VOICE_STREAM_IDLE_SECONDS = float(os.getenv("VOICE_STREAM_IDLE_SECONDS", "10"))
+VOICE_STREAM_MAX_CONNECTIONS = int(os.getenv("VOICE_STREAM_MAX_CONNECTIONS", "4"))
+# Margen para que ffmpeg vacíe lo pendiente si el audio se cortó justo en el límite
+VOICE_STREAM_FLUSH_SECONDS = float(os.getenv("VOICE_STREAM_FLUSH_SECONDS", "2"))
+_voice_streams = 0
+
+
+@app.websocket("/voice/transcribe/stream")
+async def transcribe_stream(
+    websocket: WebSocket,
+    format: str = "webm",
+    sample_rate: int = 16000,
+    end_on_final: bool = False,
+):
+    """
+    Transcripción en tiempo real mientras el usuario habla.
+
+    Query params:
+    - format: "webm" u "ogg" (chunks de MediaRecorder, se decodifican con ffmpeg en streaming)
+      o "pcm16" (s16le mono a sample_rate)
+    - end_on_final: cierra en cuanto Vosk da la primera frase final (respuestas PHQ-9/GAD-7)
+
+    Cliente → servidor: mensajes binarios con audio; el texto "end" termina la grabación.
+    Servidor → cliente: {"type": "partial"|"final", "text"} y al terminar
+    {"type": "done", "text", "last", "seconds"}; si algo falla, {"type": "error", "detail"}.
+    """
+    global _voice_streams
+    await websocket.accept()
+
+    error = None
+    if not transcription_service:
+        error = "Servicio de transcripción no disponible"
+    elif format not in ("webm", "ogg", "pcm16") or not (8000 <= sample_rate <= 48000):
+        error = "Formato de audio no soportado"
+    elif _voice_streams >= VOICE_STREAM_MAX_CONNECTIONS:
+        error = "Demasiadas transcripciones en curso; reintenta en unos segundos"
+    if error:
+        await websocket.send_json({"type": "error", "detail": error})
+        await websocket.close(code=1013 if _voice_streams >= VOICE_STREAM_MAX_CONNECTIONS else 1011)
+        return
+
+    _voice_streams += 1
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + VOICE_STREAM_MAX_SECONDS
+    stream = transcription_service.stream(sample_rate if format == "pcm16" else AUDIO_SAMPLE_RATE)
+    decoder = None
+    reader = None
+    pending = set()
+    finished = asyncio.Event()
+
+    async def _reconocer(pcm: bytes):
+        evento = await run_in_threadpool(stream.accept, pcm)
+        if evento:
+            await websocket.send_json(evento)
+            if evento["type"] == "final" and end_on_final:
+                finished.set()
+
+    async def _a_tiempo(aw, timeout: float) -> bool:
+        """
+        Espera aw como mucho timeout segundos; si vence, mata ffmpeg. Un
+        asyncio.wait_for no basta: el hilo de run_in_threadpool no se cancela y
+        la espera seguiría colgada del pipe hasta que ffmpeg muera.
+
+        Returns:
+            True si terminó a tiempo
+        """
+        task = asyncio.ensure_future(aw)
+        done, _ = await asyncio.wait({task}, timeout=max(timeout, 0.0))
+        if task in done:
+            task.result()
+            return True
+        decoder.kill()
+        try:
+            # Con ffmpeg muerto write() falla y read() llega a b'' enseguida
+            await task
+        except Exception:
+            pass
+        return False
+
+    async def _leer_decoder():
+        # PCM que ffmpeg va produciendo → Vosk, hasta fin de stream o primera frase final
+        while not finished.is_set():
+            pcm = await run_in_threadpool(decoder.read, 8000)
+            if not pcm:
+                break
+            await _reconocer(pcm)
+
+    try:
+        if format != "pcm16":
+            decoder = await run_in_threadpool(StreamDecoder, format, AUDIO_SAMPLE_RATE)
+            reader = asyncio.ensure_future(_leer_decoder())
+
+        stop = asyncio.ensure_future(finished.wait())
+        pending.add(stop)
+        while True:
+            timeout = min(VOICE_STREAM_IDLE_SECONDS, deadline - loop.time())
+            if timeout <= 0:
+                break
+            recv = asyncio.ensure_future(websocket.receive())
+            pending.add(recv)
+            done, _ = await asyncio.wait({recv, stop}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if recv not in done:
+                break
+            pending.discard(recv)
+            message = recv.result()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                if decoder is not None:
+                    escrito = run_in_threadpool(decoder.write, message["bytes"])
+                    if not await _a_tiempo(escrito, deadline - loop.time()):
+                        print("⚠️ ffmpeg no aceptó audio antes del límite de la transcripción; se corta")
+                        break
+                else:
+                    await _reconocer(message["bytes"])
+            elif (message.get("text") or "").strip().lower() == "end":
+                break
+
+        if decoder is not None:
+            # Fin del audio: ffmpeg vacía lo pendiente y el lector termina
+            decoder.end()
+            if not await _a_tiempo(reader, max(deadline - loop.time(), VOICE_STREAM_FLUSH_SECONDS)):
+                print("⚠️ ffmpeg no terminó de decodificar antes del límite; se envía lo reconocido")
+        await websocket.send_json(await run_in_threadpool(stream.finish))
+        await websocket.close()
+
+    except WebSocketDisconnect:
+        pass
+    except AudioDecodeError as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1011)
+    finally:
+        _voice_streams -= 1
+        for task in pending:
+            task.cancel()
+        if decoder is not None:
+            await run_in_threadpool(decoder.close)
+        if reader is not None and not reader.done():
+            reader.cancel()
+
+
 @app.post("/voice/map-response")
 async def map_voice_response(text: str):
     """Mapear respuesta de voz a puntuación 0-3"""
@@ -1851,8 +2312,24 @@ async def get_exercise(
 # ENDPOINTS: ANÁLISIS DE VOZ
 # =====================
 
+async def _analizar_audio(audio, gender: str, request: Request, ruta_archivo: Optional[str] = None) -> dict:
+    """Análisis en el pool de voz; cola llena → 429 con Retry-After, vencido → 504"""
+    try:
+        return await get_voice_analysis_pool().analyze(
+            audio, gender, ruta_archivo, is_disconnected=request.is_disconnected
+        )
+    except VoiceQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except VoiceAnalysisTimeout:
+        raise HTTPException(status_code=504, detail="El análisis de voz tardó demasiado")
+    except VoiceJobCancelled:
+        # El cliente ya no está: el código solo queda en logs
+        raise HTTPException(status_code=499, detail="Cliente desconectado")
+
+
 @app.post("/api/voice/analyze")
 async def analyze_voice(
+    request: Request,
     audio_file: UploadFile = File(...),
     gender: str = Form("neutro")
 ):
@@ -1864,11 +2341,61 @@ async def analyze_voice(
     - gender: "masculino", "femenino" o "neutro"
     """
     try:
-        audio_bytes = await audio_file.read()
-        async with voice_analysis_semaphore:
-            resultado = await run_in_threadpool(procesar_audio_archivo, audio_bytes, gender)
+        with await read_upload(audio_file, VOICE_UPLOAD_MAX_BYTES) as upload:
+            resultado = await _analizar_audio(upload.view(), gender, request, upload.path)
         return resultado
-        
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error analizando audio: {str(e)}"
+        )
+
+
+@app.post("/api/voice/analyze-transcribe")
+async def analyze_and_transcribe_voice(
+    request: Request,
+    audio_file: UploadFile = File(...),
+    gender: str = Form("neutro")
+):
+    """
+    Biomarcadores vocales + transcripción de la misma grabación.
+
+    El audio se decodifica una sola vez a PCM 16kHz mono; ese PCM va al análisis
+    (como WAV float32, sin volver a pasar por ffmpeg) y a Vosk, en paralelo.
+    Si la transcripción no está disponible o falla, "transcription" viene en null
+    y el motivo en "transcription_error".
+    """
+    try:
+        with await read_upload(audio_file, VOICE_UPLOAD_MAX_BYTES) as upload:
+            pcm = await run_in_threadpool(cargar_pcm, upload.view(), AUDIO_SAMPLE_RATE, upload.path)
+        wav = wav_float32(pcm, AUDIO_SAMPLE_RATE)
+
+        async def _transcribir():
+            if not transcription_service:
+                raise RuntimeError("Servicio de transcripción no disponible")
+            async with voice_transcribe_semaphore:
+                return await run_in_threadpool(transcription_service.transcribe_pcm, pcm)
+
+        analisis, transcripcion = await asyncio.gather(
+            _analizar_audio(memoryview(wav), gender, request),
+            _transcribir(),
+            return_exceptions=True,
+        )
+        if isinstance(analisis, BaseException):
+            raise analisis
+
+        return {
+            "analysis": analisis,
+            "transcription": None if isinstance(transcripcion, BaseException) else transcripcion,
+            "transcription_error": str(transcripcion) if isinstance(transcripcion, BaseException) else None,
+            "duration_seconds": round(pcm.size / float(AUDIO_SAMPLE_RATE), 2),
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -1882,6 +2409,7 @@ async def analyze_voice(
 
 @app.post("/api/voice/sessions")
 async def create_voice_session(
+    request: Request,
     audio_file: UploadFile = File(...),
     user_id: int = Form(...),
     exercise_id: int = Form(...),
@@ -1889,6 +2417,7 @@ async def create_voice_session(
     gender: str = Form("neutro"),
     completed: bool = Form(True),
     notes: Optional[str] = Form(None),
+    async_analysis: bool = Form(False),
     db: Session = Depends(get_db)
 ):
     """
@@ -1902,6 +2431,8 @@ async def create_voice_session(
     - gender: Género del usuario para ajustar umbrales
     - completed: Si completó el ejercicio
     - notes: Notas adicionales (opcional)
+    - async_analysis: Si es true responde 202 con job_id enseguida y el análisis
+      se completa en segundo plano (consultar /api/voice/jobs/{job_id})
     """
     try:
         # Validar usuario
@@ -1917,67 +2448,53 @@ async def create_voice_session(
         if not exercise_row:
             raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
         
-        # Leer y analizar audio
-        audio_bytes = await audio_file.read()
-        async with voice_analysis_semaphore:
-            analisis = await run_in_threadpool(procesar_audio_archivo, audio_bytes, gender)
-
-        # Normalizar risk_level para que coincida con el Enum de BD
-        risk_raw = (analisis.get("risk_level") or "").strip()
-        risk_map = {
-            "LOW": models.VoiceRiskLevel.LOW,
-            "MODERATE": models.VoiceRiskLevel.MODERATE,
-            "HIGH": models.VoiceRiskLevel.HIGH,
-            "bajo": models.VoiceRiskLevel.LOW,
-            "moderado": models.VoiceRiskLevel.MODERATE,
-            "alto": models.VoiceRiskLevel.HIGH,
-        }
-        risk_level = risk_map.get(risk_raw)
-        
-        # Crear sesión en BD
         session = models.VoiceExerciseSession(
             user_id=user_id,
             exercise_id=exercise_id,
-            pitch_mean=analisis["pitch_mean"],
-            pitch_std=analisis["pitch_std"],
-            energy=analisis["energy"],
-            voice_ratio=analisis["voice_ratio"],
-            mfcc_variability=analisis["mfcc_variability"],
-            jitter=analisis["jitter"],
-            shimmer=analisis["shimmer"],
-            hnr=analisis["hnr"],
-            score=analisis["score"],
-            risk_level=risk_level,
             duration_seconds=duration_seconds,
             completed=completed,
             notes=notes
         )
-        
+
+        if async_analysis:
+            # Modo asíncrono: sesión pending + audio en disco, el análisis lo hace un worker
+            jobs = get_voice_session_jobs()
+            jobs.check_capacity()
+            with await read_upload(audio_file, VOICE_UPLOAD_MAX_BYTES) as upload:
+                jobs.assign(session)
+                db.add(session)
+                db.commit()
+                db.refresh(session)
+                try:
+                    await run_in_threadpool(guardar_audio, session.id, upload.view(), gender)
+                except Exception:
+                    db.delete(session)
+                    db.commit()
+                    raise
+            jobs.enqueue(session.id)
+            return JSONResponse(status_code=202, content={
+                "job_id": session.id,
+                "status": VOICE_JOB_PENDING,
+                "status_url": f"/api/voice/jobs/{session.id}",
+                "events_url": f"/api/voice/jobs/{session.id}/events",
+            })
+
+        # Leer y analizar audio
+        with await read_upload(audio_file, VOICE_UPLOAD_MAX_BYTES) as upload:
+            analisis = await _analizar_audio(upload.view(), gender, request, upload.path)
+
+        # Crear sesión en BD
+        aplicar_analisis(session, analisis)
         db.add(session)
         db.commit()
         db.refresh(session)
         
-        return {
-            "id": session.id,
-            "user_id": session.user_id,
-            "exercise_id": session.exercise_id,
-            "pitch_mean": session.pitch_mean,
-            "pitch_std": session.pitch_std,
-            "energy": session.energy,
-            "voice_ratio": session.voice_ratio,
-            "mfcc_variability": session.mfcc_variability,
-            "jitter": session.jitter,
-            "shimmer": session.shimmer,
-            "hnr": session.hnr,
-            "score": session.score,
-            "risk_level": session.risk_level.value if hasattr(session.risk_level, 'value') else session.risk_level,
-            "duration_seconds": session.duration_seconds,
-            "completed": session.completed,
-            "created_at": session.created_at.isoformat()
-        }
+        return sesion_a_dict(session)
         
     except HTTPException:
         raise
+    except VoiceQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         db.rollback()
         print(f"❌ ERROR COMPLETO: {e}")  # ← AGREGAR ESTA LÍNEA
@@ -2007,27 +2524,7 @@ async def get_user_voice_sessions(
         models.VoiceExerciseSession.created_at.desc()
     ).limit(limit).all()
     
-    return [
-        {
-            "id": s.id,
-            "user_id": s.user_id,
-            "exercise_id": s.exercise_id,
-            "pitch_mean": s.pitch_mean,
-            "pitch_std": s.pitch_std,
-            "energy": s.energy,
-            "voice_ratio": s.voice_ratio,
-            "mfcc_variability": s.mfcc_variability,
-            "jitter": s.jitter,
-            "shimmer": s.shimmer,
-            "hnr": s.hnr,
-            "score": s.score,
-            "risk_level": s.risk_level.value if hasattr(s.risk_level, 'value') else s.risk_level,
-            "duration_seconds": s.duration_seconds,
-            "completed": s.completed,
-            "created_at": s.created_at.isoformat()
-        }
-        for s in sessions
-    ]
+    return [sesion_a_dict(s) for s in sessions]
 
 
 @app.get("/api/voice/sessions/{session_id}")
@@ -2043,24 +2540,32 @@ async def get_voice_session(
     if not session:
         raise HTTPException(status_code=404, detail="Sesión no encontrada")
     
-    return {
-        "id": session.id,
-        "user_id": session.user_id,
-        "exercise_id": session.exercise_id,
-        "pitch_mean": session.pitch_mean,
-        "pitch_std": session.pitch_std,
-        "energy": session.energy,
-        "voice_ratio": session.voice_ratio,
-        "mfcc_variability": session.mfcc_variability,
-        "jitter": session.jitter,
-        "shimmer": session.shimmer,
-        "hnr": session.hnr,
-        "score": session.score,
-        "risk_level": session.risk_level.value if hasattr(session.risk_level, 'value') else session.risk_level,
-        "duration_seconds": session.duration_seconds,
-        "completed": session.completed,
-        "created_at": session.created_at.isoformat()
-    }
+    return sesion_a_dict(session)
+
+
+@app.get("/api/voice/jobs/{job_id}")
+async def get_voice_job(
+    job_id: int,
+    db: Session = Depends(get_db)
+):
+    """
+    Estado de una sesión creada con async_analysis: pending, processing, done o failed.
+    Con done incluye la sesión completa; con failed, el error.
+    """
+    estado = estado_job(db, job_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    return estado
+
+
+@app.get("/api/voice/jobs/{job_id}/events")
+async def stream_voice_job(job_id: int, request: Request):
+    """Server-Sent Events con el estado del trabajo; se cierra al llegar a done o failed"""
+    return StreamingResponse(
+        eventos_job(job_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # =====================
@@ -2193,6 +2698,9 @@ async def get_user_voice_stats(
             models.VoiceExerciseSession.created_at.desc()
         ).all()
 
+        # Las sesiones con análisis pendiente o fallido no entran en promedios ni riesgo
+        sessions = [s for s in sessions if s.analysis_status == "done"]
+
         if not sessions:
             return {
                 "user_id": user_id,
@@ -2203,6 +2711,8 @@ async def get_user_voice_stats(
                     "completed_sessions": 0,
                     "total_duration": 0,
                     "avg_pitch": 0,
+                    "pitch_engine": F0_ENGINE,
+                    "pitch_sessions_excluded": 0,
                     "avg_energy": 0,
                     "avg_hnr": 0,
                     "avg_score": 0,
@@ -2225,7 +2735,12 @@ async def get_user_voice_stats(
         # --------------------------------------------------
         # PROMEDIOS SEGUROS
         # --------------------------------------------------
-        valid_pitch = [s.pitch_mean for s in sessions if s.pitch_mean is not None]
+        # El pitch solo se promedia entre sesiones del motor de F0 actual: las de otro
+        # motor (o legacy, pitch_engine NULL) están en otra escala
+        valid_pitch = [s.pitch_mean for s in sessions
+                       if s.pitch_mean is not None and s.pitch_engine == F0_ENGINE]
+        pitch_excluded = len([s for s in sessions
+                              if s.pitch_mean is not None and s.pitch_engine != F0_ENGINE])
         valid_energy = [s.energy for s in sessions if s.energy is not None]
         valid_hnr = [s.hnr for s in sessions if s.hnr is not None]
         valid_score = [s.score for s in sessions if s.score is not None]
@@ -2262,6 +2777,7 @@ async def get_user_voice_stats(
                 "exercise_id": s.exercise_id,
                 "pitch_mean": round(float(s.pitch_mean or 0.0), 2),
                 "pitch_std": round(float(s.pitch_std or 0.0), 2),
+                "pitch_engine": s.pitch_engine or "legacy",
                 "energy": round(float(s.energy or 0.0), 4),
                 "voice_ratio": round(float(s.voice_ratio or 0.0), 4),
                 "hnr": round(float(s.hnr or 0.0), 2),
@@ -2286,6 +2802,8 @@ async def get_user_voice_stats(
                 "completed_sessions": completed_sessions,
                 "total_duration": total_duration,
                 "avg_pitch": round(avg_pitch, 2),
+                "pitch_engine": F0_ENGINE,
+                "pitch_sessions_excluded": pitch_excluded,
                 "avg_energy": round(avg_energy, 4),
                 "avg_hnr": round(avg_hnr, 2),
                 "avg_score": round(avg_score, 2),
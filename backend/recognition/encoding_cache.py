@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# =====================================================
+#  ENCODING CACHE - LRU + TTL delante de la extracción
+#  Reintentos, polling de Welcome y doble submit mandan
+#  el mismo frame: se reutiliza el encoding ya calculado
+# =====================================================
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+from backend.recognition.image_preprocess import dhash_bits
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# 0 entradas = caché deshabilitado
+CACHE_MAX_ENTRIES = max(0, _env_int("FACE_CACHE_MAX_ENTRIES", 1024))
+CACHE_TTL_SECONDS = _env_float("FACE_CACHE_TTL_SECONDS", 30.0)
+# Clave adicional por hash perceptual del frame decodificado (frames casi idénticos
+# re-codificados por el navegador). Apagado por defecto: frames distintos pero
+# muy parecidos comparten encoding.
+CACHE_PERCEPTUAL = (os.getenv("FACE_CACHE_PERCEPTUAL") or "0").strip() == "1"
+
+# Estados que dependen solo del contenido del frame (timeout no se cachea)
+_CACHEABLE_STATUS = {"ok", "low_quality", "no_face", "no_face_crop", "no_encoding"}
+
+
+def content_key(data: bytes) -> str:
+    """Hash rápido de los bytes subidos (BLAKE2b, 128 bits)"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_key(frame: np.ndarray, size: int = 16) -> str:
+    """dHash de size x size bits sobre el frame gris reducido"""
+    return np.packbits(dhash_bits(frame, size)).tobytes().hex()
+
+
+class EncodingCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 perceptual: bool = CACHE_PERCEPTUAL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.perceptual = perceptual
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def keys_for(self, frame_key: Optional[str], frame: Optional[np.ndarray],
+                 require_quality_check: bool) -> List[Hashable]:
+        """Claves del frame: hash de bytes y, si está activo, hash perceptual"""
+        if not self.enabled:
+            return []
+        keys: List[Hashable] = []
+        if frame_key:
+            keys.append(("bytes", frame_key, require_quality_check))
+        if self.perceptual and frame is not None:
+            keys.append(("dhash", perceptual_key(frame), require_quality_check))
+        return keys
+
+    def get(self, keys: List[Hashable]) -> Optional[Dict]:
+        if not keys:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                stored_at, extraction = entry
+                if now - stored_at > self.ttl_seconds:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(extraction)
+            self.misses += 1
+            return None
+
+    def put(self, keys: List[Hashable], extraction: Dict) -> None:
+        if not keys or extraction.get("status") not in _CACHEABLE_STATUS:
+            return
+        # Solo lo que sirve para decidir; los tiempos por etapa no se reutilizan
+        entry = (time.monotonic(), {
+            "status": extraction["status"],
+            "encoding": extraction.get("encoding"),
+            "quality_info": extraction.get("quality_info"),
+        })
+        with self._lock:
+            for key in keys:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "perceptual": self.perceptual,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_cache = EncodingCache()
+
+
+def get_encoding_cache() -> EncodingCache:
+    """Caché compartido por todo el proceso (un worker de uvicorn)"""
+    return _cache
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# =====================================================
+#  FORMATO DE ALMACENAMIENTO DE ENCODINGS
+#  1.0     -> JSON array de 128 floats (encoding_data, legacy)
+#  2.0-f32 -> 128 float32 little-endian = 512 bytes (encoding_blob)
+# =====================================================
+
+import os
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+ENCODING_DIM = 128
+ENCODING_DTYPE = np.dtype("<f4")
+ENCODING_BYTES = ENCODING_DIM * ENCODING_DTYPE.itemsize  # 512
+
+ENCODING_VERSION_JSON = "1.0"
+ENCODING_VERSION_F32 = "2.0-f32"
+
+# Durante el rollover se sigue escribiendo también el JSON legacy para que
+# los workers con la versión anterior puedan leer las filas nuevas.
+# Poner FACE_ENCODING_WRITE_JSON=0 cuando todos los workers lean encoding_blob.
+WRITE_LEGACY_JSON = (os.getenv("FACE_ENCODING_WRITE_JSON", "1").strip().lower() in {"1", "true", "yes"})
+
+
+def pack_encoding(encoding: np.ndarray) -> bytes:
+    """Serializa un encoding de 128 dimensiones a 512 bytes float32"""
+    arr = np.asarray(encoding, dtype=ENCODING_DTYPE).reshape(ENCODING_DIM)
+    return arr.tobytes()
+
+
+def unpack_encoding(blob: bytes) -> np.ndarray:
+    """Vista float32 (sin copia, solo lectura) sobre un blob de 512 bytes"""
+    if blob is None or len(blob) != ENCODING_BYTES:
+        raise ValueError(f"Blob de encoding inválido ({0 if blob is None else len(blob)} bytes)")
+    return np.frombuffer(blob, dtype=ENCODING_DTYPE)
+
+
+def is_packed(blob: Optional[bytes]) -> bool:
+    return blob is not None and len(blob) == ENCODING_BYTES
+
+
+def unpack_many(blobs: Sequence[bytes]) -> np.ndarray:
+    """
+    Une N blobs en una sola matriz [N, 128] float32.
+    Hay una única copia (el join); la matriz es una vista de solo lectura sobre ese buffer.
+    """
+    if not blobs:
+        return np.empty((0, ENCODING_DIM), dtype=ENCODING_DTYPE)
+    return np.frombuffer(b"".join(blobs), dtype=ENCODING_DTYPE).reshape(len(blobs), ENCODING_DIM)
+
+
+def encoding_columns(encoding: np.ndarray) -> dict:
+    """Valores de columnas para crear/actualizar un FaceEncoding en el formato actual"""
+    values = {
+        "encoding_blob": pack_encoding(encoding),
+        "encoding_version": ENCODING_VERSION_F32,
+    }
+    if WRITE_LEGACY_JSON:
+        values["encoding_data"] = np.asarray(encoding, dtype=np.float64).tolist()
+    return values
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# =====================================================
+#  FACE ENGINE POOL - Reconocimiento en procesos aparte
+#  Cada proceso tiene su propio FaceDetection (MediaPipe)
+#  y modelos dlib, así no se comparte el lock global.
+#  Los frames viajan por memoria compartida.
+# =====================================================
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# Nº de procesos del pool por worker de uvicorn. 0 = deshabilitado (todo en el proceso web).
+FACE_ENGINE_PROCESSES = max(0, _env_int("FACE_ENGINE_PROCESSES", 0))
+FACE_ENGINE_TIMEOUT_SECONDS = max(1, _env_int("FACE_ENGINE_TIMEOUT_SECONDS", 30))
+
+
+# ============================================================
+# Lado del proceso hijo
+# ============================================================
+_worker_pipeline = None
+
+
+def _init_worker():
+    """Inicializa el pipeline del proceso (los modelos dlib se cargan al importar face_recognition)"""
+    global _worker_pipeline
+    from backend.recognition.face_extraction import FacePipeline, create_face_detector
+
+    _worker_pipeline = FacePipeline(create_face_detector())
+    _worker_pipeline.warm_up()
+
+
+def _on_shared_frame(shm_name: str, shape: tuple, dtype: str, fn):
+    """fn(frame) sobre la vista en memoria compartida"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        result = fn(frame)
+        # Nada del resultado puede seguir apuntando al buffer compartido
+        del frame
+    finally:
+        shm.close()
+    return result
+
+
+def _extract_in_worker(shm_name: str, shape: tuple, dtype: str, require_quality_check: bool,
+                       debug: bool = False, detection: Optional[Dict] = None) -> Dict:
+    result = _on_shared_frame(
+        shm_name, shape, dtype,
+        lambda frame: _worker_pipeline.run(frame, require_quality_check, debug, detection=detection),
+    )
+
+    encoding = result.get("encoding")
+    if encoding is not None:
+        result["encoding"] = np.asarray(encoding, dtype=np.float64).copy()
+    return result
+
+
+def _describe_in_worker(shm_name: str, shape: tuple, dtype: str) -> Optional[Dict]:
+    return _on_shared_frame(shm_name, shape, dtype, _worker_pipeline.describe)
+
+
+# ============================================================
+# Lado del proceso web
+# ============================================================
+class FaceEnginePool:
+    def __init__(self, processes: int):
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: MediaPipe crea threads internos, fork después de eso no es seguro
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=get_context("spawn"),
+                    initializer=_init_worker,
+                )
+                print(f"✅ Pool de reconocimiento facial: {self.processes} procesos")
+            return self._executor
+
+    def _reset(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, frame: np.ndarray, require_quality_check: bool = True, debug: bool = False,
+                detection: Optional[Dict] = None) -> Dict:
+        """Igual que face_extraction.FacePipeline.run, pero en un proceso del pool"""
+        return self._map(_extract_in_worker, [frame], require_quality_check, debug, detection)[0]
+
+    def extract_many(self, frames: List[np.ndarray], require_quality_check: bool = True,
+                     debug: bool = False) -> List[Dict]:
+        """Reparte varios frames entre los procesos del pool; resultados en el mismo orden"""
+        return self._map(_extract_in_worker, frames, require_quality_check, debug)
+
+    def describe(self, frame: np.ndarray) -> Optional[Dict]:
+        """Igual que face_extraction.FacePipeline.describe, pero en un proceso del pool"""
+        return self._map(_describe_in_worker, [frame])[0]
+
+    def _map(self, fn, frames: List[np.ndarray], *args) -> List:
+        """Ejecuta fn(shm_name, shape, dtype, *args) por frame en el pool"""
+        frames = [np.ascontiguousarray(f) for f in frames]
+        segments = []
+        try:
+            for frame in frames:
+                shm = shared_memory.SharedMemory(create=True, size=max(1, frame.nbytes))
+                segments.append(shm)
+                np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)[...] = frame
+
+            for attempt in range(2):
+                executor = self._get_executor()
+                deadline = time.monotonic() + FACE_ENGINE_TIMEOUT_SECONDS
+                try:
+                    futures = [
+                        executor.submit(fn, shm.name, frame.shape, frame.dtype.str, *args)
+                        for shm, frame in zip(segments, frames)
+                    ]
+                    return [
+                        f.result(timeout=max(0.0, deadline - time.monotonic()))
+                        for f in futures
+                    ]
+                except BrokenProcessPool:
+                    # Un proceso murió (p.ej. crash nativo): se recrea el pool y se reintenta una vez
+                    print("⚠️ Pool de reconocimiento roto; recreando procesos")
+                    self._reset(executor)
+                    if attempt == 1:
+                        raise
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+    def warm_up(self) -> None:
+        """Arranca todos los procesos (detector + encode de prueba en cada uno) sin esperar al primer request"""
+        executor = self._get_executor()
+        futures = [executor.submit(os.getpid) for _ in range(self.processes)]
+        for f in futures:
+            f.result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool: Optional[FaceEnginePool] = FaceEnginePool(FACE_ENGINE_PROCESSES) if FACE_ENGINE_PROCESSES > 0 else None
+
+
+def get_face_engine_pool() -> Optional[FaceEnginePool]:
+    """Pool del worker actual, o None si FACE_ENGINE_PROCESSES=0"""
+    return _pool
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+# =====================================================
+#  FACE EXTRACTION - Detección, alineación y encoding
+#  Sin dependencias de BD: se usa tanto en el proceso
+#  web como en los procesos del pool de reconocimiento
+# =====================================================
+
+import os
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+import face_recognition
+from mediapipe import solutions as mp_solutions
+from typing import Dict, List, Optional, Tuple
+
+from backend.recognition.image_preprocess import DETECT_MAX_SIDE, QUALITY_MAX_SIDE, dhash_bits, downscale
+
+
+# Alineación y localización del rostro para el encoding dentro del recorte:
+#   hog       : ojos por landmarks dlib (align_face) + nueva detección HOG; mismo
+#               pipeline con el que se enroló la galería existente (por defecto)
+#   mediapipe : ojos y caja de MediaPipe (sin landmarks dlib ni segunda pasada HOG);
+#               más rápido, pero los encodings se desplazan respecto de la galería:
+#               medir con backend.benchmarks.bench_alignment antes de activarlo
+PIPELINE_LOCATOR = (os.getenv("FACE_PIPELINE_LOCATOR") or "hog").strip().lower()
+# Incluye "timings_ms" por etapa en las respuestas aunque el request no lo pida
+PIPELINE_DEBUG = (os.getenv("FACE_PIPELINE_DEBUG") or "0").strip() == "1"
+# Enrolamiento por ráfaga: muestras a guardar y diferencia mínima (bits dHash 16x16) entre ellas
+ENROLL_MAX_SAMPLES = max(1, int(os.getenv("FACE_ENROLL_MAX_SAMPLES", "5")))
+ENROLL_MIN_HASH_DISTANCE = max(0, int(os.getenv("FACE_ENROLL_MIN_HASH_DISTANCE", "6")))
+
+
+def _landmark_eyes(image) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Centros de los ojos (izquierda/derecha de la imagen) según los landmarks de dlib"""
+    landmarks = face_recognition.face_landmarks(image)
+
+    if len(landmarks) == 0:
+        return None
+
+    left_eye = landmarks[0].get("left_eye")
+    right_eye = landmarks[0].get("right_eye")
+
+    if not left_eye or not right_eye:
+        return None
+
+    return np.mean(left_eye, axis=0), np.mean(right_eye, axis=0)
+
+
+def _eye_rotation(left_center, right_center) -> np.ndarray:
+    """Matriz afín 2x3 que deja la línea de los ojos horizontal (centro en el ojo izquierdo)"""
+    left_center = (int(left_center[0]), int(left_center[1]))
+    right_center = (int(right_center[0]), int(right_center[1]))
+
+    dy = right_center[1] - left_center[1]
+    dx = right_center[0] - left_center[0]
+    angle = np.degrees(np.arctan2(dy, dx))
+
+    return cv2.getRotationMatrix2D(left_center, angle, 1.0)
+
+
+def align_face(image):
+    """Alinea el rostro basándose en la posición de los ojos"""
+    eyes = _landmark_eyes(image)
+
+    if eyes is None:
+        return image
+
+    rot_matrix = _eye_rotation(*eyes)
+    aligned = cv2.warpAffine(
+        image,
+        rot_matrix,
+        (image.shape[1], image.shape[0]),
+        flags=cv2.INTER_LINEAR
+    )
+    return aligned
+
+
+def enhance_image(image):
+    """Mejora la calidad de la imagen"""
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    image = cv2.convertScaleAbs(image, alpha=1.15, beta=6)
+    return image
+
+
+# Calidad: registro estructurado por frame (assess_image_quality_records)
+QUALITY_DTYPE = np.dtype([
+    ("score", np.int32),
+    ("brightness", np.float64),
+    ("sharpness", np.float64),
+    ("contrast", np.float64),
+    ("width", np.int32),
+    ("height", np.int32),
+    ("issues", np.uint8),       # máscara de bits, ver QUALITY_ISSUES
+    ("is_acceptable", np.bool_),
+])
+
+QUALITY_ISSUES = (
+    (1, "Imagen muy oscura"),
+    (2, "Imagen muy brillante"),
+    (4, "Imagen borrosa o desenfocada"),
+    (8, "Contraste muy bajo"),
+    (16, "Imagen muy pequeña"),
+)
+
+
+def _mean_var(image: np.ndarray) -> Tuple[float, float]:
+    """Media y varianza con sumElems + NORM_L2SQR (exactas en double para uint8/int16)"""
+    n = image.size
+    mean = cv2.sumElems(image)[0] / n
+    return mean, max(cv2.norm(image, cv2.NORM_L2SQR) / n - mean * mean, 0.0)
+
+
+def _gray_metrics(frame: np.ndarray) -> Tuple[float, float, float]:
+    """
+    (brillo, contraste, nitidez) de un frame: media y desvío del gris y varianza
+    del Laplaciano (kernel 4-vecinos, como cv2.Laplacian)
+    """
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    mean, var = _mean_var(gray)
+    # uint8 → CV_16S alcanza (|lap| <= 1020) y es varias veces más rápido que CV_64F
+    depth = cv2.CV_16S if gray.dtype == np.uint8 else cv2.CV_64F
+    _, lap_var = _mean_var(cv2.Laplacian(gray, depth))
+    return mean, var ** 0.5, lap_var
+
+
+def assess_image_quality_records(frames: List[np.ndarray], max_side: int = QUALITY_MAX_SIDE) -> np.ndarray:
+    """
+    Calidad de varios frames en un registro estructurado. Las métricas se miden
+    frame a frame (gris, Laplaciano y reducciones de OpenCV: cada una es una
+    pasada SIMD y apilar la ráfaga solo agrega copias); umbrales, issues y score
+    se calculan vectorizados sobre el registro.
+
+    Por defecto (FACE_QUALITY_MAX_SIDE=0) las métricas se miden a la resolución
+    del frame, que es como se calibraron los umbrales. Con max_side > 0 se miden
+    sobre una copia reducida: la varianza del Laplaciano no escala de forma
+    predecible (depende del contenido), así que el umbral de nitidez deja de
+    ser comparable.
+
+    Returns:
+        Array estructurado [n] con dtype QUALITY_DTYPE (ver quality_info para el dict)
+    """
+    out = np.zeros(len(frames), dtype=QUALITY_DTYPE)
+    if not frames:
+        return out
+
+    for i, frame in enumerate(frames):
+        out["brightness"][i], out["contrast"][i], out["sharpness"][i] = _gray_metrics(downscale(frame, max_side))
+    out["height"] = [f.shape[0] for f in frames]
+    out["width"] = [f.shape[1] for f in frames]
+
+    # Brillo (óptimo: 80-180), nitidez (óptimo: > 100), contraste (óptimo: > 30), tamaño (mínimo: 200x200)
+    dark = out["brightness"] < 60
+    bright = out["brightness"] > 200
+    blurry = out["sharpness"] < 50
+    flat = out["contrast"] < 20
+    tiny = (out["width"] < 200) | (out["height"] < 200)
+
+    out["issues"] = dark * 1 + bright * 2 + blurry * 4 + flat * 8 + tiny * 16
+    out["score"] = 25 * (~(dark | bright)).astype(np.int32) + 25 * (~blurry) + 25 * (~flat) + 25 * (~tiny)
+    out["is_acceptable"] = out["score"] >= 50
+    return out
+
+
+def quality_info(record) -> Dict[str, any]:
+    """Registro de assess_image_quality_records → dict de assess_image_quality"""
+    return {
+        "score": int(record["score"]),
+        "brightness": float(record["brightness"]),
+        "sharpness": float(record["sharpness"]),
+        "contrast": float(record["contrast"]),
+        "size": (int(record["width"]), int(record["height"])),
+        "issues": [message for bit, message in QUALITY_ISSUES if int(record["issues"]) & bit],
+        "is_acceptable": bool(record["is_acceptable"]),
+    }
+
+
+def assess_image_quality(frame, max_side: int = QUALITY_MAX_SIDE) -> Dict[str, any]:
+    """
+    Evalúa la calidad de la imagen para reconocimiento facial.
+    Las métricas se calculan a la resolución del frame salvo que max_side > 0
+    (ver assess_image_quality_records); el tamaño, siempre sobre el frame completo.
+    """
+    return quality_info(assess_image_quality_records([frame], max_side)[0])
+
+
+def select_enrollment_frames(frames: List[np.ndarray], k: int = ENROLL_MAX_SAMPLES,
+                             min_hash_distance: int = ENROLL_MIN_HASH_DISTANCE) -> Tuple[List[int], List[Dict]]:
+    """
+    Elige hasta k frames para enrolar: solo los aceptables, ordenados por calidad
+    (score, nitidez, cercanía a brillo 130) y descartando los casi idénticos a uno
+    ya elegido (distancia de Hamming del dHash < min_hash_distance).
+
+    Returns:
+        (índices elegidos, en orden de calidad; quality_info de cada frame)
+    """
+    records = assess_image_quality_records(frames)
+    qualities = [quality_info(r) for r in records]
+    if not qualities:
+        return [], qualities
+
+    # lexsort: la última clave es la principal
+    order = np.lexsort((np.abs(records["brightness"] - 130.0), -records["sharpness"], -records["score"]))
+    order = order[records["is_acceptable"][order]]
+
+    chosen: List[int] = []
+    chosen_hashes: List[np.ndarray] = []
+    for i in order:
+        bits = dhash_bits(frames[i])
+        if chosen_hashes and int(np.min(np.count_nonzero(np.stack(chosen_hashes) != bits, axis=1))) < min_hash_distance:
+            continue
+        chosen.append(int(i))
+        chosen_hashes.append(bits)
+        if len(chosen) >= k:
+            break
+    return chosen, qualities
+
+
+# ============================================================
+# Detector y extracción de encoding
+# ============================================================
+def create_face_detector():
+    """Detector MediaPipe (no thread-safe: un detector por proceso o protegido por lock)"""
+    return mp_solutions.face_detection.FaceDetection(
+        model_selection=1,
+        min_detection_confidence=0.6
+    )
+
+
+def _detect(detector, frame, detector_lock=None, max_side: int = DETECT_MAX_SIDE) -> Optional[Dict]:
+    """
+    Detección MediaPipe del rostro principal. MediaPipe corre sobre una copia
+    reducida a max_side; como sus coordenadas son relativas, se proyectan
+    directamente a píxeles del frame completo:
+    - box: caja del detector (x1, y1, x2, y2)
+    - crop: caja expandida 40px usada para el recorte
+    - eyes: centros de los ojos (izquierda/derecha de la imagen) o None
+    """
+    rgb = cv2.cvtColor(downscale(frame, max_side), cv2.COLOR_BGR2RGB)
+    if detector_lock is not None:
+        with detector_lock:
+            results = detector.process(rgb)
+    else:
+        results = detector.process(rgb)
+
+    if not results.detections:
+        return None
+
+    h, w, _ = frame.shape
+    location = results.detections[0].location_data
+    box = location.relative_bounding_box
+
+    x1 = int(box.xmin * w)
+    y1 = int(box.ymin * h)
+    x2 = int((box.xmin + box.width) * w)
+    y2 = int((box.ymin + box.height) * h)
+
+    expand = 40
+    crop = (max(0, x1 - expand), max(0, y1 - expand), min(w, x2 + expand), min(h, y2 + expand))
+    if crop[2] <= crop[0] or crop[3] <= crop[1]:
+        return None
+
+    # Keypoints 0/1 = ojo derecho/izquierdo del sujeto (izquierda/derecha en la imagen)
+    eyes = None
+    keypoints = location.relative_keypoints
+    if len(keypoints) >= 2:
+        eyes = (
+            np.array([keypoints[0].x * w, keypoints[0].y * h]),
+            np.array([keypoints[1].x * w, keypoints[1].y * h]),
+        )
+
+    return {"box": (x1, y1, x2, y2), "crop": crop, "eyes": eyes}
+
+
+def detect_face(detector, frame, detector_lock=None):
+    """Recorta el rostro principal (caja MediaPipe expandida 40px). None si no hay rostro."""
+    detection = _detect(detector, frame, detector_lock)
+    if detection is None:
+        return None
+
+    x1, y1, x2, y2 = detection["crop"]
+    return frame[y1:y2, x1:x2]
+
+
+def presence_descriptor(frame, box, size: int = 32) -> Optional[np.ndarray]:
+    """
+    Descriptor barato del rostro: parche gris size x size de la caja, centrado y
+    normalizado (norma 1). El producto punto entre dos descriptores es su NCC.
+    """
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = box
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+    if x2 - x1 < 8 or y2 - y1 < 8:
+        return None
+
+    gray = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    patch = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    patch -= patch.mean()
+    norm = float(np.linalg.norm(patch))
+    if norm < 1e-6:
+        return None
+    return patch / norm
+
+
+# ============================================================
+# Pipeline de un frame
+# ============================================================
+@contextmanager
+def _stage(timings: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000.0, 2)
+
+
+class FacePipeline:
+    """
+    calidad → detección (MediaPipe) → mejora → alineación → localización → encoding
+
+    Con locator="mediapipe" la caja y los ojos de MediaPipe se reutilizan en las
+    etapas siguientes: la alineación no calcula landmarks dlib y la caja rotada
+    se pasa directo a face_encodings. Con "hog" se alinea y localiza como antes.
+    """
+
+    def __init__(self, detector, detector_lock=None, locator: str = PIPELINE_LOCATOR):
+        self.detector = detector
+        self.detector_lock = detector_lock
+        self.locator = locator
+
+    def _align(self, face_rgb: np.ndarray, detection: Dict) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Rota el recorte con los ojos de MediaPipe (locator mediapipe) o de los landmarks dlib"""
+        x1, y1 = detection["crop"][:2]
+        eyes = detection["eyes"] if self.locator == "mediapipe" else None
+        if eyes is not None and eyes[1][0] > eyes[0][0]:
+            offset = np.array([x1, y1])
+            eyes = (eyes[0] - offset, eyes[1] - offset)
+        else:
+            eyes = _landmark_eyes(face_rgb)
+
+        if eyes is None:
+            return face_rgb, None
+
+        rot_matrix = _eye_rotation(*eyes)
+        aligned = cv2.warpAffine(
+            face_rgb,
+            rot_matrix,
+            (face_rgb.shape[1], face_rgb.shape[0]),
+            flags=cv2.INTER_LINEAR
+        )
+        return aligned, rot_matrix
+
+    def _locate(self, face_aligned: np.ndarray, detection: Dict,
+                rot_matrix: Optional[np.ndarray]) -> Optional[Tuple[int, int, int, int]]:
+        """Caja (top, right, bottom, left) del rostro dentro del recorte alineado"""
+        if self.locator == "hog":
+            locations = face_recognition.face_locations(face_aligned, model="hog")
+            return locations[0] if locations else None
+
+        cx, cy = detection["crop"][:2]
+        x1, y1, x2, y2 = detection["box"]
+        corners = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float64) - (cx, cy)
+        if rot_matrix is not None:
+            corners = corners @ rot_matrix[:, :2].T + rot_matrix[:, 2]
+
+        h, w = face_aligned.shape[:2]
+        left, top = np.floor(corners.min(axis=0)).astype(int)
+        right, bottom = np.ceil(corners.max(axis=0)).astype(int)
+        left, top = max(0, left), max(0, top)
+        right, bottom = min(w, right), min(h, bottom)
+        if right - left < 20 or bottom - top < 20:
+            return None
+        return (int(top), int(right), int(bottom), int(left))
+
+    def describe(self, frame) -> Optional[Dict]:
+        """
+        Solo detección MediaPipe + descriptor barato (sin dlib), para el seguimiento
+        de presencia. None si no hay rostro.
+        """
+        detection = _detect(self.detector, frame, self.detector_lock)
+        if detection is None:
+            return None
+        descriptor = presence_descriptor(frame, detection["box"])
+        if descriptor is None:
+            return None
+        return {"detection": detection, "descriptor": descriptor}
+
+    def warm_up(self) -> None:
+        """Primera inferencia de MediaPipe y dlib con un frame sintético (grafos y modelos en memoria)"""
+        frame = np.full((240, 320, 3), 128, dtype=np.uint8)
+        _detect(self.detector, frame, self.detector_lock)
+        face_recognition.face_encodings(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), [(40, 240, 200, 80)])
+
+    def _prepare(self, frame, require_quality_check: bool, timings: Dict[str, float],
+                 detection: Optional[Dict] = None):
+        """
+        Etapas previas al encoding.
+
+        Returns:
+            (status, quality, recorte alineado, location); status es None si el
+            frame está listo para el encoder
+        """
+        quality = None
+        if require_quality_check:
+            with _stage(timings, "quality"):
+                quality = assess_image_quality(frame)
+            if not quality["is_acceptable"]:
+                return "low_quality", quality, None, None
+
+        # ✅ detección rápida con MediaPipe (caja + ojos)
+        with _stage(timings, "detect"):
+            if detection is None:
+                detection = _detect(self.detector, frame, self.detector_lock)
+        if detection is None:
+            return "no_face", quality, None, None
+
+        # ✅ mismo pipeline para registro y reconocimiento
+        with _stage(timings, "enhance"):
+            x1, y1, x2, y2 = detection["crop"]
+            face_img = enhance_image(frame[y1:y2, x1:x2])
+            face_rgb = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
+
+        with _stage(timings, "align"):
+            face_aligned, rot_matrix = self._align(face_rgb, detection)
+
+        # el encoding se hace sobre un recorte chico (más rápido y estable)
+        with _stage(timings, "locate"):
+            location = self._locate(face_aligned, detection, rot_matrix)
+        if location is None:
+            return "no_face_crop", quality, None, None
+
+        return None, quality, face_aligned, location
+
+    @staticmethod
+    def _result(status: str, quality, timings: Dict[str, float], debug: bool, encoding=None) -> Dict:
+        out = {"status": status, "encoding": encoding, "quality_info": quality}
+        if debug:
+            out["timings_ms"] = timings
+        return out
+
+    def run(self, frame, require_quality_check: bool = True, debug: bool = False,
+            detection: Optional[Dict] = None) -> Dict:
+        """
+        Args:
+            detection: resultado previo de la detección (p.ej. de describe) para no repetirla
+
+        Returns:
+            Dict con:
+            - status: ok | low_quality | no_face | no_face_crop | no_encoding
+            - encoding: np.ndarray float64 [128] o None
+            - quality_info: resultado de assess_image_quality (si se evaluó)
+            - timings_ms: milisegundos por etapa (solo con debug)
+        """
+        timings: Dict[str, float] = {}
+        status, quality, face_aligned, location = self._prepare(frame, require_quality_check, timings, detection)
+        if status is not None:
+            return self._result(status, quality, timings, debug)
+
+        with _stage(timings, "encode"):
+            encodings = face_recognition.face_encodings(face_aligned, [location])
+        if not encodings:
+            return self._result("no_encoding", quality, timings, debug)
+
+        return self._result("ok", quality, timings, debug, encodings[0])
+
+    def run_many(self, frames: List[np.ndarray], require_quality_check: bool = True,
+                 debug: bool = False) -> List[Dict]:
+        """
+        Como run para varios frames, con un solo paso de dlib: detección y
+        alineación por frame y los descriptores de todos los rostros en una
+        llamada batch al encoder. Resultados en el mismo orden que frames.
+        """
+        results: List[Optional[Dict]] = [None] * len(frames)
+        ready = []
+        for i, frame in enumerate(frames):
+            timings: Dict[str, float] = {}
+            status, quality, face_aligned, location = self._prepare(frame, require_quality_check, timings)
+            if status is not None:
+                results[i] = self._result(status, quality, timings, debug)
+            else:
+                ready.append((i, quality, timings, face_aligned, location))
+
+        if ready:
+            start = time.perf_counter()
+            encodings = _encode_batch([r[3] for r in ready], [r[4] for r in ready])
+            # Tiempo del batch completo, repetido en cada frame
+            encode_ms = round((time.perf_counter() - start) * 1000.0, 2)
+            for (i, quality, timings, _, _), encoding in zip(ready, encodings):
+                timings["encode_batch"] = encode_ms
+                status = "ok" if encoding is not None else "no_encoding"
+                results[i] = self._result(status, quality, timings, debug, encoding)
+        return results
+
+
+def _encode_batch(images: List[np.ndarray], locations: List[Tuple[int, int, int, int]]) -> List[Optional[np.ndarray]]:
+    """
+    Descriptores dlib de un rostro por imagen en una sola llamada
+    (compute_face_descriptor con lista de imágenes). Si la versión de dlib no
+    soporta el batch, se vuelve a face_encodings imagen por imagen.
+    """
+    try:
+        import dlib
+        from face_recognition import api as fr_api
+
+        batch_faces = []
+        for image, location in zip(images, locations):
+            faces = dlib.full_object_detections()
+            for shape in fr_api._raw_face_landmarks(image, [location], model="small"):
+                faces.append(shape)
+            batch_faces.append(faces)
+        descriptors = fr_api.face_encoder.compute_face_descriptor(
+            [np.ascontiguousarray(image) for image in images], batch_faces, 1
+        )
+        return [np.array(d[0]) if len(d) else None for d in descriptors]
+    except (ImportError, AttributeError, TypeError, RuntimeError):
+        encodings = []
+        for image, location in zip(images, locations):
+            found = face_recognition.face_encodings(image, [location])
+            encodings.append(found[0] if found else None)
+        return encodings
+
+
+def extract_face_encoding(detector, frame, require_quality_check: bool = True,
+                          detector_lock=None, debug: bool = False) -> Dict:
+    """Atajo: FacePipeline(detector, detector_lock).run(frame, ...)"""
+    return FacePipeline(detector, detector_lock).run(frame, require_quality_check, debug)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# =====================================================
+#  FACE GALLERY - Índice en memoria de encodings
+#  Una matriz float32 contigua + ids paralelos por proceso
+# =====================================================
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import case, func, null, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.db import models
+from backend.recognition import gallery_segment
+from backend.recognition.encoding_format import ENCODING_DIM, is_packed, unpack_many
+from backend.recognition.face_search import ExactIndex, build_index, resolve_backend
+from backend.recognition.face_prototypes import (
+    GALLERY_MODE,
+    build_prototype_gallery,
+    evaluate_prototype_drift,
+    user_prototypes,
+)
+
+
+GALLERY_STATE_ID = 1
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# Cada cuánto (segundos) se consulta el epoch en BD para detectar cambios
+# hechos por otros workers. 0 = consultar en cada request.
+EPOCH_CHECK_SECONDS = max(0.0, _env_float("FACE_GALLERY_EPOCH_CHECK_SECONDS", 1.0))
+# Matriz + ids en un segmento de memoria compartida por epoch (gallery_segment):
+# un worker carga desde BD y publica, el resto mapea en solo lectura
+SHARED_SEGMENT = (os.getenv("FACE_GALLERY_SHARED") or "0").strip() == "1"
+
+
+# ============================================================
+# Epoch compartido (tabla face_gallery_state)
+# ============================================================
+def ensure_gallery_state(db: Session) -> None:
+    """Crea la fila de epoch si no existe (idempotente, se llama al iniciar)"""
+    exists = db.query(models.FaceGalleryState.id).filter(
+        models.FaceGalleryState.id == GALLERY_STATE_ID
+    ).first()
+    if exists:
+        return
+    try:
+        db.add(models.FaceGalleryState(id=GALLERY_STATE_ID, version=0))
+        db.commit()
+    except IntegrityError:
+        # Otro worker la creó al mismo tiempo
+        db.rollback()
+
+
+def read_gallery_epoch(db: Session) -> int:
+    row = db.query(models.FaceGalleryState.version).filter(
+        models.FaceGalleryState.id == GALLERY_STATE_ID
+    ).first()
+    return int(row[0]) if row else 0
+
+
+def bump_gallery_epoch(db: Session) -> int:
+    """
+    Incrementa el epoch dentro de la transacción actual (NO hace commit).
+    Debe llamarse antes del commit de cualquier cambio en face_encodings.
+
+    Returns:
+        Nuevo valor del epoch
+    """
+    result = db.execute(
+        update(models.FaceGalleryState)
+        .where(models.FaceGalleryState.id == GALLERY_STATE_ID)
+        .values(
+            version=models.FaceGalleryState.version + 1,
+            updated_at=datetime.utcnow(),
+        )
+    )
+    if result.rowcount == 0:
+        db.add(models.FaceGalleryState(id=GALLERY_STATE_ID, version=1))
+        db.flush()
+        return 1
+    return read_gallery_epoch(db)
+
+
+def face_distances(matrix: np.ndarray, encoding: np.ndarray) -> np.ndarray:
+    """Distancia euclídea (igual que face_recognition.face_distance) en float32"""
+    if matrix.shape[0] == 0:
+        return np.empty(0, dtype=np.float32)
+    diff = matrix - np.asarray(encoding, dtype=np.float32)
+    return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+# ============================================================
+# Galería en memoria
+# ============================================================
+class FaceGallery:
+    """
+    Copia en memoria de todos los encodings activos.
+
+    Los arrays nunca se modifican in-place: cada cambio crea arrays nuevos
+    (copy-on-write), así un `snapshot()` en uso por otro thread sigue siendo válido.
+
+    Con FACE_GALLERY_MODE=prototypes la búsqueda 1:N corre sobre centroide +
+    prototipos por usuario; la galería completa se conserva para 1:1 y estadísticas.
+
+    `backend` fuerza un backend de búsqueda (exact/ivf/hnsw/auto); por defecto
+    FACE_SEARCH_BACKEND.
+    """
+
+    def __init__(self, mode: str = GALLERY_MODE, backend: Optional[str] = None):
+        self._lock = threading.RLock()
+        self.mode = "prototypes" if mode == "prototypes" else "full"
+        self.backend = backend
+        self._matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._encoding_ids = np.empty(0, dtype=np.int64)
+        # Índice de búsqueda 1:N (sobre la galería completa o sobre los prototipos)
+        self._index = build_index(self._matrix, self.backend)
+        self._index_user_ids = self._user_ids
+        self._drift_cache = None
+        # user_id → full_name de los usuarios ya consultados (se vacía al recargar)
+        self._names: Dict[int, str] = {}
+        self._epoch = -1  # -1 = nunca cargada
+        self._last_check = 0.0
+        # Las matrices vigentes son vistas del segmento compartido (False = arrays privados)
+        self._shared = False
+        self.segment_errors = 0
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def __len__(self) -> int:
+        return int(self._user_ids.shape[0])
+
+    # --------------------------------------------------------
+    # Carga / refresco
+    # --------------------------------------------------------
+    def ensure_fresh(self, db: Session, force: bool = False) -> None:
+        """Recarga desde BD si el epoch cambió (consulta como máximo cada EPOCH_CHECK_SECONDS)"""
+        now = time.monotonic()
+        if not force and self._epoch >= 0 and now - self._last_check < EPOCH_CHECK_SECONDS:
+            return
+
+        db_epoch = read_gallery_epoch(db)
+        with self._lock:
+            self._last_check = now
+            if force or db_epoch != self._epoch:
+                self._reload(db, db_epoch)
+
+    def _reload(self, db: Session, epoch: int) -> None:
+        shared = False
+        if SHARED_SEGMENT:
+            (matrix, user_ids, encoding_ids), shared = self._attach_segment(db, epoch)
+        else:
+            matrix, user_ids, encoding_ids = self._load_rows(db)
+
+        self._matrix = matrix
+        self._user_ids = user_ids
+        self._encoding_ids = encoding_ids
+        self._shared = shared
+        self._rebuild_search()
+        # Otro worker pudo borrar usuarios: los nombres se vuelven a pedir
+        self._names = {}
+        self._epoch = epoch
+        print(f"🗂️  Galería facial cargada: {len(self)} encodings (epoch {epoch}, "
+              f"búsqueda {self._index.name} sobre {len(self._index)} filas"
+              f"{', segmento compartido' if shared else ''})")
+
+    def _segment_error(self, e: OSError) -> None:
+        self.segment_errors += 1
+        print(f"⚠️ Segmento compartido de la galería no disponible ({e}); se usan arrays privados")
+
+    def _attach_segment(self, db: Session, epoch: int) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], bool]:
+        """
+        Mapea el segmento del epoch; si no existe, lo carga desde BD y lo publica.
+        Si /dev/shm falla (p. ej. ENOSPC con los 64 MB por defecto de Docker) se
+        sigue con arrays privados cargados desde BD.
+
+        Returns:
+            ((matriz, user_ids, encoding_ids), True si son vistas del segmento)
+        """
+        # Huella (filas activas, id máximo): descarta segmentos de una BD recreada con el mismo epoch
+        count, max_id = db.query(
+            func.count(models.FaceEncoding.id), func.max(models.FaceEncoding.id)
+        ).filter(models.FaceEncoding.is_active == True).one()
+        fingerprint = (int(count or 0), int(max_id or 0))
+
+        arrays = gallery_segment.attach(epoch, fingerprint)
+        if arrays is not None:
+            return arrays, True
+        rows = None
+        try:
+            with gallery_segment.loader_lock():
+                # Otro worker pudo publicarlo mientras esperábamos el lock
+                arrays = gallery_segment.attach(epoch, fingerprint)
+                if arrays is None:
+                    rows = self._load_rows(db)
+                    gallery_segment.publish(epoch, *rows)
+                    arrays = gallery_segment.attach(epoch)
+        except OSError as e:
+            self._segment_error(e)
+            arrays = None
+        if arrays is not None:
+            return arrays, True
+        return (rows if rows is not None else self._load_rows(db)), False
+
+    def _share_local(self, epoch: Optional[int]) -> None:
+        """
+        Tras un cambio local que lleva exactamente al siguiente epoch, publica
+        las matrices nuevas como segmento y las reemplaza por el mapeo compartido.
+        """
+        if not SHARED_SEGMENT or epoch is None or self._epoch < 0 or epoch != self._epoch + 1:
+            return
+        try:
+            with gallery_segment.loader_lock():
+                gallery_segment.publish(epoch, self._matrix, self._user_ids, self._encoding_ids)
+                arrays = gallery_segment.attach(epoch)
+        except OSError as e:
+            # Las matrices privadas ya tienen el cambio: solo no se comparten
+            self._segment_error(e)
+            self._shared = False
+            return
+        if arrays is not None:
+            self._matrix, self._user_ids, self._encoding_ids = arrays
+            self._shared = True
+
+    def _load_rows(self, db: Session) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(matriz [n, 128] float32, user_ids [n], encoding_ids [n]) de los encodings activos"""
+        # encoding_data (JSON) solo se pide para filas que aún no tienen blob,
+        # así las filas migradas no viajan dos veces por la red.
+        rows = db.query(
+            models.FaceEncoding.id,
+            models.FaceEncoding.user_id,
+            models.FaceEncoding.encoding_blob,
+            case(
+                (models.FaceEncoding.encoding_blob.is_(None), models.FaceEncoding.encoding_data),
+                else_=null(),
+            ),
+        ).filter(
+            models.FaceEncoding.is_active == True
+        ).order_by(models.FaceEncoding.id).all()
+
+        n = len(rows)
+        user_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=n)
+        encoding_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+
+        packed_idx = [i for i, r in enumerate(rows) if is_packed(r[2])]
+        packed = unpack_many([rows[i][2] for i in packed_idx])
+
+        if len(packed_idx) == n:
+            # Todo migrado: la matriz es directamente la vista sobre los blobs
+            matrix = packed
+        else:
+            # Rollover: mezcla de filas binarias y JSON legacy
+            matrix = np.empty((n, ENCODING_DIM), dtype=np.float32)
+            matrix[packed_idx] = packed
+            packed_set = set(packed_idx)
+            for i, r in enumerate(rows):
+                if i not in packed_set:
+                    matrix[i] = r[3]
+        return matrix, user_ids, encoding_ids
+
+    def _rebuild_search(self, changed_user: Optional[int] = None, appended: bool = False) -> None:
+        """Reconstruye el índice 1:N tras un cambio en la galería completa"""
+        self._drift_cache = None
+
+        if self.mode == "prototypes":
+            if changed_user is None:
+                proto_matrix, proto_ids = build_prototype_gallery(self._matrix, self._user_ids)
+            else:
+                # Solo se recalculan los prototipos del usuario afectado
+                keep = self._index_user_ids != changed_user
+                rows = self._matrix[self._user_ids == changed_user]
+                protos = user_prototypes(rows) if rows.shape[0] else rows
+                proto_matrix = np.vstack([self._index.matrix[keep], protos])
+                proto_ids = np.concatenate([
+                    self._index_user_ids[keep],
+                    np.full(protos.shape[0], changed_user, dtype=np.int64),
+                ])
+            self._index = build_index(np.ascontiguousarray(proto_matrix, dtype=np.float32), self.backend)
+            self._index_user_ids = proto_ids
+            return
+
+        if appended and resolve_backend(len(self), self.backend) == self._index.name:
+            self._index = self._index.extend(self._matrix)
+        else:
+            self._index = build_index(self._matrix, self.backend)
+        self._index_user_ids = self._user_ids
+
+    def invalidate(self) -> None:
+        """Fuerza consulta del epoch en la próxima lectura"""
+        self._last_check = 0.0
+
+    def _apply_epoch(self, epoch: Optional[int]) -> None:
+        # Si el cambio local no es exactamente el siguiente epoch, otro worker
+        # modificó la galería entretanto: forzamos recarga completa.
+        if epoch is not None and epoch == self._epoch + 1:
+            self._epoch = epoch
+        else:
+            self._epoch = -1
+            self.invalidate()
+
+    # --------------------------------------------------------
+    # Lectura
+    # --------------------------------------------------------
+    def snapshot(self, db: Session, user_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Retorna (matriz float32 [n, 128], user_ids [n]) de la galería vigente.
+
+        Args:
+            user_id: Si se especifica, solo las filas de ese usuario
+        """
+        self.ensure_fresh(db)
+        with self._lock:
+            matrix, user_ids = self._matrix, self._user_ids
+
+        if user_id is not None:
+            mask = user_ids == user_id
+            return matrix[mask], user_ids[mask]
+        return matrix, user_ids
+
+    def search(self, db: Session, queries: np.ndarray, k: int = 2,
+               user_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k vecinos más cercanos usando el backend configurado (FACE_SEARCH_BACKEND).
+
+        Args:
+            queries: encoding [128] o lote [m, 128]
+            k: vecinos por query
+            user_id: Si se especifica, búsqueda exacta solo entre las filas de ese usuario
+
+        Returns:
+            (distancias [m, k], user_ids [m, k]) ordenados; user_id -1 = sin vecino
+        """
+        self.ensure_fresh(db)
+        with self._lock:
+            if user_id is not None:
+                matrix, all_user_ids = self._matrix, self._user_ids
+            else:
+                index, user_ids = self._index, self._index_user_ids
+
+        if user_id is not None:
+            # 1:1 siempre contra todas las muestras del usuario (también en modo prototipos)
+            mask = all_user_ids == user_id
+            index, user_ids = ExactIndex(matrix[mask]), all_user_ids[mask]
+
+        idx, dist = index.search(queries, k)
+        if user_ids.shape[0] == 0:
+            return dist, np.full(idx.shape, -1, dtype=np.int64)
+        neighbor_ids = np.where(idx >= 0, user_ids[np.maximum(idx, 0)], -1)
+        return dist, neighbor_ids
+
+    def user_names(self, db: Session, user_ids: Iterable[int]) -> Dict[int, str]:
+        """
+        user_id → full_name. Los ids no cacheados se resuelven con una sola
+        consulta IN; los que no existen en BD no aparecen en el resultado.
+        """
+        wanted = {int(u) for u in user_ids}
+        with self._lock:
+            names = self._names
+        found = {u: names[u] for u in wanted if u in names}
+        missing = wanted - found.keys()
+        if missing:
+            rows = dict(
+                db.query(models.User.id, models.User.full_name).filter(
+                    models.User.id.in_(missing)
+                ).all()
+            )
+            found.update(rows)
+            with self._lock:
+                if self._names is names:
+                    names.update(rows)
+        return found
+
+    # --------------------------------------------------------
+    # Cambios locales (tras commit en BD)
+    # --------------------------------------------------------
+    def add(self, encoding_id: int, user_id: int, encoding: np.ndarray, epoch: Optional[int] = None) -> None:
+        self.add_many([encoding_id], user_id, [encoding], epoch)
+
+    def add_many(self, encoding_ids, user_id: int, encodings, epoch: Optional[int] = None) -> None:
+        """Varias muestras de un usuario guardadas en la misma transacción (un solo epoch)"""
+        with self._lock:
+            if self._epoch >= 0:
+                rows = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+                self._matrix = np.vstack([self._matrix, rows])
+                self._user_ids = np.concatenate([
+                    self._user_ids, np.full(rows.shape[0], user_id, dtype=np.int64)
+                ])
+                self._encoding_ids = np.concatenate([
+                    self._encoding_ids, np.asarray(encoding_ids, dtype=np.int64)
+                ])
+                self._share_local(epoch)
+                self._rebuild_search(changed_user=user_id, appended=True)
+            self._apply_epoch(epoch)
+
+    def remove_user(self, user_id: int, epoch: Optional[int] = None) -> None:
+        with self._lock:
+            if self._epoch >= 0:
+                keep = self._user_ids != user_id
+                self._matrix = self._matrix[keep]
+                self._user_ids = self._user_ids[keep]
+                self._encoding_ids = self._encoding_ids[keep]
+                self._share_local(epoch)
+                self._rebuild_search(changed_user=user_id)
+            self._names.pop(user_id, None)
+            self._apply_epoch(epoch)
+
+    def prototype_drift(self, threshold: float) -> Optional[dict]:
+        """
+        Deriva de precisión de los prototipos frente a la galería completa
+        (cacheada hasta el próximo cambio de la galería). None en modo full.
+        """
+        if self.mode != "prototypes":
+            return None
+        with self._lock:
+            cache = self._drift_cache
+            if cache is not None and cache[0] == threshold:
+                return cache[1]
+            matrix, user_ids = self._matrix, self._user_ids
+            proto_matrix, proto_ids = self._index.matrix, self._index_user_ids
+
+        report = evaluate_prototype_drift(matrix, user_ids, proto_matrix, proto_ids, threshold)
+        with self._lock:
+            if self._matrix is matrix:
+                self._drift_cache = (threshold, report)
+        return report
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "epoch": self._epoch,
+            "mode": self.mode,
+            "shared_segment": self._shared,
+            "segment_errors": self.segment_errors,
+            "search": self._index.stats(),
+            "memory_bytes": int(self._matrix.nbytes + self._user_ids.nbytes + self._encoding_ids.nbytes),
+        }
+
+
+_gallery = FaceGallery()
+
+
+def get_face_gallery() -> FaceGallery:
+    """Galería compartida por todo el proceso (un worker de uvicorn)"""
+    return _gallery
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# =====================================================
+#  FACE PROTOTYPES - Compresión de la galería por usuario
+#  Centroide + hasta k prototipos diversos por usuario,
+#  así la búsqueda 1:N es O(usuarios) y no O(muestras)
+# =====================================================
+
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# full | prototypes
+GALLERY_MODE = (os.getenv("FACE_GALLERY_MODE") or "full").strip().lower()
+PROTOTYPES_PER_USER = max(1, _env_int("FACE_PROTOTYPES_PER_USER", 4))
+# farthest | kmedoids
+PROTOTYPE_METHOD = (os.getenv("FACE_PROTOTYPE_METHOD") or "farthest").strip().lower()
+# Nº de muestras usadas para medir la deriva frente a la galería completa (0 = no medir)
+DRIFT_SAMPLE_SIZE = _env_int("FACE_PROTOTYPE_DRIFT_SAMPLE", 1000)
+
+
+def _pairwise(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    d2 = (
+        np.einsum("ij,ij->i", a, a)[:, None]
+        - 2.0 * (a @ b.T)
+        + np.einsum("ij,ij->i", b, b)[None, :]
+    )
+    return np.sqrt(np.maximum(d2, 0.0))
+
+
+def _nearest(queries: np.ndarray, matrix: np.ndarray,
+             exclude: Optional[np.ndarray] = None, block: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    """Vecino más cercano por bloques de queries (acota la memoria a block x n)"""
+    m = queries.shape[0]
+    best_idx = np.empty(m, dtype=np.int64)
+    best_dist = np.empty(m, dtype=np.float32)
+    for start in range(0, m, block):
+        d = _pairwise(queries[start:start + block], matrix)
+        if exclude is not None:
+            d[np.arange(d.shape[0]), exclude[start:start + block]] = np.inf
+        idx = np.argmin(d, axis=1)
+        best_idx[start:start + block] = idx
+        best_dist[start:start + block] = d[np.arange(d.shape[0]), idx]
+    return best_idx, best_dist
+
+
+# ============================================================
+# Selección de prototipos
+# ============================================================
+def farthest_point_prototypes(samples: np.ndarray, k: int) -> np.ndarray:
+    """
+    Farthest-point sampling: empieza por la muestra más cercana al centroide
+    y agrega repetidamente la más lejana a las ya elegidas.
+    """
+    n = samples.shape[0]
+    if n <= k:
+        return np.arange(n)
+
+    centroid = samples.mean(axis=0)
+    first = int(np.argmin(np.linalg.norm(samples - centroid, axis=1)))
+    chosen = [first]
+    min_dist = np.linalg.norm(samples - samples[first], axis=1)
+    for _ in range(k - 1):
+        nxt = int(np.argmax(min_dist))
+        chosen.append(nxt)
+        min_dist = np.minimum(min_dist, np.linalg.norm(samples - samples[nxt], axis=1))
+    return np.asarray(chosen)
+
+
+def kmedoids_prototypes(samples: np.ndarray, k: int, iterations: int = 10) -> np.ndarray:
+    """k-medoids (alternante) inicializado con farthest-point"""
+    n = samples.shape[0]
+    if n <= k:
+        return np.arange(n)
+
+    dist = _pairwise(samples, samples)
+    medoids = farthest_point_prototypes(samples, k)
+    for _ in range(iterations):
+        labels = np.argmin(dist[:, medoids], axis=1)
+        new_medoids = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            if members.size:
+                costs = dist[np.ix_(members, members)].sum(axis=1)
+                new_medoids[c] = members[int(np.argmin(costs))]
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+    return medoids
+
+
+def user_prototypes(samples: np.ndarray, k: int = PROTOTYPES_PER_USER,
+                    method: str = PROTOTYPE_METHOD) -> np.ndarray:
+    """
+    Centroide + k prototipos de un usuario. Con n <= k muestras se devuelven
+    las muestras tal cual: agregar el centroide haría la galería más grande
+    que en modo full. Retorna [<= min(n, k+1), 128] float32
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.shape[0] <= k:
+        return samples.copy()
+
+    select = kmedoids_prototypes if method == "kmedoids" else farthest_point_prototypes
+    idx = select(samples, k)
+    centroid = samples.mean(axis=0, keepdims=True)
+    return np.vstack([centroid, samples[idx]]).astype(np.float32)
+
+
+def build_prototype_gallery(matrix: np.ndarray, user_ids: np.ndarray,
+                            k: int = PROTOTYPES_PER_USER,
+                            method: str = PROTOTYPE_METHOD) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Comprime la galería completa a prototipos por usuario.
+
+    Returns:
+        (matriz de prototipos [p, 128], user_ids [p])
+    """
+    if matrix.shape[0] == 0:
+        return matrix.copy(), user_ids.copy()
+
+    order = np.argsort(user_ids, kind="stable")
+    sorted_ids = user_ids[order]
+    uniques, starts = np.unique(sorted_ids, return_index=True)
+    ends = np.append(starts[1:], sorted_ids.shape[0])
+
+    blocks, ids = [], []
+    for uid, start, end in zip(uniques, starts, ends):
+        protos = user_prototypes(matrix[order[start:end]], k, method)
+        blocks.append(protos)
+        ids.append(np.full(protos.shape[0], uid, dtype=np.int64))
+    return np.vstack(blocks), np.concatenate(ids)
+
+
+# ============================================================
+# Deriva respecto a la galería completa
+# ============================================================
+def _nearest_prototype_loo(queries_idx: np.ndarray, matrix: np.ndarray, user_ids: np.ndarray,
+                           proto_matrix: np.ndarray, proto_user_ids: np.ndarray,
+                           block: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vecino más cercano en la galería de prototipos sin la propia muestra:
+    los prototipos del usuario de la query se recalculan excluyéndola.
+    """
+    m = queries_idx.size
+    best_user = np.empty(m, dtype=np.int64)
+    best_dist = np.empty(m, dtype=np.float32)
+    for start in range(0, m, block):
+        q_idx = queries_idx[start:start + block]
+        queries = matrix[q_idx]
+        q_users = user_ids[q_idx]
+
+        d = _pairwise(queries, proto_matrix)
+        d[proto_user_ids[None, :] == q_users[:, None]] = np.inf
+        other = np.argmin(d, axis=1)
+
+        for j, idx in enumerate(q_idx):
+            dist, user = d[j, other[j]], proto_user_ids[other[j]]
+            own_rows = np.flatnonzero(user_ids == q_users[j])
+            own_rows = own_rows[own_rows != idx]
+            if own_rows.size:
+                protos = user_prototypes(matrix[own_rows])
+                own_dist = float(np.min(np.linalg.norm(protos - queries[j], axis=1)))
+                if own_dist < dist:
+                    dist, user = own_dist, q_users[j]
+            best_user[start + j] = user
+            best_dist[start + j] = dist
+    return best_user, best_dist
+
+
+def evaluate_prototype_drift(matrix: np.ndarray, user_ids: np.ndarray,
+                             proto_matrix: np.ndarray, proto_user_ids: np.ndarray,
+                             threshold: float, sample_size: int = DRIFT_SAMPLE_SIZE,
+                             seed: int = 0) -> Optional[Dict]:
+    """
+    Usa muestras de la propia galería como queries (leave-one-out en ambos lados)
+    y compara la decisión (mejor usuario y si pasa el umbral) con galería
+    completa vs prototipos.
+    """
+    n = matrix.shape[0]
+    if sample_size <= 0 or n < 2 or proto_matrix.shape[0] == 0:
+        return None
+
+    rng = np.random.default_rng(seed)
+    queries_idx = rng.choice(n, min(sample_size, n), replace=False)
+
+    full_best, full_dist = _nearest(matrix[queries_idx], matrix, exclude=queries_idx)
+    full_user = user_ids[full_best]
+    proto_user, proto_dist = _nearest_prototype_loo(queries_idx, matrix, user_ids, proto_matrix, proto_user_ids)
+
+    valid = np.isfinite(full_dist) & np.isfinite(proto_dist)
+    if not valid.any():
+        return None
+    full_user, full_dist = full_user[valid], full_dist[valid]
+    proto_user, proto_dist = proto_user[valid], proto_dist[valid]
+
+    decision_full = np.where(full_dist <= threshold, full_user, -1)
+    decision_proto = np.where(proto_dist <= threshold, proto_user, -1)
+
+    return {
+        "queries": int(valid.sum()),
+        "compression_ratio": round(float(n) / float(proto_matrix.shape[0]), 2),
+        "best_user_agreement": round(float(np.mean(full_user == proto_user)), 4),
+        "decision_agreement": round(float(np.mean(decision_full == decision_proto)), 4),
+        "mean_distance_delta": round(float(np.mean(proto_dist - full_dist)), 4),
+    }
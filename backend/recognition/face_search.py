@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# =====================================================
+#  FACE SEARCH - Backends de búsqueda 1:N sobre la galería
+#  exact : top-k vectorizado (argpartition), resultado exacto
+#  ivf   : índice invertido (k-means en NumPy), aproximado
+#  hnsw  : grafo HNSW vía hnswlib (opcional), aproximado
+# =====================================================
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# exact | ivf | hnsw | auto
+SEARCH_BACKEND = (os.getenv("FACE_SEARCH_BACKEND") or "exact").strip().lower()
+# En modo auto, tamaño de galería a partir del cual se usa un índice ANN
+ANN_MIN_SIZE = _env_int("FACE_SEARCH_ANN_MIN_SIZE", 20000)
+IVF_NPROBE = _env_int("FACE_SEARCH_IVF_NPROBE", 8)
+HNSW_M = _env_int("FACE_SEARCH_HNSW_M", 16)
+HNSW_EF_CONSTRUCTION = _env_int("FACE_SEARCH_HNSW_EF_CONSTRUCTION", 200)
+HNSW_EF = _env_int("FACE_SEARCH_HNSW_EF", 64)
+
+try:
+    import hnswlib
+    HNSW_AVAILABLE = True
+except ImportError:
+    hnswlib = None
+    HNSW_AVAILABLE = False
+
+
+def _as_queries(queries: np.ndarray) -> np.ndarray:
+    q = np.asarray(queries, dtype=np.float32)
+    return q.reshape(1, -1) if q.ndim == 1 else q
+
+
+def _exact_distances(matrix: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+    diff = matrix[rows] - query
+    return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+def _topk_rows(d2: np.ndarray, k: int) -> np.ndarray:
+    """Índices de los k menores por fila, sin ordenar (argpartition O(n))"""
+    n = d2.shape[1]
+    if k >= n:
+        return np.broadcast_to(np.arange(n), (d2.shape[0], n))
+    return np.argpartition(d2, k - 1, axis=1)[:, :k]
+
+
+def _finalize(matrix: np.ndarray, queries: np.ndarray, candidates, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Recalcula distancias exactas para los candidatos de cada query y ordena.
+    Filas con menos de k candidatos se rellenan con índice -1 / distancia inf.
+    """
+    m = queries.shape[0]
+    out_idx = np.full((m, k), -1, dtype=np.int64)
+    out_dist = np.full((m, k), np.inf, dtype=np.float32)
+    for i in range(m):
+        rows = np.asarray(candidates[i], dtype=np.int64)
+        if rows.size == 0:
+            continue
+        dist = _exact_distances(matrix, rows, queries[i])
+        order = np.argsort(dist, kind="stable")[:k]
+        out_idx[i, :order.size] = rows[order]
+        out_dist[i, :order.size] = dist[order]
+    return out_idx, out_dist
+
+
+# ============================================================
+# Exacto
+# ============================================================
+class ExactIndex:
+    name = "exact"
+    approximate = False
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+        self.sq_norms = np.einsum("ij,ij->i", matrix, matrix) if matrix.shape[0] else np.empty(0, np.float32)
+
+    def __len__(self) -> int:
+        return int(self.matrix.shape[0])
+
+    def search(self, queries: np.ndarray, k: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            queries: [m, 128] o [128]
+            k: vecinos por query
+
+        Returns:
+            (índices [m, k], distancias [m, k]) ordenados de menor a mayor distancia
+        """
+        q = _as_queries(queries)
+        n = len(self)
+        if n == 0:
+            return _finalize(self.matrix, q, [[]] * q.shape[0], k)
+
+        # ||x - q||² = ||x||² - 2 x·q + ||q||²  → un solo GEMM para todo el lote
+        d2 = self.sq_norms[None, :] - 2.0 * (q @ self.matrix.T)
+        candidates = _topk_rows(d2, min(k, n))
+        return _finalize(self.matrix, q, candidates, k)
+
+    def extend(self, matrix: np.ndarray) -> "ExactIndex":
+        """Índice sobre una galería que añadió filas al final"""
+        return ExactIndex(matrix)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "size": len(self)}
+
+
+# ============================================================
+# IVF (NumPy)
+# ============================================================
+class IVFIndex:
+    """
+    Inverted file: k-means sobre la galería, cada vector cae en una lista.
+    La búsqueda solo revisa las `nprobe` listas más cercanas a la query.
+    """
+    name = "ivf"
+    approximate = True
+
+    def __init__(self, matrix: np.ndarray, nlist: Optional[int] = None, nprobe: int = IVF_NPROBE,
+                 centroids: Optional[np.ndarray] = None, trained_size: Optional[int] = None):
+        self.matrix = matrix
+        n = matrix.shape[0]
+        self.nlist = nlist or max(1, int(4 * np.sqrt(max(n, 1))))
+        self.nprobe = max(1, nprobe)
+
+        if centroids is None:
+            centroids = self._train(matrix, self.nlist)
+            trained_size = n
+        self.centroids = centroids
+        self.trained_size = trained_size or n
+        self.assignments = self._assign(matrix)
+        self._build_lists()
+
+    def __len__(self) -> int:
+        return int(self.matrix.shape[0])
+
+    @staticmethod
+    def _train(matrix: np.ndarray, nlist: int, iterations: int = 10, sample: int = 50000) -> np.ndarray:
+        n = matrix.shape[0]
+        if n == 0:
+            return np.empty((0, matrix.shape[1]), dtype=np.float32)
+        rng = np.random.default_rng(0)
+        data = matrix if n <= sample else matrix[rng.choice(n, sample, replace=False)]
+        nlist = min(nlist, data.shape[0])
+        centroids = data[rng.choice(data.shape[0], nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = IVFIndex._nearest_centroid(data, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            counts = np.bincount(labels, minlength=nlist).astype(np.float32)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        return centroids
+
+    @staticmethod
+    def _nearest_centroid(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        labels = np.empty(data.shape[0], dtype=np.int64)
+        step = 8192  # por bloques para no materializar [n, nlist] completo
+        for start in range(0, data.shape[0], step):
+            block = data[start:start + step]
+            d2 = c_norms[None, :] - 2.0 * (block @ centroids.T)
+            labels[start:start + step] = np.argmin(d2, axis=1)
+        return labels
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        if matrix.shape[0] == 0 or self.centroids.shape[0] == 0:
+            return np.zeros(matrix.shape[0], dtype=np.int64)
+        return self._nearest_centroid(matrix, self.centroids)
+
+    def _build_lists(self) -> None:
+        # Formato CSR: filas ordenadas por lista + offsets
+        self.order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=max(1, self.centroids.shape[0]))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def search(self, queries: np.ndarray, k: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+        q = _as_queries(queries)
+        if len(self) == 0 or self.centroids.shape[0] == 0:
+            return _finalize(self.matrix, q, [[]] * q.shape[0], k)
+
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        c_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        d2c = c_norms[None, :] - 2.0 * (q @ self.centroids.T)
+        probes = _topk_rows(d2c, nprobe)
+
+        candidates = []
+        for i in range(q.shape[0]):
+            parts = [self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes[i]]
+            candidates.append(np.concatenate(parts) if parts else np.empty(0, np.int64))
+        return _finalize(self.matrix, q, candidates, k)
+
+    def extend(self, matrix: np.ndarray) -> "IVFIndex":
+        # Re-entrenar solo cuando la galería duplicó su tamaño desde el último k-means
+        if matrix.shape[0] >= 2 * max(self.trained_size, 1):
+            return IVFIndex(matrix, nprobe=self.nprobe)
+        return IVFIndex(matrix, nlist=self.nlist, nprobe=self.nprobe,
+                        centroids=self.centroids, trained_size=self.trained_size)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "size": len(self), "nlist": int(self.centroids.shape[0]), "nprobe": self.nprobe}
+
+
+# ============================================================
+# HNSW (hnswlib, opcional)
+# ============================================================
+class HNSWIndex:
+    name = "hnsw"
+    approximate = True
+
+    def __init__(self, matrix: np.ndarray, index=None, capacity: Optional[int] = None):
+        if not HNSW_AVAILABLE:
+            raise RuntimeError("hnswlib no está instalado (pip install hnswlib)")
+        self.matrix = matrix
+        n = matrix.shape[0]
+
+        if index is None:
+            capacity = capacity or max(1024, 2 * n)
+            index = hnswlib.Index(space="l2", dim=matrix.shape[1])
+            index.init_index(max_elements=capacity, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            index.set_ef(HNSW_EF)
+            if n:
+                index.add_items(matrix, np.arange(n))
+        self.index = index
+        self.capacity = capacity or index.get_max_elements()
+
+    def __len__(self) -> int:
+        return int(self.matrix.shape[0])
+
+    def search(self, queries: np.ndarray, k: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+        q = _as_queries(queries)
+        n = len(self)
+        if n == 0:
+            return _finalize(self.matrix, q, [[]] * q.shape[0], k)
+
+        labels, _ = self.index.knn_query(q, k=min(max(k, 1), n))
+        # El grafo puede tener filas añadidas después de este snapshot
+        candidates = [row[row < n] for row in labels.astype(np.int64)]
+        return _finalize(self.matrix, q, candidates, k)
+
+    def extend(self, matrix: np.ndarray) -> "HNSWIndex":
+        n_old, n_new = len(self), matrix.shape[0]
+        if n_new > self.capacity:
+            return HNSWIndex(matrix)
+        if n_new > n_old:
+            self.index.add_items(matrix[n_old:], np.arange(n_old, n_new))
+        return HNSWIndex(matrix, index=self.index, capacity=self.capacity)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "size": len(self), "ef": HNSW_EF, "M": HNSW_M}
+
+
+# ============================================================
+# Selección por configuración
+# ============================================================
+def resolve_backend(size: int, backend: Optional[str] = None) -> str:
+    backend = (backend or SEARCH_BACKEND).lower()
+    if backend == "auto":
+        if size < ANN_MIN_SIZE:
+            return "exact"
+        return "hnsw" if HNSW_AVAILABLE else "ivf"
+    if backend == "hnsw" and not HNSW_AVAILABLE:
+        print("⚠️  FACE_SEARCH_BACKEND=hnsw pero hnswlib no está instalado; usando ivf")
+        return "ivf"
+    if backend not in {"exact", "ivf", "hnsw"}:
+        print(f"⚠️  FACE_SEARCH_BACKEND desconocido ({backend}); usando exact")
+        return "exact"
+    return backend
+
+
+def build_index(matrix: np.ndarray, backend: Optional[str] = None):
+    name = resolve_backend(matrix.shape[0], backend)
+    if name == "hnsw":
+        return HNSWIndex(matrix)
+    if name == "ivf":
+        return IVFIndex(matrix)
+    return ExactIndex(matrix)
@@ -4,129 +4,73 @@
 #  Almacena encodings en PostgreSQL en lugar de pickle
 # =====================================================
 
-import cv2
+import os
 import numpy as np
 import threading
-import face_recognition
-from mediapipe import solutions as mp_solutions
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from sqlalchemy.orm import Session
 
 # Importar modelos de base de datos
 from backend.db import models
-
-
-def align_face(image):
-    """Alinea el rostro basándose en la posición de los ojos"""
-    landmarks = face_recognition.face_landmarks(image)
-
-    if len(landmarks) == 0:
-        return image
-
-    left_eye = landmarks[0].get("left_eye")
-    right_eye = landmarks[0].get("right_eye")
-
-    if not left_eye or not right_eye:
-        return image
-
-    left_center = np.mean(left_eye, axis=0)
-    right_center = np.mean(right_eye, axis=0)
-
-    left_center = (int(left_center[0]), int(left_center[1]))
-    right_center = (int(right_center[0]), int(right_center[1]))
-
-    dy = right_center[1] - left_center[1]
-    dx = right_center[0] - left_center[0]
-    angle = np.degrees(np.arctan2(dy, dx))
-
-    rot_matrix = cv2.getRotationMatrix2D(left_center, angle, 1.0)
-    aligned = cv2.warpAffine(
-        image,
-        rot_matrix,
-        (image.shape[1], image.shape[0]),
-        flags=cv2.INTER_LINEAR
-    )
-    return aligned
-
-
-def enhance_image(image):
-    """Mejora la calidad de la imagen"""
-    image = cv2.GaussianBlur(image, (3, 3), 0)
-    image = cv2.convertScaleAbs(image, alpha=1.15, beta=6)
-    return image
-
-
-def assess_image_quality(frame) -> Dict[str, any]:
-    """Evalúa la calidad de la imagen para reconocimiento facial"""
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    brightness = np.mean(gray)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-    contrast = gray.std()
-    height, width = frame.shape[:2]
-    
-    quality_score = 0
-    issues = []
-    
-    # Evaluación de brillo (óptimo: 80-180)
-    if brightness < 60:
-        issues.append("Imagen muy oscura")
-    elif brightness > 200:
-        issues.append("Imagen muy brillante")
-    else:
-        quality_score += 25
-    
-    # Evaluación de nitidez (óptimo: > 100)
-    if laplacian_var < 50:
-        issues.append("Imagen borrosa o desenfocada")
-    else:
-        quality_score += 25
-    
-    # Evaluación de contraste (óptimo: > 30)
-    if contrast < 20:
-        issues.append("Contraste muy bajo")
-    else:
-        quality_score += 25
-    
-    # Evaluación de tamaño (mínimo: 200x200)
-    if width < 200 or height < 200:
-        issues.append("Imagen muy pequeña")
-    else:
-        quality_score += 25
-    
-    return {
-        "score": quality_score,
-        "brightness": brightness,
-        "sharpness": laplacian_var,
-        "contrast": contrast,
-        "size": (width, height),
-        "issues": issues,
-        "is_acceptable": quality_score >= 50
-    }
+from backend.recognition.encoding_format import encoding_columns
+from backend.recognition.face_extraction import (
+    assess_image_quality,
+    assess_image_quality_records,
+    quality_info,
+    create_face_detector,
+    select_enrollment_frames,
+    FacePipeline,
+    ENROLL_MAX_SAMPLES,
+    PIPELINE_DEBUG,
+)
+from backend.recognition.face_engine_pool import get_face_engine_pool
+from backend.recognition.face_gallery import (
+    get_face_gallery,
+    bump_gallery_epoch,
+)
+from backend.recognition.encoding_cache import get_encoding_cache
+from backend.recognition.presence_tracker import PRESENCE_TRACKING, get_presence_tracker
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# Umbrales de decisión (se leen una sola vez por proceso)
+RECOGNITION_THRESHOLD = _env_float("FACE_RECOGNITION_THRESHOLD", 0.50)
+MIN_CONFIDENCE = _env_float("FACE_MIN_CONFIDENCE", 0.50)
+MARGIN_THRESHOLD = _env_float("FACE_MARGIN_THRESHOLD", 0.08)
 
 
 class FaceRecognitionService:
+    """
+    Motor de reconocimiento facial del worker: modelos, galería en memoria y cachés.
+    Es de larga vida (ver get_face_recognition_service); la sesión de BD del request
+    se pasa solo a los métodos que consultan o persisten.
+    """
     _detector_lock = threading.Lock()
-    _shared_detector = None
-
-    def __init__(self, db: Session):
-        self.db = db
+    _shared_pipeline = None
 
-        if FaceRecognitionService._shared_detector is None:
-            with FaceRecognitionService._detector_lock:
-                if FaceRecognitionService._shared_detector is None:
-                    FaceRecognitionService._shared_detector = mp_solutions.face_detection.FaceDetection(
-                        model_selection=1,
-                        min_detection_confidence=0.6
-                    )
+    def __init__(self):
+        # Con FACE_ENGINE_PROCESSES > 0 la extracción corre en el pool de procesos
+        # (cada uno con su detector); si no, en este proceso con el detector compartido.
+        self.engine_pool = get_face_engine_pool()
 
-        self.detector = FaceRecognitionService._shared_detector
+        self.pipeline = None if self.engine_pool is not None else self.shared_pipeline()
+        self.gallery = get_face_gallery()
+        self.presence = get_presence_tracker()
+        self.encoding_cache = get_encoding_cache()
         
         # Configuración de umbrales
-        self.RECOGNITION_THRESHOLD = 0.50
-        self.MIN_CONFIDENCE = 0.50
-        self.MARGIN_THRESHOLD = 0.08
+        self.RECOGNITION_THRESHOLD = RECOGNITION_THRESHOLD
+        self.MIN_CONFIDENCE = MIN_CONFIDENCE
+        self.MARGIN_THRESHOLD = MARGIN_THRESHOLD
         
         print(f"✅ Servicio inicializado (usando PostgreSQL)")
         print(f"   - Distancia máxima: {self.RECOGNITION_THRESHOLD}")
@@ -134,77 +78,112 @@ class FaceRecognitionService:
         print(f"   - Margen de seguridad: {self.MARGIN_THRESHOLD}")
 
 
+    @classmethod
+    def shared_pipeline(cls) -> FacePipeline:
+        """Pipeline del proceso (detector MediaPipe compartido, protegido por lock)"""
+        if cls._shared_pipeline is None:
+            with cls._detector_lock:
+                if cls._shared_pipeline is None:
+                    cls._shared_pipeline = FacePipeline(create_face_detector(), detector_lock=cls._detector_lock)
+        return cls._shared_pipeline
+
+
     # ============================================================
-    # Cargar encodings desde base de datos
+    # Cargar encodings (galería en memoria, refrescada por epoch)
     # ============================================================
-    def _load_user_encodings(self, user_id: Optional[int] = None) -> Tuple[List, List]:
+    def _load_user_encodings(self, db: Session, user_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Carga encodings desde la base de datos
+        Obtiene los encodings activos desde la galería en memoria del proceso.
+        Solo se consulta la BD cuando el epoch de la galería cambió.
         
         Args:
-            user_id: Si se especifica, carga solo encodings de ese usuario
+            user_id: Si se especifica, retorna solo encodings de ese usuario
         
         Returns:
-            Tupla de (encodings, user_ids)
+            Tupla de (matriz float32 [n, 128], user_ids [n])
         """
-        query = self.db.query(models.FaceEncoding).filter(
-            models.FaceEncoding.is_active == True
-        )
-        
-        if user_id is not None:
-            query = query.filter(models.FaceEncoding.user_id == user_id)
-        
-        face_encodings = query.all()
-        
-        encodings = []
-        user_ids = []
-        
-        for fe in face_encodings:
-            # Convertir de JSON array a numpy array
-            encoding = np.array(fe.encoding_data, dtype=np.float64)
-            encodings.append(encoding)
-            user_ids.append(fe.user_id)
-        
-        return encodings, user_ids
+        return self.gallery.snapshot(db, user_id)
 
 
     # ============================================================
-    # Detectar rostro
+    # Extraer encoding (pool de procesos o en este proceso)
     # ============================================================
-    def _detect_face(self, frame):
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        with FaceRecognitionService._detector_lock:
-            results = self.detector.process(rgb)
-
-        if not results.detections:
-            return None
-
-        h, w, _ = frame.shape
-        box = results.detections[0].location_data.relative_bounding_box
-
-        x1 = int(box.xmin * w)
-        y1 = int(box.ymin * h)
-        x2 = int((box.xmin + box.width) * w)
-        y2 = int((box.ymin + box.height) * h)
-
-        expand = 40
-        x1 = max(0, x1 - expand)
-        y1 = max(0, y1 - expand)
-        x2 = min(w, x2 + expand)
-        y2 = min(h, y2 + expand)
-
-        face = frame[y1:y2, x1:x2]
-
-        if face.size == 0:
-            return None
+    def _extract(self, frame: np.ndarray, require_quality_check: bool = True, debug: bool = False,
+                 detection: Optional[Dict] = None, frame_key: Optional[str] = None) -> Dict:
+        """
+        Args:
+            frame_key: hash de los bytes subidos (encoding_cache.content_key); con él,
+                       un frame repetido reutiliza la extracción ya calculada
+        """
+        cache_keys = self.encoding_cache.keys_for(frame_key, frame, require_quality_check)
+        cached = self.encoding_cache.get(cache_keys)
+        if cached is not None:
+            if debug:
+                cached["timings_ms"] = {"cache_hit": 1}
+            return cached
+
+        if self.engine_pool is not None:
+            try:
+                extraction = self.engine_pool.extract(frame, require_quality_check, debug, detection)
+            except FutureTimeoutError:
+                return {"status": "timeout", "encoding": None, "quality_info": None}
+        else:
+            extraction = self.pipeline.run(frame, require_quality_check, debug, detection=detection)
+
+        self.encoding_cache.put(cache_keys, extraction)
+        return extraction
+
+    def _extract_many(self, frames: List[np.ndarray], require_quality_check: bool = True,
+                      debug: bool = False, frame_keys: Optional[List[Optional[str]]] = None) -> List[Dict]:
+        """
+        Extracción de varios frames: repartidos entre los procesos del pool o, en este
+        proceso, con un solo paso batch de dlib (FacePipeline.run_many).
 
-        return face
+        Args:
+            frame_keys: hash de los bytes subidos de cada frame (como en _extract); los
+                        frames ya vistos salen del caché de encodings. Sin claves solo
+                        se usa el caché con FACE_ENCODING_CACHE_PERCEPTUAL
+        """
+        frame_keys = frame_keys or [None] * len(frames)
+        keys = [self.encoding_cache.keys_for(k, f, require_quality_check) for k, f in zip(frame_keys, frames)]
+        extractions: List[Optional[Dict]] = [self.encoding_cache.get(k) for k in keys]
+        if debug:
+            for extraction in extractions:
+                if extraction is not None:
+                    extraction["timings_ms"] = {"cache_hit": 1}
+
+        pending = [i for i, e in enumerate(extractions) if e is None]
+        if not pending:
+            return extractions
+
+        pending_frames = [frames[i] for i in pending]
+        if self.engine_pool is not None:
+            try:
+                results = self.engine_pool.extract_many(pending_frames, require_quality_check, debug)
+            except FutureTimeoutError:
+                timeout = [{"status": "timeout", "encoding": None, "quality_info": None} for _ in pending_frames]
+                for i, extraction in zip(pending, timeout):
+                    extractions[i] = extraction
+                return extractions
+        else:
+            results = self.pipeline.run_many(pending_frames, require_quality_check, debug)
+
+        for i, extraction in zip(pending, results):
+            self.encoding_cache.put(keys[i], extraction)
+            extractions[i] = extraction
+        return extractions
+
+    def _describe(self, frame: np.ndarray) -> Optional[Dict]:
+        """Caja + descriptor barato (sin dlib). Lanza FutureTimeoutError si el pool no responde."""
+        if self.engine_pool is not None:
+            return self.engine_pool.describe(frame)
+        return self.pipeline.describe(frame)
 
 
     # ============================================================
     # Registrar usuario (guardar en BD)
     # ============================================================
-    def register(self, user_id: int, frame: np.ndarray, capture_method: str = "registration") -> Dict:
+    def register(self, db: Session, user_id: int, frame: np.ndarray, capture_method: str = "registration") -> Dict:
         """
         Registra un nuevo encoding facial en la base de datos
         
@@ -218,73 +197,68 @@ class FaceRecognitionService:
         """
         
         # Verificar que el usuario existe
-        user = self.db.query(models.User).filter(models.User.id == user_id).first()
+        user = db.query(models.User).filter(models.User.id == user_id).first()
         if not user:
             return {
                 "success": False,
                 "message": f"Usuario con ID {user_id} no existe en la base de datos"
             }
         
-        # Evaluar calidad de imagen
-        quality = assess_image_quality(frame)
-        
-        if not quality["is_acceptable"]:
+        # Calidad → detección → alineación → encoding
+        extraction = self._extract(frame, require_quality_check=True)
+        quality = extraction["quality_info"]
+        status = extraction["status"]
+
+        if status == "low_quality":
             return {
                 "success": False,
                 "message": f"Calidad de imagen insuficiente: {', '.join(quality['issues'])}",
                 "quality_info": quality
             }
-        
-        # Detectar rostro
-        face_img = self._detect_face(frame)
 
-        if face_img is None:
+        if status == "no_face":
             return {
                 "success": False,
                 "message": "No se detectó rostro en la imagen",
                 "quality_info": quality
             }
 
-        # Mejorar y alinear imagen
-        face_img = enhance_image(face_img)
-        face_img_rgb = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
-        face_img_aligned = align_face(face_img_rgb)
-
-        # Generar encoding
-        encodings = face_recognition.face_encodings(face_img_aligned)
+        if status == "timeout":
+            return {
+                "success": False,
+                "message": "Tiempo de procesamiento agotado, intenta nuevamente",
+                "quality_info": quality
+            }
 
-        if not encodings:
+        if status != "ok":
             return {
                 "success": False,
                 "message": "No se pudo generar encoding del rostro",
                 "quality_info": quality
             }
 
+        encoding = extraction["encoding"]
+
         # Verificar si el rostro ya está registrado para OTRO usuario
-        all_encodings, all_user_ids = self._load_user_encodings()
-        
-        if all_encodings:
-            distances = face_recognition.face_distance(all_encodings, encodings[0])
-            min_dist_idx = int(np.argmin(distances))
-            min_distance = float(distances[min_dist_idx])
-            
-            if min_distance < self.RECOGNITION_THRESHOLD:
-                existing_user_id = all_user_ids[min_dist_idx]
-                if existing_user_id != user_id:
-                    existing_user = self.db.query(models.User).filter(
-                        models.User.id == existing_user_id
-                    ).first()
-                    return {
-                        "success": False,
-                        "message": f"Este rostro ya está registrado para el usuario '{existing_user.full_name}'",
-                        "quality_info": quality
-                    }
+        # (mismo índice top-k que la identificación, sin recorrer toda la tabla)
+        distances, neighbor_ids = self.gallery.search(db, encoding, k=1)
+        existing_user_id = int(neighbor_ids[0, 0])
+        min_distance = float(distances[0, 0])
+
+        if existing_user_id >= 0 and min_distance < self.RECOGNITION_THRESHOLD and existing_user_id != user_id:
+            existing_name = self.gallery.user_names(db, [existing_user_id]).get(
+                existing_user_id, f"ID {existing_user_id}"
+            )
+            return {
+                "success": False,
+                "message": f"Este rostro ya está registrado para el usuario '{existing_name}'",
+                "quality_info": quality
+            }
 
         # Guardar encoding en base de datos
         face_encoding = models.FaceEncoding(
             user_id=user_id,
-            encoding_data=encodings[0].tolist(),  # Convertir numpy array a lista
-            encoding_version="1.0",
+            **encoding_columns(encoding),  # blob float32 (+ JSON legacy durante el rollover)
             quality_score=quality["score"],
             capture_method=capture_method,
             image_metadata={
@@ -295,12 +269,15 @@ class FaceRecognitionService:
             }
         )
         
-        self.db.add(face_encoding)
-        self.db.commit()
-        self.db.refresh(face_encoding)
+        db.add(face_encoding)
+        db.flush()
+        epoch = bump_gallery_epoch(db)
+        db.commit()
+        db.refresh(face_encoding)
+        self.gallery.add(face_encoding.id, user_id, encoding, epoch)
         
         # Contar encodings del usuario
-        total_encodings = self.db.query(models.FaceEncoding).filter(
+        total_encodings = db.query(models.FaceEncoding).filter(
             models.FaceEncoding.user_id == user_id,
             models.FaceEncoding.is_active == True
         ).count()
@@ -317,45 +294,172 @@ class FaceRecognitionService:
 
 
     # ============================================================
-    # Reconocer usuario
+    # Enrolar usuario con una ráfaga de frames
     # ============================================================
-    def recognize(
-        self,
-        frame: np.ndarray,
-        require_quality_check: bool = True,
-        expected_user_id: Optional[int] = None,
-    ) -> Dict:
-        if require_quality_check:
-            quality = assess_image_quality(frame)
-            if not quality["is_acceptable"]:
-                return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "Calidad insuficiente", "quality_info": quality}
+    def enroll(self, db: Session, user_id: int, frames: List[np.ndarray], max_samples: int = ENROLL_MAX_SAMPLES,
+               capture_method: str = "enrollment", frame_keys: Optional[List[Optional[str]]] = None) -> Dict:
+        """
+        Registra varias muestras de una sola vez.
 
-        # ✅ recorte rápido con MediaPipe
-        face_img = self._detect_face(frame)
-        if face_img is None:
-            return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "No se detectó rostro"}
+        1. Calidad de todos los frames; se eligen los max_samples mejores y distintos entre sí
+        2. Encoding solo de los elegidos (en paralelo si hay pool de procesos)
+        3. Se descartan muestras que no se parecen al resto (otra persona en la ráfaga)
+        4. Chequeo de duplicado contra otros usuarios con una búsqueda top-1 por lote
+        5. Inserción de todas las muestras en una sola transacción (un solo epoch)
 
-        # ✅ mismo pipeline del registro
-        face_img = enhance_image(face_img)
-        face_rgb = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
-        face_aligned = align_face(face_rgb)
+        Returns:
+            Dict con success, message, encoding_ids y detalle por frame
+        """
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if not user:
+            return {
+                "success": False,
+                "message": f"Usuario con ID {user_id} no existe en la base de datos"
+            }
 
-        # ahora el encoding se hace sobre un recorte chico (más rápido y estable)
-        locations = face_recognition.face_locations(face_aligned, model="hog")
-        if not locations:
-            return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "No se detectó rostro (recorte)"}
+        selected, qualities = select_enrollment_frames(frames, max(1, max_samples))
+        frame_results = [
+            {"index": i, "quality_score": q["score"], "issues": q["issues"], "status": "not_selected"}
+            for i, q in enumerate(qualities)
+        ]
+        for i, q in enumerate(qualities):
+            if not q["is_acceptable"]:
+                frame_results[i]["status"] = "low_quality"
 
-        encodings = face_recognition.face_encodings(face_aligned, locations)
-        if not encodings:
-            return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "No se pudo generar encoding"}
+        if not selected:
+            return {
+                "success": False,
+                "message": "Ningún frame tiene calidad suficiente",
+                "frames": frame_results
+            }
 
-        encoding = encodings[0]
+        # La calidad ya se evaluó al seleccionar
+        extractions = self._extract_many(
+            [frames[i] for i in selected], require_quality_check=False,
+            frame_keys=[frame_keys[i] for i in selected] if frame_keys else None,
+        )
 
-        # Cargar encodings de la base de datos
-        # Si se especifica expected_user_id, solo comparamos contra ese usuario (más rápido y escalable).
-        all_encodings, all_user_ids = self._load_user_encodings(expected_user_id)
+        ok = []
+        for i, extraction in zip(selected, extractions):
+            frame_results[i]["status"] = extraction["status"]
+            if extraction["status"] == "ok":
+                ok.append(i)
+        if not ok:
+            return {
+                "success": False,
+                "message": "No se detectó rostro en los frames seleccionados",
+                "frames": frame_results
+            }
 
-        if not all_encodings:
+        by_index = dict(zip(selected, extractions))
+        encodings = np.stack([np.asarray(by_index[i]["encoding"], dtype=np.float32) for i in ok])
+
+        # Consistencia interna: cada muestra contra el promedio de las demás
+        if len(ok) > 2:
+            totals = encodings.sum(axis=0)
+            others_mean = (totals[None, :] - encodings) / (len(ok) - 1)
+            spread = np.linalg.norm(encodings - others_mean, axis=1)
+            consistent = spread <= self.RECOGNITION_THRESHOLD
+            for i, keep in zip(ok, consistent):
+                if not keep:
+                    frame_results[i]["status"] = "inconsistent"
+            ok = [i for i, keep in zip(ok, consistent) if keep]
+            encodings = encodings[consistent]
+            if not ok:
+                return {
+                    "success": False,
+                    "message": "Los frames no parecen ser de la misma persona",
+                    "frames": frame_results
+                }
+
+        # Duplicado: alguna muestra pertenece a OTRO usuario
+        distances, neighbor_ids = self.gallery.search(db, encodings, k=1)
+        conflict = (neighbor_ids[:, 0] >= 0) & (neighbor_ids[:, 0] != user_id) & (distances[:, 0] < self.RECOGNITION_THRESHOLD)
+        if conflict.any():
+            existing_user_id = int(neighbor_ids[np.flatnonzero(conflict)[0], 0])
+            existing_name = self.gallery.user_names(db, [existing_user_id]).get(
+                existing_user_id, f"ID {existing_user_id}"
+            )
+            return {
+                "success": False,
+                "message": f"Este rostro ya está registrado para el usuario '{existing_name}'",
+                "frames": frame_results
+            }
+
+        rows = []
+        for i, encoding in zip(ok, encodings):
+            quality = qualities[i]
+            rows.append(models.FaceEncoding(
+                user_id=user_id,
+                **encoding_columns(by_index[i]["encoding"]),
+                quality_score=quality["score"],
+                capture_method=capture_method,
+                image_metadata={
+                    "brightness": float(quality["brightness"]),
+                    "sharpness": float(quality["sharpness"]),
+                    "contrast": float(quality["contrast"]),
+                    "size": quality["size"]
+                }
+            ))
+
+        try:
+            db.add_all(rows)
+            db.flush()
+            epoch = bump_gallery_epoch(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Error guardando enrolamiento: {e}")
+            return {"success": False, "message": "No se pudieron guardar las muestras", "frames": frame_results}
+
+        encoding_ids = [row.id for row in rows]
+        self.gallery.add_many(encoding_ids, user_id, encodings, epoch)
+        for i in ok:
+            frame_results[i]["status"] = "saved"
+
+        total_encodings = db.query(models.FaceEncoding).filter(
+            models.FaceEncoding.user_id == user_id,
+            models.FaceEncoding.is_active == True
+        ).count()
+
+        print(f"✅ {len(rows)} encodings guardados en BD para usuario {user.full_name} (ID: {user_id})")
+
+        return {
+            "success": True,
+            "message": f"Rostro enrolado con {len(rows)} muestras ({total_encodings} en total)",
+            "encoding_ids": encoding_ids,
+            "total_encodings": total_encodings,
+            "frames": frame_results
+        }
+
+
+    # ============================================================
+    # Reconocer usuario
+    # ============================================================
+    @staticmethod
+    def _extraction_failure(extraction: Dict) -> Optional[Dict]:
+        """Respuesta de recognize cuando no se obtuvo encoding (None si hay encoding)"""
+        status = extraction["status"]
+
+        if status == "ok":
+            return None
+        if status == "low_quality":
+            return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "Calidad insuficiente", "quality_info": extraction["quality_info"]}
+        if status == "no_face":
+            return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "No se detectó rostro"}
+        if status == "no_face_crop":
+            return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "No se detectó rostro (recorte)"}
+        if status == "timeout":
+            return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "Tiempo de procesamiento agotado"}
+        return {"found": False, "user": None, "user_id": None, "confidence": 0, "message": "No se pudo generar encoding"}
+
+    def _match_decision(self, distances: np.ndarray, neighbor_ids: np.ndarray,
+                        expected_user_id: Optional[int] = None) -> Dict:
+        """
+        Aplica umbral, confianza mínima y margen sobre los 2 mejores vecinos.
+        En un match deja user_id y "user" pendiente de resolver (_attach_user_names).
+        """
+        if neighbor_ids[0] < 0:
             return {
                 "found": True,
                 "user": None,
@@ -364,14 +468,9 @@ class FaceRecognitionService:
                 "message": "No hay usuarios registrados" if expected_user_id is None else "Usuario sin encodings registrados"
             }
 
-        # Calcular distancias
-        distances = face_recognition.face_distance(all_encodings, encoding)
-        
-        # Obtener mejores matches
-        sorted_indices = np.argsort(distances)
-        best_idx = sorted_indices[0]
-        best_distance = float(distances[best_idx])
-        best_user_id = all_user_ids[best_idx]
+        # Mejor match
+        best_distance = float(distances[0])
+        best_user_id = int(neighbor_ids[0])
         
         # Calcular confianza
         confidence = max(0.0, 1.0 - best_distance)
@@ -399,10 +498,9 @@ class FaceRecognitionService:
             }
         
         # VALIDACIÓN 3: Margen de seguridad
-        if len(sorted_indices) > 1:
-            second_best_idx = sorted_indices[1]
-            second_best_distance = float(distances[second_best_idx])
-            second_best_user_id = all_user_ids[second_best_idx]
+        if len(neighbor_ids) > 1 and neighbor_ids[1] >= 0:
+            second_best_distance = float(distances[1])
+            second_best_user_id = int(neighbor_ids[1])
             
             if second_best_user_id != best_user_id:
                 margin = second_best_distance - best_distance
@@ -418,53 +516,296 @@ class FaceRecognitionService:
                         "ambiguous": True
                     }
 
-        # ✅ MATCH EXITOSO - Obtener datos del usuario
-        user = self.db.query(models.User).filter(models.User.id == best_user_id).first()
-        
-        if not user:
-            return {
-                "found": True,
-                "user": None,
-                "user_id": None,
-                "confidence": confidence,
-                "message": "Usuario encontrado pero no existe en BD"
-            }
-        
-        print(f"✅ MATCH | user={user.full_name} (ID:{user.id}) | dist={best_distance:.3f} | conf={confidence:.3f}")
-        
         return {
             "found": True,
-            "user": user.full_name,
-            "user_id": user.id,
+            "user": None,
+            "user_id": best_user_id,
             "confidence": confidence,
             "distance": best_distance,
             "message": "Usuario reconocido exitosamente"
         }
 
+    def _attach_user_names(self, db: Session, results: List[Dict]) -> None:
+        """Completa "user" de los matches (caché de nombres + una sola consulta para los que falten)"""
+        user_ids = {r["user_id"] for r in results if r.get("user_id") is not None}
+        if not user_ids:
+            return
+
+        names = self.gallery.user_names(db, user_ids)
+        for r in results:
+            user_id = r.get("user_id")
+            if user_id is None:
+                continue
+            if user_id not in names:
+                r.update({
+                    "user": None,
+                    "user_id": None,
+                    "message": "Usuario encontrado pero no existe en BD"
+                })
+                r.pop("distance", None)
+                continue
+            r["user"] = names[user_id]
+
+    def recognize(
+        self,
+        db: Session,
+        frame: np.ndarray,
+        require_quality_check: bool = True,
+        expected_user_id: Optional[int] = None,
+        debug: bool = False,
+        detection: Optional[Dict] = None,
+        frame_key: Optional[str] = None,
+    ) -> Dict:
+        """
+        Con debug (o FACE_PIPELINE_DEBUG=1) la respuesta incluye "timings_ms":
+        etapas del pipeline + extract (incluye IPC del pool) + search + total.
+        Con frame_key (hash de los bytes) se usa el caché de encodings.
+        """
+        debug = debug or PIPELINE_DEBUG
+        start = time.perf_counter()
+
+        extraction = self._extract(frame, require_quality_check, debug, detection, frame_key)
+        extract_ms = (time.perf_counter() - start) * 1000.0
+        timings = dict(extraction.get("timings_ms") or {})
+        timings["extract"] = round(extract_ms, 2)
+
+        failure = self._extraction_failure(extraction)
+        if failure is not None:
+            result = failure
+        else:
+            search_start = time.perf_counter()
+            result = self.recognize_encoding(db, extraction["encoding"], expected_user_id)
+            timings["search"] = round((time.perf_counter() - search_start) * 1000.0, 2)
+
+        if debug:
+            timings["total"] = round((time.perf_counter() - start) * 1000.0, 2)
+            result["timings_ms"] = timings
+        return result
+
+
+    def recognize_encoding(self, db: Session, encoding: np.ndarray,
+                           expected_user_id: Optional[int] = None) -> Dict:
+        """
+        Decisión de reconocimiento para un encoding ya extraído
+        (búsqueda en la galería + umbrales + nombre del usuario).
+        """
+        # Buscar los 2 vecinos más cercanos en la galería (backend según FACE_SEARCH_BACKEND).
+        # Si se especifica expected_user_id, solo comparamos contra ese usuario (más rápido y escalable).
+        distances, neighbor_ids = self.gallery.search(db, encoding, k=2, user_id=expected_user_id)
+        result = self._match_decision(distances[0], neighbor_ids[0], expected_user_id)
+        self._attach_user_names(db, [result])
+        return result
+
+
+    # ============================================================
+    # Chequeo de presencia (usuario ya logueado)
+    # ============================================================
+    def check_presence(
+        self,
+        db: Session,
+        frame: np.ndarray,
+        expected_user_id: int,
+        session_key: Optional[str] = None,
+        debug: bool = False,
+        frame_key: Optional[str] = None,
+    ) -> Dict:
+        """
+        Verificación periódica de que sigue frente a la cámara el usuario esperado.
+
+        Si la caja MediaPipe y el parche del rostro coinciden con el último frame
+        verificado, responde "presente" sin correr dlib. Se vuelve a la verificación
+        1:1 completa cada FACE_PRESENCE_VERIFY_SECONDS o cuando el frame se aleja
+        de la referencia (movimiento, otra persona, cámara tapada).
+
+        El seguimiento requiere session_key (un id por cliente): sin él cada poll
+        hace la verificación completa.
+        """
+        if not PRESENCE_TRACKING or not session_key:
+            return self.recognize(db, frame, True, expected_user_id, debug, frame_key=frame_key)
+
+        debug = debug or PIPELINE_DEBUG
+        start = time.perf_counter()
+        key = (expected_user_id, session_key)
+
+        try:
+            described = self._describe(frame)
+        except FutureTimeoutError:
+            return self._extraction_failure({"status": "timeout"})
+        if described is None:
+            self.presence.reset(key)
+            return self._extraction_failure({"status": "no_face"})
+
+        box = described["detection"]["box"]
+        tracked = self.presence.match(key, box, described["descriptor"])
+        if tracked is not None:
+            result = {**tracked, "tracked": True, "message": "Usuario presente (seguimiento)"}
+            if debug:
+                result["timings_ms"] = {"total": round((time.perf_counter() - start) * 1000.0, 2)}
+            return result
+
+        # Verificación completa reutilizando la detección ya hecha
+        result = self.recognize(
+            db, frame, True, expected_user_id, debug, detection=described["detection"], frame_key=frame_key
+        )
+        if result.get("found") and result.get("user_id") == expected_user_id:
+            reference = {k: result[k] for k in ("found", "user", "user_id", "confidence") if k in result}
+            self.presence.verified(key, box, described["descriptor"], reference)
+        else:
+            self.presence.reset(key)
+        result["tracked"] = False
+        return result
+
+
+    # ============================================================
+    # Reconocer usuario con varios frames (ráfaga)
+    # ============================================================
+    def recognize_batch(
+        self,
+        db: Session,
+        frames: List[np.ndarray],
+        require_quality_check: bool = True,
+        expected_user_id: Optional[int] = None,
+        fusion: str = "mean",
+        debug: bool = False,
+        frame_keys: Optional[List[Optional[str]]] = None,
+    ) -> Dict:
+        """
+        Reconoce una ráfaga de frames con una sola consulta a la galería.
+
+        Args:
+            frames: Lista de frames BGR
+            fusion: "mean" (usuario con menor distancia media entre frames) o
+                    "majority" (usuario con mayoría absoluta de los frames válidos)
+            frame_keys: hash de los bytes subidos de cada frame (encoding_cache.content_key)
+
+        Returns:
+            Dict con la decisión fusionada (mismas claves que recognize) + "frames"
+            (con debug, cada frame incluye sus "timings_ms")
+        """
+        debug = debug or PIPELINE_DEBUG
+
+        # Calidad de toda la ráfaga en una pasada; solo se extraen los frames aceptables
+        extractions: List[Optional[Dict]] = [None] * len(frames)
+        pending = list(range(len(frames)))
+        if require_quality_check:
+            for i, record in enumerate(assess_image_quality_records(frames)):
+                if not record["is_acceptable"]:
+                    extractions[i] = {"status": "low_quality", "encoding": None, "quality_info": quality_info(record)}
+            pending = [i for i in pending if extractions[i] is None]
+
+        results = self._extract_many(
+            [frames[i] for i in pending], False, debug,
+            [frame_keys[i] for i in pending] if frame_keys else None,
+        )
+        for i, extraction in zip(pending, results):
+            extractions[i] = extraction
+
+        frame_results: List[Optional[Dict]] = [self._extraction_failure(e) for e in extractions]
+        valid = [i for i, r in enumerate(frame_results) if r is None]
+
+        if not valid:
+            # Ningún frame útil: se devuelve el motivo del primero
+            fused = dict(frame_results[0]) if frame_results else {
+                "found": False, "user": None, "user_id": None, "confidence": 0, "message": "Sin frames"
+            }
+            return {**fused, "fusion": fusion, "valid_frames": 0, "frames": frame_results}
+
+        encodings = np.stack([np.asarray(extractions[i]["encoding"], dtype=np.float32) for i in valid])
+
+        # Una sola búsqueda para todos los frames
+        distances, neighbor_ids = self.gallery.search(db, encodings, k=2, user_id=expected_user_id)
+
+        for row, i in enumerate(valid):
+            frame_results[i] = self._match_decision(distances[row], neighbor_ids[row], expected_user_id)
+
+        per_frame = [frame_results[i] for i in valid]
+        if fusion == "mean":
+            fused = self._mean_distance_decision(db, encodings, neighbor_ids, expected_user_id)
+        else:
+            fused = self._majority_decision(per_frame)
+
+        self._attach_user_names(db, frame_results + [fused])
+        if debug:
+            for frame_result, extraction in zip(frame_results, extractions):
+                frame_result["timings_ms"] = extraction.get("timings_ms") or {}
+        return {**fused, "fusion": fusion, "valid_frames": len(valid), "frames": frame_results}
+
+    def _mean_distance_decision(self, db: Session, encodings: np.ndarray, neighbor_ids: np.ndarray,
+                                expected_user_id: Optional[int] = None) -> Dict:
+        """
+        Candidatos = usuarios que aparecen en el top-2 de algún frame. Para cada uno se
+        promedia (entre frames) la distancia a su muestra más cercana y se aplica la
+        misma decisión que a un frame individual sobre los dos mejores promedios.
+        """
+        candidates = np.unique(neighbor_ids[neighbor_ids >= 0])
+        if candidates.size == 0:
+            return self._match_decision(np.array([np.inf]), np.array([-1]), expected_user_id)
+
+        matrix, user_ids = self._load_user_encodings(db, expected_user_id)
+        means = np.empty(candidates.size, dtype=np.float32)
+        for j, candidate in enumerate(candidates):
+            rows = matrix[user_ids == candidate]
+            d = np.sqrt(((encodings[:, None, :] - rows[None, :, :]) ** 2).sum(axis=2))
+            means[j] = d.min(axis=1).mean()
+
+        order = np.argsort(means)[:2]
+        return self._match_decision(means[order], candidates[order], expected_user_id)
+
+    @staticmethod
+    def _majority_decision(per_frame: List[Dict]) -> Dict:
+        votes: Dict[int, List[Dict]] = {}
+        for r in per_frame:
+            if r.get("user_id") is not None:
+                votes.setdefault(r["user_id"], []).append(r)
+
+        if votes:
+            user_id, hits = max(votes.items(), key=lambda kv: len(kv[1]))
+            if len(hits) * 2 > len(per_frame):
+                return {
+                    "found": True,
+                    "user": None,
+                    "user_id": user_id,
+                    "confidence": float(np.mean([r["confidence"] for r in hits])),
+                    "distance": float(np.mean([r["distance"] for r in hits])),
+                    "votes": len(hits),
+                    "message": "Usuario reconocido exitosamente"
+                }
+
+        return {
+            "found": True,
+            "user": None,
+            "user_id": None,
+            "confidence": float(np.mean([r.get("confidence", 0) for r in per_frame])),
+            "message": "Sin mayoría entre los frames",
+            "ambiguous": len(votes) > 1
+        }
+
 
     # ============================================================
     # Agregar encoding adicional
     # ============================================================
-    def add_encoding(self, user_id: int, frame: np.ndarray) -> Dict:
+    def add_encoding(self, db: Session, user_id: int, frame: np.ndarray) -> Dict:
         """Agrega una muestra adicional a un usuario existente"""
-        return self.register(user_id, frame, capture_method="improvement")
+        return self.register(db, user_id, frame, capture_method="improvement")
 
 
     # ============================================================
     # Eliminar encodings de usuario
     # ============================================================
-    def remove_user_encodings(self, user_id: int) -> bool:
+    def remove_user_encodings(self, db: Session, user_id: int) -> bool:
         """Marca como inactivos todos los encodings de un usuario (soft delete)"""
         try:
-            self.db.query(models.FaceEncoding).filter(
+            db.query(models.FaceEncoding).filter(
                 models.FaceEncoding.user_id == user_id
             ).update({"is_active": False})
             
-            self.db.commit()
+            epoch = bump_gallery_epoch(db)
+            db.commit()
+            self.gallery.remove_user(user_id, epoch)
             print(f"✅ Encodings desactivados para usuario ID: {user_id}")
             return True
         except Exception as e:
-            self.db.rollback()
+            db.rollback()
             print(f"❌ Error desactivando encodings: {e}")
             return False
 
@@ -472,16 +813,16 @@ class FaceRecognitionService:
     # ============================================================
     # Estadísticas
     # ============================================================
-    def get_stats(self) -> Dict:
+    def get_stats(self, db: Session) -> Dict:
         """Retorna estadísticas del sistema desde la base de datos"""
         
         # Total de usuarios con encodings
-        total_users = self.db.query(models.FaceEncoding.user_id).filter(
+        total_users = db.query(models.FaceEncoding.user_id).filter(
             models.FaceEncoding.is_active == True
         ).distinct().count()
         
         # Total de encodings activos
-        total_encodings = self.db.query(models.FaceEncoding).filter(
+        total_encodings = db.query(models.FaceEncoding).filter(
             models.FaceEncoding.is_active == True
         ).count()
         
@@ -489,7 +830,7 @@ class FaceRecognitionService:
         avg_encodings = total_encodings / total_users if total_users > 0 else 0
         
         # Usuarios con encodings
-        users_with_encodings = self.db.query(
+        users_with_encodings = db.query(
             models.User.id, 
             models.User.full_name
         ).join(models.FaceEncoding).filter(
@@ -506,5 +847,89 @@ class FaceRecognitionService:
                 "min_confidence": self.MIN_CONFIDENCE,
                 "margin_threshold": self.MARGIN_THRESHOLD
             },
-            "storage": "PostgreSQL Database"
-        }
\ No newline at end of file
+            "storage": "PostgreSQL Database",
+            **self.runtime_stats(),
+        }
+
+    def runtime_stats(self) -> Dict:
+        """Contadores del worker (sin datos de usuarios): galería, presencia y caché de encodings"""
+        return {
+            "gallery": {
+                **self.gallery.stats(),
+                "prototype_drift": self.gallery.prototype_drift(self.RECOGNITION_THRESHOLD),
+            },
+            "presence": self.presence.stats(),
+            "encoding_cache": self.encoding_cache.stats(),
+        }
+
+
+_service: Optional[FaceRecognitionService] = None
+_service_lock = threading.Lock()
+
+
+def get_face_recognition_service() -> FaceRecognitionService:
+    """Motor compartido por todo el proceso (un worker de uvicorn)"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = FaceRecognitionService()
+    return _service
+
+
+# ============================================================
+# Warm-up del worker
+# ============================================================
+_warmup_lock = threading.Lock()
+_warmup_state: Dict = {"status": "pending", "stages_ms": {}, "error": None}
+
+
+def warm_up_face_service(db: Optional[Session] = None) -> Dict:
+    """
+    Deja el worker listo antes del primer request:
+    detector MediaPipe (o procesos del pool), encode de prueba con dlib y,
+    si hay sesión de BD, carga de la galería en memoria.
+    """
+    with _warmup_lock:
+        if _warmup_state["status"] in ("warming", "ready"):
+            return dict(_warmup_state)
+        _warmup_state.update({"status": "warming", "stages_ms": {}, "error": None})
+
+    stages: Dict[str, float] = {}
+    start = time.perf_counter()
+    try:
+        stage_start = time.perf_counter()
+        pool = get_face_engine_pool()
+        if pool is not None:
+            # Cada proceso crea su detector y hace su encode de prueba al iniciar
+            get_face_recognition_service()
+            pool.warm_up()
+            stages["engine_pool"] = round((time.perf_counter() - stage_start) * 1000.0, 2)
+        else:
+            pipeline = get_face_recognition_service().pipeline
+            stages["detector"] = round((time.perf_counter() - stage_start) * 1000.0, 2)
+            stage_start = time.perf_counter()
+            pipeline.warm_up()
+            stages["encode"] = round((time.perf_counter() - stage_start) * 1000.0, 2)
+
+        if db is not None:
+            stage_start = time.perf_counter()
+            get_face_gallery().ensure_fresh(db, force=True)
+            stages["gallery"] = round((time.perf_counter() - stage_start) * 1000.0, 2)
+
+        stages["total"] = round((time.perf_counter() - start) * 1000.0, 2)
+        with _warmup_lock:
+            _warmup_state.update({"status": "ready", "stages_ms": stages, "ready_at": datetime.utcnow().isoformat()})
+        print(f"🔥 Reconocimiento facial listo en {stages['total']:.0f} ms {stages}")
+    except Exception as e:
+        with _warmup_lock:
+            _warmup_state.update({"status": "failed", "stages_ms": stages, "error": str(e)})
+        print(f"❌ Warm-up de reconocimiento facial falló: {e}")
+
+    return face_readiness()
+
+
+def face_readiness() -> Dict:
+    """Estado del warm-up: pending | warming | ready | failed"""
+    with _warmup_lock:
+        return {**_warmup_state, "stages_ms": dict(_warmup_state["stages_ms"])}
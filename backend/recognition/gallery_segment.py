@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# =====================================================
+#  GALLERY SEGMENT - Galería facial en memoria compartida
+#  Un archivo por epoch en /dev/shm (tmpfs): el primer
+#  worker que ve el epoch lo publica y el resto lo mapea
+#  en solo lectura, así la RAM no crece con WEB_CONCURRENCY
+# =====================================================
+
+import contextlib
+import glob
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+
+from backend.recognition.encoding_format import ENCODING_DIM, ENCODING_DTYPE
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos (cada worker carga desde BD si hace falta)
+    fcntl = None
+
+
+def _default_dir() -> str:
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+SEGMENT_DIR = (os.getenv("FACE_GALLERY_SHM_DIR") or "").strip() or _default_dir()
+# Prefijo de los archivos; incluye un hash de DATABASE_URL para que dos entornos
+# en el mismo host (staging/producción) no compartan segmentos
+SEGMENT_PREFIX = "{}_{}".format(
+    (os.getenv("FACE_GALLERY_SHM_NAME") or "face_gallery").strip(),
+    hashlib.blake2b((os.getenv("DATABASE_URL") or "").encode(), digest_size=4).hexdigest(),
+)
+
+# Cabecera: magic, epoch, filas, dim, id máximo de encoding (huella frente a la BD)
+_MAGIC = b"FGSEG001"
+_HEADER = struct.Struct("<8sqqIxxxxq")
+_HEADER_SIZE = 64  # la matriz empieza alineada
+_IDS_DTYPE = np.dtype("<i8")
+
+GalleryArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def segment_path(epoch: int) -> str:
+    return os.path.join(SEGMENT_DIR, f"{SEGMENT_PREFIX}_{epoch}.seg")
+
+
+def _segment_epoch(path: str) -> Optional[int]:
+    try:
+        return int(os.path.basename(path)[len(SEGMENT_PREFIX) + 1:-len(".seg")])
+    except ValueError:
+        return None
+
+
+@contextlib.contextmanager
+def loader_lock():
+    """Lock exclusivo entre workers: solo uno consulta la BD y publica cada epoch"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(SEGMENT_DIR, f"{SEGMENT_PREFIX}.lock"), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def publish(epoch: int, matrix: np.ndarray, user_ids: np.ndarray, encoding_ids: np.ndarray) -> str:
+    """
+    Escribe el segmento del epoch (archivo temporal + rename atómico: un lector
+    nunca ve un segmento a medio escribir) y borra los de epochs anteriores.
+    Los workers que todavía mapean un segmento borrado lo siguen leyendo sin problema.
+    """
+    n = int(matrix.shape[0])
+    max_id = int(encoding_ids.max()) if n else 0
+    path = segment_path(epoch)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{SEGMENT_PREFIX}_", dir=SEGMENT_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, epoch, n, ENCODING_DIM, max_id).ljust(_HEADER_SIZE, b"\0"))
+            f.write(np.ascontiguousarray(matrix, dtype=ENCODING_DTYPE).tobytes())
+            f.write(np.ascontiguousarray(user_ids, dtype=_IDS_DTYPE).tobytes())
+            f.write(np.ascontiguousarray(encoding_ids, dtype=_IDS_DTYPE).tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+    for old in glob.glob(os.path.join(SEGMENT_DIR, f"{SEGMENT_PREFIX}_*.seg")):
+        old_epoch = _segment_epoch(old)
+        if old_epoch is not None and old_epoch < epoch:
+            with contextlib.suppress(OSError):
+                os.unlink(old)
+    return path
+
+
+def attach(epoch: int, fingerprint: Optional[Tuple[int, int]] = None) -> Optional[GalleryArrays]:
+    """
+    Mapea en solo lectura el segmento del epoch.
+
+    Args:
+        fingerprint: (filas, id máximo) esperados según la BD; si no coinciden
+            (p. ej. BD recreada con el mismo epoch) el segmento se ignora
+
+    Returns:
+        (matriz [n, 128] float32, user_ids [n], encoding_ids [n]) como vistas sobre
+        el mapeo, o None si el segmento no existe o no es válido
+    """
+    try:
+        with open(segment_path(epoch), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mm) < _HEADER_SIZE:
+        return None
+    magic, seg_epoch, n, dim, max_id = _HEADER.unpack_from(mm, 0)
+    expected = _HEADER_SIZE + n * dim * ENCODING_DTYPE.itemsize + 2 * n * _IDS_DTYPE.itemsize
+    if magic != _MAGIC or seg_epoch != epoch or dim != ENCODING_DIM or len(mm) != expected:
+        return None
+    if fingerprint is not None and tuple(fingerprint) != (n, max_id):
+        return None
+
+    # Las vistas mantienen vivo el mmap; se libera cuando ninguna galería las usa
+    offset = _HEADER_SIZE
+    matrix = np.frombuffer(mm, dtype=ENCODING_DTYPE, count=n * dim, offset=offset).reshape(n, dim)
+    offset += matrix.nbytes
+    user_ids = np.frombuffer(mm, dtype=_IDS_DTYPE, count=n, offset=offset)
+    offset += user_ids.nbytes
+    encoding_ids = np.frombuffer(mm, dtype=_IDS_DTYPE, count=n, offset=offset)
+    return matrix, user_ids, encoding_ids
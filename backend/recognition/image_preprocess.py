@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# =====================================================
+#  IMAGE PREPROCESS - Decodificación y reescalado
+#  Los frames del navegador llegan a la resolución de la
+#  cámara; acá se acotan antes de calidad y detección
+# =====================================================
+
+import os
+import struct
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# Lado mayor objetivo al decodificar (IMREAD_REDUCED_* 1/2, 1/4, 1/8). 0 = resolución original.
+# Opt-in: con un valor > 0 calidad, recorte y encoding corren sobre el frame reducido
+# (umbrales y galería están calibrados a resolución completa). La detección ya usa
+# una copia reducida (FACE_DETECT_MAX_SIDE) sin necesidad de esto
+DECODE_MAX_SIDE = max(0, _env_int("FACE_DECODE_MAX_SIDE", 0))
+# Lado mayor de la imagen gris usada para las métricas de calidad. 0 = sin reescalar
+# (por defecto: los umbrales de nitidez se calibraron a resolución completa)
+QUALITY_MAX_SIDE = max(0, _env_int("FACE_QUALITY_MAX_SIDE", 0))
+# Lado mayor de la imagen que recibe MediaPipe (las cajas son relativas). 0 = sin reescalar
+DETECT_MAX_SIDE = max(0, _env_int("FACE_DETECT_MAX_SIDE", 640))
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Marcadores SOF de JPEG (excepto DHT=C4, JPG=C8, DAC=CC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(ancho, alto) leyendo solo la cabecera JPEG/PNG, sin decodificar. None si no se reconoce."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        width, height = struct.unpack(">II", data[16:24])
+        return width, height
+
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    i, n = 2, len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (length,) = struct.unpack(">H", data[i + 2:i + 4])
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def reduction_factor(size: Optional[Tuple[int, int]], max_side: int = DECODE_MAX_SIDE) -> int:
+    """Mayor factor 1/2/4/8 que deja el lado mayor todavía >= max_side"""
+    if not size or max_side <= 0:
+        return 1
+    longest = max(size)
+    for factor, _ in _REDUCED_FLAGS:
+        if longest // factor >= max_side:
+            return factor
+    return 1
+
+
+def decode_frame(data: bytes, max_side: int = DECODE_MAX_SIDE) -> Optional[np.ndarray]:
+    """
+    cv2.imdecode; con max_side > 0 (FACE_DECODE_MAX_SIDE, opt-in) decodifica a
+    escala reducida cuando la imagen lo supera. Con JPEG el decodificador escala
+    en el dominio DCT (más rápido que decodificar y reducir).
+    """
+    buf = np.frombuffer(data, np.uint8)
+    factor = reduction_factor(image_size(data), max_side)
+    if factor > 1:
+        frame = cv2.imdecode(buf, dict(_REDUCED_FLAGS)[factor])
+        if frame is not None:
+            return frame
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def downscale(image: np.ndarray, max_side: int) -> np.ndarray:
+    """Reduce (INTER_AREA) hasta que el lado mayor sea max_side; nunca agranda"""
+    h, w = image.shape[:2]
+    longest = max(h, w)
+    if max_side <= 0 or longest <= max_side:
+        return image
+    scale = max_side / float(longest)
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def dhash_bits(image: np.ndarray, size: int = 16) -> np.ndarray:
+    """dHash: size x size bits (gradiente horizontal del gris reducido), bool [size*size]"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    return (small[:, 1:] > small[:, :-1]).ravel()
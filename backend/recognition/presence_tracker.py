@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# =====================================================
+#  PRESENCE TRACKER - Atajo para /face/recognize/check
+#  Mientras la caja y el parche del rostro coincidan con
+#  el último frame verificado, no se vuelve a correr dlib
+# =====================================================
+
+import os
+import threading
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+PRESENCE_TRACKING = (os.getenv("FACE_PRESENCE_TRACKING") or "1").strip() == "1"
+# Verificación 1:1 completa como mínimo cada N segundos
+PRESENCE_VERIFY_SECONDS = _env_float("FACE_PRESENCE_VERIFY_SECONDS", 10.0)
+# Tolerancias respecto al último frame verificado (no al último visto: así la deriva se acumula)
+PRESENCE_MIN_IOU = _env_float("FACE_PRESENCE_MIN_IOU", 0.5)
+PRESENCE_MIN_SIMILARITY = _env_float("FACE_PRESENCE_MIN_SIMILARITY", 0.85)
+# Sesiones sin polls durante este tiempo se descartan
+PRESENCE_IDLE_SECONDS = _env_float("FACE_PRESENCE_IDLE_SECONDS", 120.0)
+
+
+def box_iou(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> float:
+    """IoU de dos cajas (x1, y1, x2, y2)"""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class PresenceTracker:
+    """
+    Estado por (user_id, sesión): caja + descriptor del último frame que pasó
+    la verificación completa. Vive en memoria del worker; si el poll cae en otro
+    worker simplemente se hace una verificación completa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[Hashable, Dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _evict_idle(self, now: float) -> None:
+        stale = [k for k, s in self._states.items() if now - s["last_seen"] > PRESENCE_IDLE_SECONDS]
+        for key in stale:
+            del self._states[key]
+
+    def match(self, key: Hashable, box, descriptor: np.ndarray) -> Optional[Dict]:
+        """
+        Returns:
+            El último resultado verificado si el frame sigue dentro de tolerancia
+            y la verificación no venció; None si hay que verificar de nuevo.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None or now - state["verified_at"] > PRESENCE_VERIFY_SECONDS:
+                self.misses += 1
+                return None
+
+            similarity = float(np.dot(descriptor, state["descriptor"]))
+            if box_iou(box, state["box"]) < PRESENCE_MIN_IOU or similarity < PRESENCE_MIN_SIMILARITY:
+                self.misses += 1
+                return None
+
+            state["last_seen"] = now
+            self.hits += 1
+            return {**state["result"], "similarity": round(similarity, 4)}
+
+    def verified(self, key: Hashable, box, descriptor: np.ndarray, result: Dict) -> None:
+        """Guarda el frame que acaba de pasar la verificación 1:1 completa"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            self._states[key] = {
+                "box": tuple(box),
+                "descriptor": descriptor,
+                "result": result,
+                "verified_at": now,
+                "last_seen": now,
+            }
+
+    def reset(self, key: Hashable) -> None:
+        with self._lock:
+            self._states.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": PRESENCE_TRACKING,
+                "sessions": len(self._states),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_tracker = PresenceTracker()
+
+
+def get_presence_tracker() -> PresenceTracker:
+    """Tracker compartido por todo el proceso (un worker de uvicorn)"""
+    return _tracker
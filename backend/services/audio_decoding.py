@@ -0,0 +1,380 @@
+# =====================================================
+#  DECODIFICACIÓN DE AUDIO
+#  ffmpeg por pipes (stdin → PCM crudo en stdout) directo
+#  a un buffer NumPy, sin archivos temporales; lo usan el
+#  análisis de voz y la transcripción
+# =====================================================
+
+import os
+import struct
+import subprocess
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# =====================
+# CONFIGURACIÓN
+# =====================
+
+# Permitir setear ffmpeg explícitamente (útil en Windows)
+FFMPEG_BINARY = (os.getenv("FFMPEG_BINARY") or os.getenv("FFMPEG_PATH") or "ffmpeg").strip()
+# Procesos ffmpeg simultáneos por proceso
+AUDIO_DECODE_CONCURRENCY = max(1, _env_int("AUDIO_DECODE_CONCURRENCY", 2))
+# Tiempo máximo de una decodificación (ffmpeg se mata al vencer)
+AUDIO_DECODE_TIMEOUT_SECONDS = max(1.0, _env_float("AUDIO_DECODE_TIMEOUT_SECONDS", 30.0))
+# Espera máxima por un decodificador libre
+AUDIO_DECODE_QUEUE_SECONDS = max(0.1, _env_float("AUDIO_DECODE_QUEUE_SECONDS", 30.0))
+
+_PIPE_CHUNK = 64 * 1024
+_MAX_ESTIMATE_BYTES = 64 * 1024 * 1024
+
+# Formato de salida de ffmpeg → dtype NumPy
+_FORMATOS = {"f32le": np.float32, "s16le": np.int16}
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+# =====================
+# LECTURA WAV SIN COPIA
+# =====================
+
+# (formato, bits) → dtype de las muestras; 1 = PCM entero, 3 = IEEE float
+_WAV_DTYPES = {(1, 16): "<i2", (1, 32): "<i4", (3, 32): "<f4"}
+
+
+def leer_wav_pcm(archivo) -> Optional[Tuple[int, np.ndarray]]:
+    """
+    Lee un WAV PCM 16/32 bits o float32 como vista NumPy sobre el buffer
+    (bytes, bytearray o memoryview), sin copiar las muestras.
+
+    Returns:
+        (sample_rate, muestras [n] o [n, canales]) o None si el formato no aplica
+    """
+    mv = memoryview(archivo)
+    if len(mv) < 12 or mv[:4] != b"RIFF" or mv[8:12] != b"WAVE":
+        return None
+
+    pos, fmt = 12, None
+    while pos + 8 <= len(mv):
+        chunk_id = bytes(mv[pos:pos + 4])
+        (size,) = struct.unpack_from("<I", mv, pos + 4)
+        body = pos + 8
+        if chunk_id == b"fmt " and size >= 16:
+            tag, channels, sr, _, _, bits = struct.unpack_from("<HHIIHH", mv, body)
+            if tag == 0xFFFE and size >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: el formato real está al inicio del GUID
+                (tag,) = struct.unpack_from("<H", mv, body + 24)
+            fmt = (tag, channels, sr, bits)
+        elif chunk_id == b"data" and fmt is not None:
+            tag, channels, sr, bits = fmt
+            dtype = _WAV_DTYPES.get((tag, bits))
+            if dtype is None or channels < 1:
+                return None
+            # MediaRecorder/streams pueden dejar el tamaño en 0 o 0xFFFFFFFF
+            size = len(mv) - body if size == 0 or body + size > len(mv) else size
+            frames = size // (np.dtype(dtype).itemsize * channels)
+            data = np.frombuffer(mv, dtype=dtype, count=frames * channels, offset=body)
+            return sr, (data.reshape(frames, channels) if channels > 1 else data)
+        pos = body + size + (size & 1)
+    return None
+
+
+# =====================
+# FFMPEG POR PIPES
+# =====================
+
+def _ffmpeg_faltante(e: Exception) -> AudioDecodeError:
+    return AudioDecodeError(
+        "No se pudo decodificar el audio porque falta ffmpeg. "
+        "En deploy funciona porque el Dockerfile instala ffmpeg. "
+        "Solución localhost (Windows): instala ffmpeg y agrégalo al PATH, "
+        "o setea la variable de entorno FFMPEG_BINARY con la ruta a ffmpeg.exe. "
+        f"Detalle: {str(e)}"
+    )
+
+
+def _alimentar(stdin, data: memoryview) -> None:
+    """Escribe el audio a stdin de ffmpeg por bloques (thread aparte: evita el deadlock de pipes)"""
+    try:
+        for start in range(0, len(data), _PIPE_CHUNK):
+            stdin.write(data[start:start + _PIPE_CHUNK])
+    except (BrokenPipeError, OSError, ValueError):
+        # ffmpeg cerró stdin (error de formato o timeout): el motivo sale por stderr
+        pass
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def _leer_pcm(stdout, dtype, estimado: int) -> np.ndarray:
+    """Lee stdout directo a un array que crece x2 (readinto, sin bytes intermedios)"""
+    itemsize = np.dtype(dtype).itemsize
+    out = np.empty(max(estimado, _PIPE_CHUNK) // itemsize + 1, dtype=dtype)
+    raw = memoryview(out).cast("B")
+    n = 0
+    while True:
+        if n == len(raw):
+            out = np.resize(out, out.size * 2)
+            raw = memoryview(out).cast("B")
+        read = stdout.readinto(raw[n:])
+        if not read:
+            break
+        n += read
+    return out[:n // itemsize]
+
+
+class _AudioDecoders:
+    """
+    Decodificadores ffmpeg acotados por proceso. Cada ffmpeg decodifica un solo
+    stream, así que lo que se reutiliza es el cupo: como mucho
+    AUDIO_DECODE_CONCURRENCY procesos vivos, con timeout de espera y de ejecución.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.decodes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.busy_rejections = 0
+        self.total_ms = 0.0
+
+    def _count(self, campo: str, ms: float = 0.0) -> None:
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+            self.total_ms += ms
+
+    def decode(self, data, sr: int, formato: str, ruta_archivo: Optional[str],
+               timeout: float) -> np.ndarray:
+        if not self._slots.acquire(timeout=AUDIO_DECODE_QUEUE_SECONDS):
+            self._count("busy_rejections")
+            raise AudioDecodeError("Todos los decodificadores de audio están ocupados")
+        try:
+            start = time.perf_counter()
+            pcm = self._run(data, sr, formato, ruta_archivo, timeout)
+            self._count("decodes", (time.perf_counter() - start) * 1000.0)
+            return pcm
+        finally:
+            self._slots.release()
+
+    def _run(self, data, sr: int, formato: str, ruta_archivo: Optional[str],
+             timeout: float) -> np.ndarray:
+        # Con el upload ya en disco ffmpeg lo lee directo (y puede hacer seek: MP4/M4A)
+        entrada = ruta_archivo or "pipe:0"
+        cmd = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error"]
+        if ruta_archivo:
+            cmd.append("-nostdin")
+        cmd += ["-i", entrada, "-vn", "-ac", "1", "-ar", str(sr), "-f", formato, "pipe:1"]
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL if ruta_archivo else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except FileNotFoundError as e:
+            self._count("failures")
+            raise _ffmpeg_faltante(e)
+
+        vencido = threading.Event()
+
+        def _matar():
+            vencido.set()
+            proc.kill()
+
+        watchdog = threading.Timer(timeout, _matar)
+        watchdog.daemon = True
+        watchdog.start()
+
+        writer = None
+        stderr = []
+        err_reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)
+        err_reader.start()
+        try:
+            size = 0
+            if not ruta_archivo:
+                view = memoryview(data).cast("B")
+                size = len(view)
+                writer = threading.Thread(target=_alimentar, args=(proc.stdin, view), daemon=True)
+                writer.start()
+            # Estimado de salida: ~10x el comprimido (Opus/MP3 a PCM 16 kHz mono float), acotado
+            estimado = min((size or os.path.getsize(ruta_archivo)) * 10, _MAX_ESTIMATE_BYTES)
+            pcm = _leer_pcm(proc.stdout, _FORMATOS[formato], estimado)
+            proc.wait()
+        finally:
+            watchdog.cancel()
+            if writer is not None:
+                writer.join()
+            err_reader.join()
+            proc.stdout.close()
+            proc.stderr.close()
+
+        if vencido.is_set():
+            self._count("timeouts")
+            raise AudioDecodeError(f"La decodificación del audio superó {timeout:g}s")
+        if proc.returncode != 0 or pcm.size == 0:
+            self._count("failures")
+            detalle = (stderr[0] if stderr else b"").decode("utf-8", "replace").strip()[-500:]
+            raise AudioDecodeError(
+                "No se pudo decodificar el audio (formato no soportado). "
+                "Si estás grabando con MediaRecorder, normalmente el blob real es WebM/Opus aunque lo nombres .wav. "
+                f"Detalle: {detalle or 'sin muestras'}"
+            )
+        return pcm
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "decodes": self.decodes,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "busy_rejections": self.busy_rejections,
+                "avg_ms": round(self.total_ms / self.decodes, 1) if self.decodes else 0.0,
+            }
+
+
+_decoders = _AudioDecoders(AUDIO_DECODE_CONCURRENCY)
+
+
+def decodificar_audio(data, sr: int, formato: str = "f32le", ruta_archivo: Optional[str] = None,
+                      timeout: float = AUDIO_DECODE_TIMEOUT_SECONDS) -> np.ndarray:
+    """
+    Cualquier formato que entienda ffmpeg (WebM/Opus, OGG, MP3, M4A, WAV...) →
+    PCM mono a `sr` Hz, sin pasar por disco.
+
+    Args:
+        data: contenido (bytes o memoryview, se escribe a stdin sin copiar)
+        formato: "f32le" (float32 en [-1, 1]) o "s16le" (int16)
+        ruta_archivo: si el audio ya está en disco, ffmpeg lo lee de ahí y se ignora data
+
+    Raises:
+        AudioDecodeError: falta ffmpeg, formato no soportado, timeout o sin decodificadores libres
+    """
+    if formato not in _FORMATOS:
+        raise ValueError(f"Formato PCM no soportado: {formato}")
+    return _decoders.decode(data, sr, formato, ruta_archivo, timeout)
+
+
+def cargar_pcm(data, sr: int, ruta_archivo: Optional[str] = None) -> np.ndarray:
+    """
+    Audio subido → float32 mono a `sr` Hz en [-1, 1], una sola vez: un WAV que ya
+    viene mono a `sr` se lee sin ffmpeg, todo lo demás (incluido el remuestreo)
+    lo hace ffmpeg por pipes.
+    """
+    wav = leer_wav_pcm(data) if bytes(memoryview(data)[:4]) == b"RIFF" else None
+    if wav is not None and wav[0] == sr and wav[1].ndim == 1 and wav[1].size:
+        samples = wav[1]
+        if np.issubdtype(samples.dtype, np.integer):
+            return samples.astype(np.float32) / float(np.iinfo(samples.dtype).max)
+        return samples.astype(np.float32)
+    return decodificar_audio(data, sr, "f32le", ruta_archivo)
+
+
+def wav_float32(pcm: np.ndarray, sr: int) -> bytearray:
+    """PCM float32 mono → WAV IEEE float en memoria (lo lee leer_wav_pcm sin copiar ni remuestrear)"""
+    samples = np.ascontiguousarray(pcm, dtype="<f4")
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + samples.nbytes, b"WAVE",
+        b"fmt ", 16, 3, 1, sr, sr * 4, 4, 32,
+        b"data", samples.nbytes,
+    )
+    out = bytearray(len(header) + samples.nbytes)
+    out[:len(header)] = header
+    out[len(header):] = memoryview(samples).cast("B")
+    return out
+
+
+# =====================
+# DECODIFICACIÓN EN STREAMING
+# =====================
+
+# Contenedor de los chunks de MediaRecorder → demuxer de ffmpeg (sin sondeo del formato)
+_STREAM_DEMUXERS = {"webm": "matroska", "ogg": "ogg"}
+
+
+class StreamDecoder:
+    """
+    ffmpeg de larga vida para audio que llega por partes (chunks WebM/OGG de
+    MediaRecorder): write() recibe lo comprimido y read() devuelve PCM s16le
+    mono a medida que ffmpeg lo produce. Bloqueante: usar desde el threadpool.
+    """
+
+    def __init__(self, contenedor: str, sr: int):
+        demuxer = _STREAM_DEMUXERS.get(contenedor)
+        if demuxer is None:
+            raise ValueError(f"Contenedor no soportado para streaming: {contenedor}")
+        cmd = [
+            FFMPEG_BINARY, "-hide_banner", "-loglevel", "error",
+            "-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0",
+            "-f", demuxer, "-i", "pipe:0",
+            "-vn", "-ac", "1", "-ar", str(sr), "-f", "s16le", "pipe:1",
+        ]
+        try:
+            # bufsize=0: read() devuelve lo que haya disponible sin esperar a llenar un buffer
+            self._proc = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+            )
+        except FileNotFoundError as e:
+            raise _ffmpeg_faltante(e)
+
+    def write(self, data) -> None:
+        view = memoryview(data).cast("B")
+        try:
+            while len(view):
+                written = self._proc.stdin.write(view)
+                view = view[written:]
+        except (BrokenPipeError, OSError, ValueError):
+            raise AudioDecodeError("ffmpeg dejó de aceptar audio (formato no soportado o stream corrupto)")
+
+    def end(self) -> None:
+        """Fin del audio: ffmpeg vacía lo pendiente y read() llega a b''"""
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+
+    def read(self, n: int = 8000) -> bytes:
+        return self._proc.stdout.read(n) or b""
+
+    def kill(self) -> None:
+        """Mata ffmpeg sin esperar: un write()/read() bloqueado en otro hilo vuelve enseguida"""
+        if self._proc.poll() is None:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        self.end()
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._proc.stdout.close()
+
+
+def decoder_stats() -> Dict:
+    return _decoders.stats()
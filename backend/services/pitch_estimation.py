@@ -0,0 +1,201 @@
+# =====================================================
+#  ESTIMACIÓN DE F0 (PITCH)
+#  yin   : YIN vectorizado sobre frames (NumPy, por bloques)
+#  praat : autocorrelación de Praat (parselmouth)
+#  pyin  : librosa.pyin C2–C7 (referencia, el más lento)
+# =====================================================
+
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# =====================
+# CONFIGURACIÓN
+# =====================
+
+# yin | praat | pyin
+F0_ENGINES = ("yin", "praat", "pyin")
+F0_ENGINE = (os.getenv("VOICE_F0_ENGINE") or "yin").strip().lower()
+if F0_ENGINE not in F0_ENGINES:
+    print(f"⚠️  VOICE_F0_ENGINE desconocido ({F0_ENGINE}); usando yin")
+    F0_ENGINE = "yin"
+# Umbral de la diferencia normalizada de YIN: por encima el frame se considera sordo
+YIN_THRESHOLD = _env_float("VOICE_F0_YIN_THRESHOLD", 0.15)
+# Paso entre frames (segundos)
+F0_HOP_SECONDS = _env_float("VOICE_F0_HOP_SECONDS", 0.016)
+# Rango de búsqueda alrededor de los umbrales de tono del género
+F0_RANGE_LOW_FACTOR = 0.5
+F0_RANGE_HIGH_FACTOR = 2.0
+F0_ABS_MIN, F0_ABS_MAX = 50.0, 600.0
+# Frames por bloque de FFT (acota la memoria en grabaciones largas)
+_YIN_BLOCK = 256
+# Potencia media por muestra bajo la cual el frame es silencio (~ -100 dBFS)
+_YIN_SILENCE_POWER = 1e-10
+
+
+def rango_f0(umbral: Dict) -> Tuple[float, float]:
+    """(fmin, fmax) de búsqueda a partir de UMBRALES_TONO del género"""
+    fmin = max(F0_ABS_MIN, umbral["bajo"] * F0_RANGE_LOW_FACTOR)
+    fmax = min(F0_ABS_MAX, umbral["alto"] * F0_RANGE_HIGH_FACTOR)
+    return fmin, fmax
+
+
+# =====================
+# YIN VECTORIZADO
+# =====================
+
+def _yin_block(frames: np.ndarray, window: int, tau_min: int, tau_max: int,
+               threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Para un bloque de frames [m, window + tau_max]: período (muestras, con
+    interpolación parabólica) y aperiodicidad (mínimo de la CMND) por frame.
+    """
+    m, length = frames.shape
+    n_fft = 1 << int(np.ceil(np.log2(length + window)))
+
+    # r(τ) = Σ_j x[j] x[j+τ] para j < window, con un solo rfft por frame
+    spectrum = np.fft.rfft(frames, n_fft, axis=1)
+    head = np.fft.rfft(frames[:, :window], n_fft, axis=1)
+    r = np.fft.irfft(spectrum * np.conj(head), n_fft, axis=1)[:, :tau_max + 1]
+
+    # Energías de las ventanas desplazadas con suma acumulada
+    energy = np.zeros((m, length + 1))
+    np.cumsum(frames * frames, axis=1, out=energy[:, 1:])
+    taus = np.arange(tau_max + 1)
+    shifted = energy[:, taus + window] - energy[:, taus]
+    diff = np.maximum(energy[:, [window]] + shifted - 2.0 * r, 0.0)
+
+    # Diferencia media normalizada acumulada (CMND). Sin energía (silencio
+    # digital) d(τ) = 0 daría CMND = 0, "periódico perfecto": queda en 1 (sordo)
+    cmnd = np.ones_like(diff)
+    cumulative = np.cumsum(diff[:, 1:], axis=1)
+    cmnd[:, 1:] = np.where(cumulative > 1e-12, diff[:, 1:] * taus[1:] / np.maximum(cumulative, 1e-12), 1.0)
+    cmnd[energy[:, length] <= _YIN_SILENCE_POWER * length] = 1.0
+
+    # Primer mínimo local bajo el umbral dentro de [tau_min, tau_max); si no hay, mínimo global
+    search = cmnd[:, tau_min:tau_max]
+    trough = (search[:, :-1] < threshold) & (search[:, :-1] <= search[:, 1:])
+    has_trough = trough.any(axis=1)
+    tau = np.where(has_trough, trough.argmax(axis=1), search.argmin(axis=1)) + tau_min
+    rows = np.arange(m)
+    aperiodicity = cmnd[rows, tau]
+
+    # Interpolación parabólica alrededor del mínimo
+    left = cmnd[rows, np.maximum(tau - 1, 0)]
+    right = cmnd[rows, np.minimum(tau + 1, tau_max)]
+    denom = left - 2.0 * aperiodicity + right
+    offset = np.where(np.abs(denom) > 1e-12, 0.5 * (left - right) / np.where(denom == 0, 1, denom), 0.0)
+    period = tau + np.clip(offset, -1.0, 1.0)
+    return period, aperiodicity
+
+
+def yin(y: np.ndarray, sr: int, fmin: float, fmax: float, hop_length: int,
+        threshold: float = YIN_THRESHOLD) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    YIN (de Cheveigné & Kawahara) vectorizado: todos los frames de un bloque
+    se procesan con una FFT por lote.
+
+    Returns:
+        (f0 [n] con NaN en frames sordos, aperiodicidad [n]); el frame i está
+        centrado en la muestra i * hop_length
+    """
+    tau_min = max(2, int(np.floor(sr / fmax)))
+    tau_max = int(np.ceil(sr / fmin))
+    window = tau_max
+    length = window + tau_max + 1
+
+    y = np.asarray(y, dtype=np.float64)
+    n_frames = 1 + len(y) // hop_length
+    padded = np.pad(y, (length // 2, length), mode="constant")
+    frames = sliding_window_view(padded, length)[::hop_length][:n_frames]
+
+    f0 = np.full(n_frames, np.nan)
+    aperiodicity = np.ones(n_frames)
+    for start in range(0, n_frames, _YIN_BLOCK):
+        block = frames[start:start + _YIN_BLOCK]
+        period, aper = _yin_block(block, window, tau_min, tau_max, threshold)
+        voiced = aper < threshold
+        f0[start:start + block.shape[0]] = np.where(voiced, sr / period, np.nan)
+        aperiodicity[start:start + block.shape[0]] = aper
+    return f0, aperiodicity
+
+
+# =====================
+# MOTORES
+# =====================
+
+def _f0_praat(y: np.ndarray, sr: int, fmin: float, fmax: float,
+              hop_length: int) -> Tuple[np.ndarray, np.ndarray]:
+    import parselmouth
+
+    pitch = parselmouth.Sound(np.asarray(y, dtype=np.float64), sr).to_pitch_ac(
+        time_step=hop_length / float(sr), pitch_floor=fmin, pitch_ceiling=fmax
+    )
+    f0 = pitch.selected_array["frequency"]
+    return np.where(f0 > 0, f0, np.nan), np.asarray(pitch.xs())
+
+
+def _f0_pyin(y: np.ndarray, sr: int) -> np.ndarray:
+    import librosa
+
+    # sr explícito: sin él librosa asume 22050 Hz y el F0 sale escalado x1.38 a 16 kHz
+    f0, _, _ = librosa.pyin(
+        y,
+        fmin=librosa.note_to_hz("C2"),
+        fmax=librosa.note_to_hz("C7"),
+        sr=sr,
+    )
+    return f0
+
+
+def _gate_with_vad(f0: np.ndarray, times: np.ndarray, actividad: Dict, sr: int) -> np.ndarray:
+    """Anula (NaN) los frames de F0 cuyo centro cae en un frame sin voz del VAD"""
+    mask = actividad["mask"]
+    if mask.size == 0:
+        return f0
+    idx = np.minimum((times * sr / actividad["frame_length"]).astype(np.int64), mask.size - 1)
+    return np.where(mask[idx], f0, np.nan)
+
+
+def estimar_f0(y: np.ndarray, sr: int, umbral: Dict, motor: Optional[str] = None,
+               actividad: Optional[Dict] = None) -> Dict:
+    """
+    Contorno de F0 con el motor configurado (VOICE_F0_ENGINE).
+
+    Args:
+        umbral: entrada de UMBRALES_TONO del género (define el rango de búsqueda)
+        actividad: resultado de detectar_actividad_voz; si se pasa, los frames
+            sin voz quedan sordos (no aplica a pyin, que es la referencia)
+
+    Returns:
+        {"f0": [n] Hz con NaN en frames sordos, "engine", "fmin", "fmax"}
+    """
+    motor = (motor or F0_ENGINE).lower()
+    if motor not in F0_ENGINES:
+        print(f"⚠️  VOICE_F0_ENGINE desconocido ({motor}); usando yin")
+        motor = "yin"
+
+    if motor == "pyin":
+        return {"f0": _f0_pyin(y, sr), "engine": motor, "fmin": None, "fmax": None}
+
+    fmin, fmax = rango_f0(umbral)
+    hop_length = max(1, int(round(sr * F0_HOP_SECONDS)))
+    if motor == "praat":
+        f0, times = _f0_praat(y, sr, fmin, fmax, hop_length)
+    else:
+        f0, _ = yin(y, sr, fmin, fmax, hop_length)
+        times = np.arange(f0.size) * hop_length / float(sr)
+
+    if actividad is not None:
+        f0 = _gate_with_vad(f0, times, actividad, sr)
+    return {"f0": f0, "engine": motor, "fmin": fmin, "fmax": fmax}
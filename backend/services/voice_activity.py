@@ -0,0 +1,150 @@
+# =====================================================
+#  DETECCIÓN DE ACTIVIDAD DE VOZ (VAD)
+#  Máscara de voz por frame de 30 ms, reutilizable por
+#  el resto del análisis (ratio de voz, pitch, energía)
+# =====================================================
+
+import os
+import threading
+from typing import Dict
+
+import numpy as np
+
+try:
+    import webrtcvad
+    WEBRTC_AVAILABLE = True
+except ImportError:
+    webrtcvad = None
+    WEBRTC_AVAILABLE = False
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# =====================
+# CONFIGURACIÓN
+# =====================
+
+FRAME_MS = 30
+# webrtc | energia | auto (auto = energia para grabaciones largas)
+VAD_ENGINE = (os.getenv("VOICE_VAD_ENGINE") or "webrtc").strip().lower()
+VAD_AGGRESSIVENESS = int(_env_float("VOICE_VAD_AGGRESSIVENESS", 2))
+# En modo auto, duración a partir de la cual se usa el VAD de energía
+VAD_ENERGY_MIN_SECONDS = _env_float("VOICE_VAD_ENERGY_MIN_SECONDS", 120.0)
+# VAD de energía: dB sobre el piso de ruido (percentil 10) y tasa de cruces por cero máxima
+VAD_ENERGY_MARGIN_DB = _env_float("VOICE_VAD_ENERGY_MARGIN_DB", 12.0)
+VAD_ENERGY_MIN_DBFS = _env_float("VOICE_VAD_ENERGY_MIN_DBFS", -50.0)
+VAD_ZCR_MAX = _env_float("VOICE_VAD_ZCR_MAX", 0.35)
+
+# Frecuencias de muestreo que acepta webrtcvad
+_WEBRTC_RATES = {8000, 16000, 32000, 48000}
+
+# Un Vad por thread (el análisis corre en el threadpool)
+_local = threading.local()
+
+
+def _webrtc_vad():
+    vad = getattr(_local, "vad", None)
+    if vad is None:
+        vad = _local.vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+    return vad
+
+
+def a_pcm16(y: np.ndarray) -> np.ndarray:
+    """Señal float [-1, 1] → int16 contiguo, una sola conversión (con saturación)"""
+    scaled = np.multiply(y, 32768.0)
+    np.clip(scaled, -32768, 32767, out=scaled)
+    return scaled.astype(np.int16)
+
+
+# =====================
+# MOTORES
+# =====================
+
+def mascara_webrtc(pcm16: np.ndarray, sr: int, frame_length: int) -> np.ndarray:
+    """
+    webrtcvad sobre slices de un único memoryview de solo lectura (sin copiar por frame).
+    Frames que webrtcvad rechaza cuentan como silencio.
+    """
+    n_frames = len(pcm16) // frame_length
+    mask = np.zeros(n_frames, dtype=bool)
+    if n_frames == 0:
+        return mask
+
+    vad = _webrtc_vad()
+    buf = memoryview(np.ascontiguousarray(pcm16)).cast("B").toreadonly()
+    step = frame_length * 2
+    for i in range(n_frames):
+        try:
+            mask[i] = vad.is_speech(buf[i * step:(i + 1) * step], sr)
+        except Exception:
+            pass
+    return mask
+
+
+def mascara_energia(y: np.ndarray, frame_length: int) -> np.ndarray:
+    """
+    VAD NumPy por energía + cruces por cero, vectorizado sobre todos los frames:
+    voz = energía sobre el piso de ruido adaptativo y ZCR baja (descarta ruido blanco/siseo).
+    """
+    n_frames = len(y) // frame_length
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+
+    frames = np.asarray(y[:n_frames * frame_length], dtype=np.float32).reshape(n_frames, frame_length)
+    energy_db = 10.0 * np.log10(np.einsum("ij,ij->i", frames, frames) / frame_length + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(frame_length - 1)
+
+    threshold = max(float(np.percentile(energy_db, 10)) + VAD_ENERGY_MARGIN_DB, VAD_ENERGY_MIN_DBFS)
+    return (energy_db > threshold) & (zcr < VAD_ZCR_MAX)
+
+
+# =====================
+# ETAPA DE VAD
+# =====================
+
+def resolver_motor(duracion_s: float, sr: int, motor: str = None) -> str:
+    motor = (motor or VAD_ENGINE).lower()
+    if motor == "auto":
+        motor = "energia" if duracion_s >= VAD_ENERGY_MIN_SECONDS else "webrtc"
+    if motor not in ("webrtc", "energia"):
+        print(f"⚠️  VOICE_VAD_ENGINE desconocido ({motor}); usando webrtc")
+        motor = "webrtc"
+    if motor == "webrtc" and (not WEBRTC_AVAILABLE or sr not in _WEBRTC_RATES):
+        return "energia"
+    return motor
+
+
+def detectar_actividad_voz(y: np.ndarray, sr: int, motor: str = None) -> Dict:
+    """
+    Máscara de voz por frame de FRAME_MS (frames contiguos sin solapamiento).
+
+    Returns:
+        {"mask": bool [n_frames], "frame_length": muestras por frame,
+         "engine": motor usado, "ratio": fracción de frames con voz}
+    """
+    frame_length = int(sr * FRAME_MS / 1000)
+    engine = resolver_motor(len(y) / float(sr), sr, motor)
+    if engine == "webrtc":
+        mask = mascara_webrtc(a_pcm16(y), sr, frame_length)
+    else:
+        mask = mascara_energia(y, frame_length)
+    return {
+        "mask": mask,
+        "frame_length": frame_length,
+        "engine": engine,
+        "ratio": float(mask.mean()) if mask.size else 0.0,
+    }
+
+
+def mascara_por_muestra(actividad: Dict, n_muestras: int) -> np.ndarray:
+    """Expande la máscara por frame a una máscara por muestra (cola sin frame completo = silencio)"""
+    mask = np.zeros(n_muestras, dtype=bool)
+    covered = actividad["mask"].size * actividad["frame_length"]
+    mask[:covered] = np.repeat(actividad["mask"], actividad["frame_length"])
+    return mask
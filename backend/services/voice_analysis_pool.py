@@ -0,0 +1,302 @@
+# =====================================================
+#  POOL DE ANÁLISIS DE VOZ
+#  procesar_audio_archivo en procesos dedicados (librosa,
+#  parselmouth y webrtcvad ya importados), con cola acotada,
+#  timeout por trabajo y cancelación si el cliente se va
+# =====================================================
+
+import asyncio
+import contextlib
+import mmap
+import os
+import time
+from multiprocessing import get_context, shared_memory
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# =====================
+# CONFIGURACIÓN
+# =====================
+
+# process = procesos dedicados | thread = threadpool del worker web (comportamiento anterior)
+VOICE_ANALYSIS_POOL = (os.getenv("VOICE_ANALYSIS_POOL") or "thread").strip().lower()
+# Análisis simultáneos por worker web (procesos en modo process)
+VOICE_ANALYSIS_CONCURRENCY = max(1, _env_int("VOICE_ANALYSIS_CONCURRENCY", 1))
+# Trabajos esperando además de los que corren; más allá se responde 429
+VOICE_ANALYSIS_QUEUE_MAX = max(0, _env_int("VOICE_ANALYSIS_QUEUE_MAX", 4))
+VOICE_ANALYSIS_TIMEOUT_SECONDS = max(1, _env_int("VOICE_ANALYSIS_TIMEOUT_SECONDS", 120))
+# Cada cuánto se revisa si el cliente se desconectó mientras el trabajo corre
+_POLL_SECONDS = 0.5
+
+Disconnected = Optional[Callable[[], Awaitable[bool]]]
+
+
+class VoiceQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Hay demasiados análisis de voz en curso; reintenta en unos segundos")
+        self.retry_after = retry_after
+
+
+class VoiceAnalysisTimeout(Exception):
+    pass
+
+
+class VoiceJobCancelled(Exception):
+    pass
+
+
+# =====================
+# LADO DEL PROCESO HIJO
+# =====================
+
+def _warm_up(procesar) -> None:
+    """Un análisis corto al arrancar: imports perezosos, numba/BLAS y filtros quedan listos"""
+    sr = 16000
+    t = np.arange(sr) / sr
+    y = (0.3 * np.sin(2 * np.pi * 150 * t) * 32767).astype("<i2")
+    header = b"RIFF" + (36 + y.nbytes).to_bytes(4, "little") + b"WAVEfmt " + bytes.fromhex(
+        "10000000" "0100" "0100" "803e0000" "007d0000" "0200" "1000"
+    ) + b"data" + y.nbytes.to_bytes(4, "little")
+    try:
+        procesar(header + y.tobytes(), "neutro")
+    except Exception as e:
+        print(f"⚠️ Warm-up de análisis de voz falló: {e}")
+
+
+def _worker_main(conn) -> None:
+    from backend.services.voice_analysis_service import procesar_audio_archivo
+
+    _warm_up(procesar_audio_archivo)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        kind, ref, size, gender = job
+        result = None
+        try:
+            if kind == "shm":
+                shm = shared_memory.SharedMemory(name=ref)
+                try:
+                    result = ("ok", procesar_audio_archivo(shm.buf[:size], gender))
+                finally:
+                    with contextlib.suppress(BufferError):
+                        shm.close()
+            else:
+                with open(ref, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mm)
+                try:
+                    result = ("ok", procesar_audio_archivo(view, gender, ref))
+                finally:
+                    # Si el análisis falla, el traceback aún retiene vistas del mmap:
+                    # release()/close() lanzarían BufferError y taparían el error real
+                    with contextlib.suppress(BufferError):
+                        view.release()
+                    with contextlib.suppress(BufferError):
+                        mm.close()
+        except Exception as e:
+            result = ("error", str(e))
+        conn.send(result)
+
+
+# =====================
+# LADO DEL PROCESO WEB
+# =====================
+
+class _Worker:
+    def __init__(self):
+        ctx = get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), name="voice-analysis", daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self) -> None:
+        with contextlib.suppress(Exception):
+            self.process.kill()
+            self.process.join(timeout=1)
+        with contextlib.suppress(Exception):
+            self.conn.close()
+
+
+class VoiceAnalysisPool:
+    """
+    Cola acotada de análisis de voz del worker web.
+
+    En modo process cada trabajo corre en un proceso propio (sin GIL compartido);
+    un trabajo que vence o cuyo cliente se desconecta se cancela matando solo
+    su proceso, que se reemplaza por uno nuevo.
+    """
+
+    def __init__(self, mode: str = VOICE_ANALYSIS_POOL, concurrency: int = VOICE_ANALYSIS_CONCURRENCY,
+                 queue_max: int = VOICE_ANALYSIS_QUEUE_MAX):
+        self.mode = "process" if mode == "process" else "thread"
+        self.concurrency = concurrency
+        self.queue_max = queue_max
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: List[_Worker] = []
+        self._jobs = 0
+        self._avg_seconds = 10.0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._slots
+
+    def start(self) -> None:
+        """Arranca los procesos sin esperar al primer trabajo (modo process)"""
+        if self.mode == "process":
+            while len(self._idle) < self.concurrency:
+                self._idle.append(_Worker())
+            print(f"✅ Pool de análisis de voz: {self.concurrency} procesos")
+
+    def shutdown(self) -> None:
+        workers, self._idle = self._idle, []
+        for worker in workers:
+            with contextlib.suppress(Exception):
+                worker.conn.send(None)
+            worker.process.join(timeout=2)
+            worker.kill()
+
+    def retry_after(self) -> int:
+        """Segundos estimados hasta que se libere un lugar en la cola"""
+        return max(1, int(round(self._avg_seconds * max(1, self._jobs - self.concurrency + 1) / self.concurrency)))
+
+    async def analyze(self, audio, genero: str = "neutro", ruta_archivo: Optional[str] = None,
+                      is_disconnected: Disconnected = None) -> Dict:
+        """
+        procesar_audio_archivo con backpressure.
+
+        Raises:
+            VoiceQueueFull: cola llena (responder 429 con Retry-After)
+            VoiceAnalysisTimeout: superó VOICE_ANALYSIS_TIMEOUT_SECONDS
+            VoiceJobCancelled: el cliente se desconectó antes de terminar
+        """
+        if self._jobs >= self.concurrency + self.queue_max:
+            self.rejected += 1
+            raise VoiceQueueFull(self.retry_after())
+
+        self._jobs += 1
+        try:
+            slots = self._semaphore()
+            # Esperando turno: si el cliente se va, sale de la cola sin haber corrido
+            while True:
+                try:
+                    await asyncio.wait_for(slots.acquire(), timeout=_POLL_SECONDS)
+                    break
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        self.cancelled += 1
+                        raise VoiceJobCancelled()
+            try:
+                start = time.monotonic()
+                if self.mode == "process":
+                    result = await self._run_in_process(audio, genero, ruta_archivo, is_disconnected)
+                else:
+                    result = await self._run_in_thread(audio, genero, ruta_archivo)
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - start)
+                self.completed += 1
+                return result
+            finally:
+                slots.release()
+        finally:
+            self._jobs -= 1
+
+    async def _run_in_thread(self, audio, genero: str, ruta_archivo: Optional[str]) -> Dict:
+        from backend.services.voice_analysis_service import procesar_audio_archivo
+
+        # El thread no se puede interrumpir: al vencer se responde y el análisis termina en segundo plano
+        try:
+            return await asyncio.wait_for(
+                run_in_threadpool(procesar_audio_archivo, audio, genero, ruta_archivo),
+                timeout=VOICE_ANALYSIS_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise VoiceAnalysisTimeout()
+
+    async def _run_in_process(self, audio, genero: str, ruta_archivo: Optional[str],
+                              is_disconnected: Disconnected) -> Dict:
+        worker = self._idle.pop() if self._idle else _Worker()
+        shm = None
+        healthy = False
+        try:
+            if ruta_archivo:
+                job = ("path", ruta_archivo, 0, genero)
+            else:
+                view = memoryview(audio).cast("B")
+                shm = shared_memory.SharedMemory(create=True, size=max(1, view.nbytes))
+                shm.buf[:view.nbytes] = view
+                job = ("shm", shm.name, view.nbytes, genero)
+            worker.conn.send(job)
+
+            deadline = time.monotonic() + VOICE_ANALYSIS_TIMEOUT_SECONDS
+            loop = asyncio.get_running_loop()
+            while not await loop.run_in_executor(None, worker.conn.poll, _POLL_SECONDS):
+                if not worker.process.is_alive():
+                    raise RuntimeError("El proceso de análisis de voz terminó inesperadamente")
+                if time.monotonic() > deadline:
+                    self.timeouts += 1
+                    raise VoiceAnalysisTimeout()
+                if is_disconnected is not None and await is_disconnected():
+                    self.cancelled += 1
+                    raise VoiceJobCancelled()
+
+            try:
+                status, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                raise RuntimeError("El proceso de análisis de voz terminó inesperadamente")
+            healthy = True
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            if healthy:
+                self._idle.append(worker)
+            else:
+                # Vencido, cancelado o muerto: se descarta el proceso y se arranca otro
+                worker.kill()
+                self._idle.append(_Worker())
+
+        if status != "ok":
+            raise Exception(payload)
+        return payload
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "queue_max": self.queue_max,
+            "jobs": self._jobs,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "avg_seconds": round(self._avg_seconds, 2),
+        }
+
+
+_pool = VoiceAnalysisPool()
+
+
+def get_voice_analysis_pool() -> VoiceAnalysisPool:
+    """Pool del worker web actual (un worker de uvicorn)"""
+    return _pool
@@ -7,11 +7,13 @@ import librosa
 import numpy as np
 from scipy.signal import butter, lfilter
 import parselmouth
-import webrtcvad
 import io
 import base64
-import os
-from typing import Dict
+from typing import Dict, Optional
+
+from backend.services.audio_decoding import decodificar_audio, leer_wav_pcm
+from backend.services.pitch_estimation import estimar_f0
+from backend.services.voice_activity import detectar_actividad_voz
 
 # =====================
 # CONFIGURACIÓN GENERAL
@@ -39,8 +41,6 @@ UMBRALES_ESTABILIDAD = {
     "hnr": 15
 }
 
-vad = webrtcvad.Vad(2)
-
 # =====================
 # FILTRADO
 # =====================
@@ -81,19 +81,8 @@ def extraer_estabilidad_vocal(y, sr):
 # =====================
 
 def detectar_voz_ratio(y, sr):
-    frame_length = int(sr * 0.03)
-    if len(y) < frame_length:
-        return 0.0
-    frames = librosa.util.frame(y, frame_length=frame_length, hop_length=frame_length)
-    voiced = 0
-    for frame in frames.T:
-        pcm = (frame * 32768).astype(np.int16)
-        try:
-            if vad.is_speech(pcm.tobytes(), sr):
-                voiced += 1
-        except Exception:
-            pass
-    return voiced / frames.shape[1] if frames.shape[1] > 0 else 0.0
+    """Fracción de frames de 30 ms con voz (ver voice_activity para la máscara completa)"""
+    return detectar_actividad_voz(y, sr)["ratio"]
 
 # =====================
 # ANALIZADOR PRINCIPAL
@@ -104,11 +93,14 @@ def analizar_voz_audio(audio_data: np.ndarray, sr: int, genero: str = "neutro")
     genero = genero.lower()
     umbral = UMBRALES_TONO.get(genero, UMBRALES_TONO["neutro"])
 
-    f0, _, _ = librosa.pyin(
-        y,
-        fmin=librosa.note_to_hz("C2"),
-        fmax=librosa.note_to_hz("C7")
-    )
+    # Máscara de voz por frame (VOICE_VAD_ENGINE); se calcula una vez y la reutilizan las demás etapas
+    actividad = detectar_actividad_voz(y, sr)
+    voice_ratio = actividad["ratio"]
+
+    # F0 con el motor configurado (VOICE_F0_ENGINE: yin | praat | pyin de referencia),
+    # en el rango del género y solo en frames con voz
+    pitch = estimar_f0(y, sr, umbral, actividad=actividad)
+    f0 = pitch["f0"]
     f0_valid = f0[~np.isnan(f0)]
     pitch_mean = np.mean(f0_valid) if f0_valid.size > 0 else 0
     pitch_std = np.std(f0_valid) if f0_valid.size > 0 else 0
@@ -116,8 +108,6 @@ def analizar_voz_audio(audio_data: np.ndarray, sr: int, genero: str = "neutro")
     rms = librosa.feature.rms(y=y)[0]
     energy_mean = np.mean(rms)
 
-    voice_ratio = detectar_voz_ratio(y, sr)
-
     mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
     mfcc_variability = np.std(mfcc)
 
@@ -158,7 +148,8 @@ def analizar_voz_audio(audio_data: np.ndarray, sr: int, genero: str = "neutro")
         "shimmer": round(float(shimmer), 4),
         "hnr": round(float(hnr), 2),
         "score": round(float(score), 2),
-        "risk_level": nivel
+        "risk_level": nivel,
+        "pitch_engine": pitch["engine"],
     }
 
 
@@ -197,19 +188,27 @@ def procesar_audio_base64(audio_base64: str, genero: str = "neutro") -> Dict:
 # FUNCIÓN PARA PROCESAR ARCHIVO DE AUDIO
 # =====================
 
-def procesar_audio_archivo(archivo_bytes: bytes, genero: str = "neutro") -> Dict:
+def procesar_audio_archivo(archivo_bytes, genero: str = "neutro", ruta_archivo: Optional[str] = None) -> Dict:
     """
     Procesa audio recibido como archivo desde el frontend.
     Soporta WAV, WebM, MP3, OGG, etc.
+
+    Args:
+        archivo_bytes: Contenido (bytes o memoryview de backend.uploads, sin copiar)
+        ruta_archivo: Si el upload ya está en disco, ffmpeg lo lee directo de ahí
     """
     try:
         # 1) Camino rápido: si es WAV real, evitamos ffmpeg por completo.
         # Esto ayuda especialmente en Windows/localhost donde ffmpeg suele faltar.
-        if archivo_bytes[:4] == b"RIFF" and b"WAVE" in archivo_bytes[:16]:
+        if archivo_bytes[:4] == b"RIFF" and b"WAVE" in bytes(archivo_bytes[:16]):
             try:
-                from scipy.io import wavfile
-
-                sr, data = wavfile.read(io.BytesIO(archivo_bytes))
+                wav = leer_wav_pcm(archivo_bytes)
+                if wav is not None:
+                    sr, data = wav
+                else:
+                    # Variantes menos comunes (8/24 bits, etc.)
+                    from scipy.io import wavfile
+                    sr, data = wavfile.read(ruta_archivo or io.BytesIO(archivo_bytes))
                 if data is None or (hasattr(data, "size") and data.size == 0):
                     raise ValueError("WAV vacío")
 
@@ -235,69 +234,10 @@ def procesar_audio_archivo(archivo_bytes: bytes, genero: str = "neutro") -> Dict
                 # caemos al path con ffmpeg.
                 pass
 
-        # 2) Camino general: pydub + ffmpeg para WebM/MP3/OGG/etc.
-        from pydub import AudioSegment
-        from pydub.exceptions import CouldntDecodeError
-        import tempfile
-        import io
-        
-        # Permitir setear ffmpeg explícitamente (útil en Windows).
-        ffmpeg_bin = (os.getenv("FFMPEG_BINARY") or os.getenv("FFMPEG_PATH") or "").strip()
-        if ffmpeg_bin:
-            AudioSegment.converter = ffmpeg_bin
-
-        # Crear archivo temporal (la extensión puede ser engañosa; ffmpeg suele detectar por contenido)
-        with tempfile.NamedTemporaryFile(suffix='.tmp', delete=False) as temp_input:
-            temp_input.write(archivo_bytes)
-            temp_input_path = temp_input.name
-        
-        try:
-            # Intentar cargar con pydub (soporta múltiples formatos)
-            audio = AudioSegment.from_file(temp_input_path)
-
-            # Convertir a mono 16kHz (en memoria)
-            audio = audio.set_channels(1).set_frame_rate(SAMPLE_RATE)
-
-            # Extraer samples PCM en memoria (evita exportar WAV + volver a leer)
-            sample_width = audio.sample_width  # bytes por sample
-            samples = np.array(audio.get_array_of_samples())
-            # Normalizar a float32 en [-1, 1]
-            denom = float(1 << (8 * sample_width - 1)) if sample_width else 32768.0
-            audio_data = (samples.astype(np.float32) / denom)
-            sr = SAMPLE_RATE
-
-            # Limpiar archivo temporal de entrada
-            os.unlink(temp_input_path)
-
-            # Analizar
-            resultado = analizar_voz_audio(audio_data, sr, genero)
-            return resultado
-            
-        except FileNotFoundError as e:
-            # Frecuente en localhost Windows: ffmpeg no está instalado/en PATH.
-            if os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            raise Exception(
-                "No se pudo decodificar el audio porque falta ffmpeg. "
-                "En deploy funciona porque el Dockerfile instala ffmpeg. "
-                "Solución localhost (Windows): instala ffmpeg y agrégalo al PATH, "
-                "o setea la variable de entorno FFMPEG_BINARY con la ruta a ffmpeg.exe. "
-                f"Detalle: {str(e)}"
-            )
-        except CouldntDecodeError as e:
-            if os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            raise Exception(
-                "No se pudo decodificar el audio (formato no soportado/local sin ffmpeg). "
-                "Si estás grabando con MediaRecorder, normalmente el blob real es WebM/Opus aunque lo nombres .wav. "
-                "Instala ffmpeg localmente o ejecuta el backend vía Docker para igualar el entorno de deploy. "
-                f"Detalle: {str(e)}"
-            )
-        except Exception as e:
-            # Limpiar en caso de error
-            if os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            raise e
-        
+        # 2) Camino general: ffmpeg por pipes para WebM/MP3/OGG/etc.
+        # Sale float32 mono a SAMPLE_RATE, ya normalizado, sin archivos temporales.
+        audio_data = decodificar_audio(archivo_bytes, SAMPLE_RATE, "f32le", ruta_archivo)
+        return analizar_voz_audio(audio_data, SAMPLE_RATE, genero)
+
     except Exception as e:
-        raise Exception(f"Error procesando audio: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error procesando audio: {str(e)}")
@@ -0,0 +1,492 @@
+# =====================================================
+#  SESIONES DE VOZ ASÍNCRONAS
+#  El endpoint guarda el audio y una sesión pending; los
+#  workers de este proceso la analizan y completan la fila
+# =====================================================
+
+import asyncio
+import json
+import mmap
+import os
+import socket
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from backend.db import models
+from backend.db.database import SessionLocal
+from backend.services.voice_analysis_pool import (
+    VOICE_ANALYSIS_CONCURRENCY,
+    VoiceQueueFull,
+    get_voice_analysis_pool,
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+# =====================
+# CONFIGURACIÓN
+# =====================
+
+# Audio de los trabajos pendientes (sobrevive a reinicios del worker, no del contenedor)
+VOICE_JOBS_DIR = os.getenv("VOICE_JOBS_DIR") or os.path.join(tempfile.gettempdir(), "calmasense_voice_jobs")
+VOICE_JOBS_WORKERS = max(1, _env_int("VOICE_JOBS_WORKERS", VOICE_ANALYSIS_CONCURRENCY))
+# Trabajos en cola por worker web; más allá se responde 429
+VOICE_JOBS_MAX_PENDING = max(1, _env_int("VOICE_JOBS_MAX_PENDING", 32))
+# Intervalo de consulta del estado para el stream SSE (segundos)
+VOICE_JOBS_SSE_POLL_SECONDS = max(0.2, _env_float("VOICE_JOBS_SSE_POLL_SECONDS", 1.0))
+VOICE_JOBS_SSE_MAX_SECONDS = max(1.0, _env_float("VOICE_JOBS_SSE_MAX_SECONDS", 600.0))
+# Lease de un trabajo pending/processing: el dueño lo renueva cada tercio; vencido,
+# otro worker lo recupera (la búsqueda de huérfanos corre con la misma frecuencia)
+VOICE_JOBS_LEASE_SECONDS = max(10.0, _env_float("VOICE_JOBS_LEASE_SECONDS", 60.0))
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+_RISK_MAP = {
+    "LOW": models.VoiceRiskLevel.LOW,
+    "MODERATE": models.VoiceRiskLevel.MODERATE,
+    "HIGH": models.VoiceRiskLevel.HIGH,
+    "bajo": models.VoiceRiskLevel.LOW,
+    "moderado": models.VoiceRiskLevel.MODERATE,
+    "alto": models.VoiceRiskLevel.HIGH,
+}
+
+_BIOMARCADORES = ("pitch_mean", "pitch_std", "energy", "voice_ratio", "mfcc_variability",
+                  "jitter", "shimmer", "hnr", "score")
+
+
+# =====================
+# FILA DE LA SESIÓN
+# =====================
+
+def columnas_analisis(analisis: Dict) -> Dict:
+    """Columnas de la sesión a partir de procesar_audio_archivo (risk_level normalizado al Enum)"""
+    return {
+        **{campo: analisis[campo] for campo in _BIOMARCADORES},
+        "risk_level": _RISK_MAP.get((analisis.get("risk_level") or "").strip()),
+        "pitch_engine": analisis.get("pitch_engine"),
+        "analysis_status": DONE,
+        "analysis_error": None,
+    }
+
+
+def aplicar_analisis(session: models.VoiceExerciseSession, analisis: Dict) -> None:
+    """Copia los biomarcadores de procesar_audio_archivo a la sesión"""
+    for campo, valor in columnas_analisis(analisis).items():
+        setattr(session, campo, valor)
+
+
+def sesion_a_dict(session: models.VoiceExerciseSession) -> Dict:
+    return {
+        "id": session.id,
+        "user_id": session.user_id,
+        "exercise_id": session.exercise_id,
+        **{campo: getattr(session, campo) for campo in _BIOMARCADORES},
+        "risk_level": session.risk_level.value if hasattr(session.risk_level, 'value') else session.risk_level,
+        "pitch_engine": session.pitch_engine,
+        "duration_seconds": session.duration_seconds,
+        "completed": session.completed,
+        "analysis_status": session.analysis_status,
+        "created_at": session.created_at.isoformat()
+    }
+
+
+def estado_job(db, session_id: int) -> Optional[Dict]:
+    """Estado del trabajo (job_id = id de la sesión); la sesión completa solo cuando está done"""
+    session = db.query(models.VoiceExerciseSession).filter(
+        models.VoiceExerciseSession.id == session_id
+    ).first()
+    if session is None:
+        return None
+    return {
+        "job_id": session.id,
+        "status": session.analysis_status,
+        "error": session.analysis_error,
+        "session": sesion_a_dict(session) if session.analysis_status == DONE else None,
+    }
+
+
+# =====================
+# AUDIO EN DISCO
+# =====================
+
+def _audio_path(session_id: int) -> str:
+    return os.path.join(VOICE_JOBS_DIR, f"{session_id}.audio")
+
+
+def _meta_path(session_id: int) -> str:
+    return os.path.join(VOICE_JOBS_DIR, f"{session_id}.json")
+
+
+def guardar_audio(session_id: int, audio, genero: str) -> None:
+    """Escribe el audio subido (memoryview) y el género del trabajo; rename atómico al final"""
+    os.makedirs(VOICE_JOBS_DIR, exist_ok=True)
+    tmp = _audio_path(session_id) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(audio)
+    with open(_meta_path(session_id), "w") as f:
+        json.dump({"gender": genero}, f)
+    os.replace(tmp, _audio_path(session_id))
+
+
+def _borrar_audio(session_id: int) -> None:
+    for path in (_audio_path(session_id), _meta_path(session_id)):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# =====================
+# COLA DE TRABAJOS
+# =====================
+
+class VoiceSessionJobs:
+    """
+    Cola en memoria del worker web; el estado vive en la fila de la sesión.
+
+    Cada trabajo se toma con un UPDATE pending → processing, así que aunque
+    varios workers lo encolen (p. ej. al recuperar pendientes) se analiza una vez.
+    Desde que se crea, la fila lleva el dueño (host:pid:token del proceso) y un
+    lease que el dueño renueva mientras el trabajo está en su cola o en análisis:
+    solo se recuperan trabajos cuyo lease venció, nunca los de un worker vivo.
+    """
+
+    def __init__(self, workers: int = VOICE_JOBS_WORKERS, max_pending: int = VOICE_JOBS_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.owner = ""
+        self._active = 0
+        self.completed = 0
+        self.failed = 0
+
+    def pending(self) -> int:
+        return (self._queue.qsize() if self._queue is not None else 0) + self._active
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        # En start (no al importar): cada worker de uvicorn tiene su pid. El token evita
+        # confundirse con un proceso anterior que tuvo el mismo pid (reinicio del contenedor)
+        self.owner = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._vigilar()))
+        await self._reencolar()
+
+    async def _reencolar(self) -> None:
+        try:
+            recuperados = await run_in_threadpool(self._recuperar)
+        except Exception as e:
+            print(f"⚠️ No se pudieron recuperar sesiones de voz pendientes: {e}")
+            return
+        for session_id in recuperados:
+            self._queue.put_nowait(session_id)
+        if recuperados:
+            print(f"🔁 {len(recuperados)} sesiones de voz pendientes reencoladas")
+
+    async def _vigilar(self) -> None:
+        """
+        Cada tercio del lease: renueva los pending de la cola de este worker y
+        recupera los trabajos de workers que murieron (también después de nuestro arranque)
+        """
+        while True:
+            await asyncio.sleep(VOICE_JOBS_LEASE_SECONDS / 3)
+            try:
+                await run_in_threadpool(self._renew_pending)
+            except Exception as e:
+                print(f"⚠️ No se pudo renovar el lease de las sesiones de voz en cola: {e}")
+            await self._reencolar()
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await run_in_threadpool(self._liberar)
+        except Exception as e:
+            print(f"⚠️ No se pudieron liberar las sesiones de voz en curso: {e}")
+
+    def check_capacity(self) -> None:
+        """VoiceQueueFull si este worker ya tiene VOICE_JOBS_MAX_PENDING trabajos"""
+        if self.pending() >= self.max_pending:
+            raise VoiceQueueFull(get_voice_analysis_pool().retry_after())
+
+    def assign(self, session: models.VoiceExerciseSession) -> None:
+        """Marca una sesión nueva como pending de este worker (antes del commit y de enqueue)"""
+        session.analysis_status = PENDING
+        session.analysis_owner = self.owner
+        session.analysis_lease_until = self._lease()
+
+    def enqueue(self, session_id: int) -> None:
+        self._queue.put_nowait(session_id)
+
+    # ---------- DB (en threadpool) ----------
+
+    def _recuperar(self) -> List[int]:
+        """
+        Trabajos huérfanos: pending o processing con el lease vencido (su worker murió
+        o se apagó). Pasan a pending de este worker y se encolan; sin audio en disco
+        quedan failed. Reanalizar es idempotente.
+
+        Cada cambio es un UPDATE condicionado al estado y al lease leídos, así que
+        nunca pisa un trabajo que otro worker tomó o renovó entretanto.
+        """
+        Session = models.VoiceExerciseSession
+        ahora = datetime.utcnow()
+        vencido = (Session.analysis_lease_until.is_(None)) | (Session.analysis_lease_until < ahora)
+        # Filas sin lease de versiones anteriores: recién creadas pueden no tener aún el audio
+        creado_hace = ahora - timedelta(seconds=VOICE_JOBS_LEASE_SECONDS)
+        db = SessionLocal()
+        try:
+            huerfanos = db.query(Session.id, Session.analysis_status, Session.created_at).filter(
+                Session.analysis_status.in_((PENDING, PROCESSING)), vencido
+            ).all()
+
+            ids = []
+            for session_id, estado, created_at in huerfanos:
+                hay_audio = os.path.exists(_audio_path(session_id))
+                if hay_audio:
+                    cambios = {"analysis_status": PENDING, "analysis_owner": self.owner,
+                               "analysis_lease_until": self._lease()}
+                elif estado == PENDING and created_at is not None and created_at >= creado_hace:
+                    continue
+                else:
+                    cambios = {"analysis_status": FAILED, "analysis_owner": None, "analysis_lease_until": None,
+                               "analysis_error": "Audio no disponible al recuperar el trabajo"}
+                actualizado = db.query(Session).filter(
+                    Session.id == session_id, Session.analysis_status == estado, vencido
+                ).update(cambios, synchronize_session=False)
+                if actualizado and hay_audio:
+                    ids.append(session_id)
+            db.commit()
+            return ids
+        finally:
+            db.close()
+
+    def _renew_pending(self) -> None:
+        """Extiende el lease de los pending de este worker (siguen en su cola)"""
+        Session = models.VoiceExerciseSession
+        db = SessionLocal()
+        try:
+            db.query(Session).filter(
+                Session.analysis_status == PENDING, Session.analysis_owner == self.owner
+            ).update({"analysis_lease_until": self._lease()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _liberar(self) -> None:
+        """Al apagar, los trabajos de este worker (en cola o en curso) quedan libres sin esperar al lease"""
+        Session = models.VoiceExerciseSession
+        db = SessionLocal()
+        try:
+            db.query(Session).filter(
+                Session.analysis_status.in_((PENDING, PROCESSING)), Session.analysis_owner == self.owner
+            ).update({"analysis_status": PENDING, "analysis_owner": None, "analysis_lease_until": None},
+                     synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _lease(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=VOICE_JOBS_LEASE_SECONDS)
+
+    def _mio(self, session_id: int):
+        """Filtro del trabajo en processing tomado por este worker"""
+        Session = models.VoiceExerciseSession
+        return (Session.id == session_id) & (Session.analysis_status == PROCESSING) & (
+            Session.analysis_owner == self.owner)
+
+    def _claim(self, session_id: int) -> bool:
+        db = SessionLocal()
+        try:
+            claimed = db.query(models.VoiceExerciseSession).filter(
+                models.VoiceExerciseSession.id == session_id,
+                models.VoiceExerciseSession.analysis_status == PENDING,
+            ).update({
+                "analysis_status": PROCESSING,
+                "analysis_owner": self.owner,
+                "analysis_lease_until": self._lease(),
+            }, synchronize_session=False)
+            db.commit()
+            return claimed == 1
+        finally:
+            db.close()
+
+    def _renew(self, session_id: int) -> bool:
+        db = SessionLocal()
+        try:
+            renewed = db.query(models.VoiceExerciseSession).filter(self._mio(session_id)).update(
+                {"analysis_lease_until": self._lease()}, synchronize_session=False
+            )
+            db.commit()
+            return renewed == 1
+        finally:
+            db.close()
+
+    def _finish(self, session_id: int, analisis: Optional[Dict], error: Optional[str]) -> bool:
+        """
+        Guarda el resultado solo si el trabajo sigue en processing y es de este
+        worker: nunca pisa un done/failed que escribió otro.
+        """
+        cambios = columnas_analisis(analisis) if analisis is not None else {
+            "analysis_status": FAILED,
+            "analysis_error": error,
+        }
+        cambios.update({"analysis_owner": None, "analysis_lease_until": None})
+        db = SessionLocal()
+        try:
+            finished = db.query(models.VoiceExerciseSession).filter(self._mio(session_id)).update(
+                cambios, synchronize_session=False
+            )
+            db.commit()
+            return finished == 1
+        finally:
+            db.close()
+
+    # ---------- Worker ----------
+
+    async def _worker(self) -> None:
+        while True:
+            session_id = await self._queue.get()
+            self._active += 1
+            try:
+                await self._process(session_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Sesión de voz {session_id}: {e}")
+            finally:
+                self._active -= 1
+                self._queue.task_done()
+
+    async def _heartbeat(self, session_id: int) -> None:
+        while True:
+            await asyncio.sleep(VOICE_JOBS_LEASE_SECONDS / 3)
+            try:
+                if not await run_in_threadpool(self._renew, session_id):
+                    print(f"⚠️ Sesión de voz {session_id}: el lease ya no es de este worker")
+                    return
+            except Exception as e:
+                print(f"⚠️ No se pudo renovar el lease de la sesión de voz {session_id}: {e}")
+
+    async def _analizar(self, session_id: int) -> Dict:
+        path = _audio_path(session_id)
+        try:
+            with open(_meta_path(session_id)) as f:
+                genero = json.load(f).get("gender") or "neutro"
+        except FileNotFoundError:
+            raise RuntimeError("Audio no disponible para el análisis")
+
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        error = None
+        try:
+            while True:
+                try:
+                    return await get_voice_analysis_pool().analyze(view, genero, path)
+                except VoiceQueueFull as e:
+                    # Los requests síncronos tienen prioridad: el trabajo espera su turno
+                    await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            # Solo el mensaje: el traceback retiene frames con vistas del mmap y close() fallaría
+            error = str(e) or type(e).__name__
+        finally:
+            del view
+            try:
+                mm.close()
+            except BufferError:
+                print(f"⚠️ Sesión de voz {session_id}: el mmap del audio sigue exportado; se libera con el GC")
+        raise RuntimeError(error)
+
+    async def _process(self, session_id: int) -> None:
+        if not await run_in_threadpool(self._claim, session_id):
+            return
+
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(session_id))
+        try:
+            analisis = await self._analizar(session_id)
+        except asyncio.CancelledError:
+            # Apagado: queda processing y se recupera cuando venza el lease
+            raise
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Análisis de la sesión de voz {session_id} falló: {e}")
+            finished = await run_in_threadpool(self._finish, session_id, None, str(e) or type(e).__name__)
+        else:
+            self.completed += 1
+            finished = await run_in_threadpool(self._finish, session_id, analisis, None)
+        finally:
+            heartbeat.cancel()
+        # Si el lease venció y otro worker lo retomó, el audio es suyo
+        if finished:
+            _borrar_audio(session_id)
+        else:
+            print(f"⚠️ Sesión de voz {session_id}: resultado descartado, el trabajo ya no es de este worker")
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "owner": self.owner,
+            "pending": self.pending(),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+async def eventos_job(session_id: int, is_disconnected) -> AsyncIterator[str]:
+    """Stream SSE: un evento `status` por cada cambio de estado hasta done/failed"""
+
+    def _leer():
+        db = SessionLocal()
+        try:
+            return estado_job(db, session_id)
+        finally:
+            db.close()
+
+    ultimo = None
+    esperado = 0.0
+    while esperado < VOICE_JOBS_SSE_MAX_SECONDS:
+        estado = await run_in_threadpool(_leer)
+        if estado is None:
+            yield "event: error\ndata: {\"detail\": \"Sesión no encontrada\"}\n\n"
+            return
+        if estado["status"] != ultimo:
+            ultimo = estado["status"]
+            yield f"event: status\ndata: {json.dumps(estado, default=str)}\n\n"
+        if ultimo in (DONE, FAILED) or await is_disconnected():
+            return
+        await asyncio.sleep(VOICE_JOBS_SSE_POLL_SECONDS)
+        esperado += VOICE_JOBS_SSE_POLL_SECONDS
+
+
+_jobs = VoiceSessionJobs()
+
+
+def get_voice_session_jobs() -> VoiceSessionJobs:
+    return _jobs
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# =====================================================
+#  UPLOADS - Lectura de archivos subidos por streaming
+#  Límite de tamaño mientras se lee, buffers reutilizables
+#  por worker y memoryview hacia los decodificadores
+# =====================================================
+
+import json
+import mmap
+import os
+import resource
+import sys
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, UploadFile
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except Exception:
+        return default
+
+
+MB = 1024 * 1024
+
+UPLOAD_CHUNK_BYTES = max(4096, _env_int("UPLOAD_CHUNK_BYTES", 64 * 1024))
+# Hasta este tamaño el archivo queda en un buffer reutilizable; más grande va a un archivo temporal
+UPLOAD_MEMORY_MAX_BYTES = max(UPLOAD_CHUNK_BYTES, _env_int("UPLOAD_MEMORY_MAX_BYTES", 1 * MB))
+# Buffers retenidos por worker para reutilizar (el resto se libera al terminar el request)
+UPLOAD_POOL_BUFFERS = max(0, _env_int("UPLOAD_POOL_BUFFERS", 4))
+FACE_UPLOAD_MAX_BYTES = _env_int("FACE_UPLOAD_MAX_BYTES", 5 * MB)
+VOICE_UPLOAD_MAX_BYTES = _env_int("VOICE_UPLOAD_MAX_BYTES", 25 * MB)
+# Log por request con bytes subidos, buffer máximo y crecimiento del RSS máximo del proceso
+UPLOAD_LOG_MEMORY = (os.getenv("UPLOAD_LOG_MEMORY") or "0").strip() == "1"
+
+# Margen para cabeceras multipart y campos de formulario al validar Content-Length
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(
+            status_code=413,
+            detail=f"El archivo es demasiado grande (máximo {max_bytes / MB:.0f}MB)",
+        )
+
+
+def _max_rss_kb() -> int:
+    # ru_maxrss: KB en Linux, bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(rss // 1024) if sys.platform == "darwin" else int(rss)
+
+
+# ============================================================
+# Buffers reutilizables y estadísticas
+# ============================================================
+class _UploadBuffers:
+    def __init__(self, size: int, keep: int):
+        self.size = size
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._free: List[bytearray] = []
+        self.requests = 0
+        self.spilled = 0
+        self.rejected = 0
+        self.reused = 0
+        self.in_use_bytes = 0
+        self.peak_in_use_bytes = 0
+        self.peak_request_bytes = 0
+
+    def acquire(self) -> bytearray:
+        with self._lock:
+            self.requests += 1
+            if self._free:
+                self.reused += 1
+                buf = self._free.pop()
+            else:
+                buf = None
+            self.in_use_bytes += self.size
+            self.peak_in_use_bytes = max(self.peak_in_use_bytes, self.in_use_bytes)
+        return buf if buf is not None else bytearray(self.size)
+
+    def release(self, buf: bytearray) -> None:
+        with self._lock:
+            self.in_use_bytes -= self.size
+            if len(self._free) < self.keep:
+                self._free.append(buf)
+
+    def record(self, payload: "UploadPayload") -> None:
+        with self._lock:
+            self.spilled += payload.path is not None
+            self.peak_request_bytes = max(self.peak_request_bytes, payload.peak_memory_bytes)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "spilled_to_disk": self.spilled,
+                "rejected": self.rejected,
+                "buffer_reuses": self.reused,
+                "buffer_bytes": self.size,
+                "free_buffers": len(self._free),
+                "in_use_bytes": self.in_use_bytes,
+                "peak_in_use_bytes": self.peak_in_use_bytes,
+                "peak_request_bytes": self.peak_request_bytes,
+                "max_rss_mb": round(_max_rss_kb() / 1024.0, 1),
+            }
+
+
+_buffers = _UploadBuffers(UPLOAD_MEMORY_MAX_BYTES, UPLOAD_POOL_BUFFERS)
+
+
+def upload_stats() -> Dict:
+    """Contadores de subidas del worker (buffers, spill a disco, picos de memoria)"""
+    return _buffers.stats()
+
+
+# ============================================================
+# Archivo subido
+# ============================================================
+class UploadPayload:
+    """
+    Contenido de un archivo subido: en un buffer reutilizable (pequeños) o en un
+    archivo temporal (grandes). `view()` da un memoryview sin copiar; es válido
+    solo hasta `close()` (usar como context manager alrededor del procesamiento).
+    """
+
+    def __init__(self, filename: Optional[str], content_type: Optional[str]):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.path: Optional[str] = None
+        self.peak_memory_bytes = 0
+        self._buffer: Optional[bytearray] = None
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._rss_start_kb = _max_rss_kb()
+
+    def _write(self, chunk: bytes) -> None:
+        end = self.size + len(chunk)
+        if self._file is None and end > len(self._buffer):
+            # Pasa del buffer a disco: se vuelca lo leído y el buffer vuelve al pool
+            self._file = tempfile.NamedTemporaryFile(prefix="upload_", suffix=".tmp", delete=False)
+            self.path = self._file.name
+            self._file.write(memoryview(self._buffer)[:self.size])
+            _buffers.release(self._buffer)
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer[self.size:end] = chunk
+            self.peak_memory_bytes = end
+        self.size = end
+
+    def view(self) -> memoryview:
+        """Contenido completo como memoryview de solo lectura (sin copia)"""
+        if self._buffer is not None:
+            return memoryview(self._buffer)[:self.size].toreadonly()
+        if self.size == 0:
+            return memoryview(b"")
+        if self._mmap is None:
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def close(self) -> None:
+        _buffers.record(self)
+        if UPLOAD_LOG_MEMORY:
+            print(f"📦 Upload {self.filename or '-'}: {self.size} bytes "
+                  f"({'disco' if self.path else 'memoria'}), buffer máx {self.peak_memory_bytes} bytes, "
+                  f"RSS máx +{max(0, _max_rss_kb() - self._rss_start_kb)} KB")
+        if self._buffer is not None:
+            _buffers.release(self._buffer)
+            self._buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Algún decodificador retiene una vista: el mapeo se libera con el GC
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __enter__(self) -> "UploadPayload":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+async def read_upload(file: UploadFile, max_bytes: int) -> UploadPayload:
+    """
+    Lee el UploadFile por bloques cortando en cuanto supera max_bytes (UploadTooLarge, 413).
+    Nunca arma un `bytes` con el archivo completo.
+    """
+    payload = UploadPayload(file.filename, file.content_type)
+    payload._buffer = _buffers.acquire()
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            if payload.size + len(chunk) > max_bytes:
+                with _buffers._lock:
+                    _buffers.rejected += 1
+                raise UploadTooLarge(max_bytes)
+            payload._write(chunk)
+        if payload._file is not None:
+            payload._file.flush()
+    except BaseException:
+        payload.close()
+        raise
+    return payload
+
+
+# ============================================================
+# Límite por Content-Length (antes de parsear el multipart)
+# ============================================================
+class UploadLimitMiddleware:
+    """
+    Rechaza con 413 los POST cuyo Content-Length ya supera el máximo de la ruta,
+    sin leer el cuerpo. Las subidas chunked (sin Content-Length) quedan acotadas
+    por read_upload.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("method") == "POST":
+            limit = self.limits.get(scope.get("path", "").rstrip("/"))
+            if limit is not None:
+                length = dict(scope.get("headers") or []).get(b"content-length")
+                if length is not None and length.isdigit() and int(length) > limit + _MULTIPART_OVERHEAD:
+                    with _buffers._lock:
+                        _buffers.rejected += 1
+                    body = json.dumps({"detail": UploadTooLarge(limit).detail}).encode()
+                    await send({
+                        "type": "http.response.start",
+                        "status": 413,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+        await self.app(scope, receive, send)
@@ -1,13 +1,54 @@
 from vosk import Model, KaldiRecognizer
 import json
-import wave
-import io
-import subprocess
-import tempfile
-import os
 import re
 import unicodedata
 
+import numpy as np
+
+from backend.services.audio_decoding import decodificar_audio, leer_wav_pcm
+from backend.services.voice_activity import a_pcm16
+
+SAMPLE_RATE = 16000
+
+class StreamingTranscription:
+    """
+    KaldiRecognizer alimentado por partes. accept() devuelve un evento
+    {"type": "partial"|"final", "text"} cuando hay algo nuevo que contar:
+    final cuando Vosk detecta el fin de una frase (silencio), partial si cambió
+    la hipótesis en curso.
+    """
+    
+    def __init__(self, model, sample_rate: int = SAMPLE_RATE):
+        self.rec = KaldiRecognizer(model, sample_rate)
+        self.sample_rate = sample_rate
+        self.finals = []
+        self.samples = 0
+        self._partial = ""
+    
+    def accept(self, pcm16: bytes):
+        self.samples += len(pcm16) // 2
+        if self.rec.AcceptWaveform(bytes(pcm16)):
+            text = json.loads(self.rec.Result()).get("text", "").strip()
+            self._partial = ""
+            if text:
+                self.finals.append(text)
+                return {"type": "final", "text": text}
+            return None
+        partial = json.loads(self.rec.PartialResult()).get("partial", "").strip()
+        if partial and partial != self._partial:
+            self._partial = partial
+            return {"type": "partial", "text": partial}
+        return None
+    
+    def finish(self) -> dict:
+        """Cierra la frase en curso; devuelve el texto completo de la conexión"""
+        text = json.loads(self.rec.FinalResult()).get("text", "").strip()
+        if text:
+            self.finals.append(text)
+        return {"type": "done", "text": " ".join(self.finals), "last": text,
+                "seconds": round(self.samples / float(self.sample_rate), 2)}
+
+
 class TranscriptionService:
     def __init__(self):
         model_path = "backend/voice/models/vosk-model-small-es-0.42"
@@ -17,48 +58,38 @@ class TranscriptionService:
     def transcribe(self, audio_bytes: bytes) -> dict:
         """Transcribe audio a texto"""
         
-        # Convertir a WAV 16kHz mono usando ffmpeg
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as f_in:
-            f_in.write(audio_bytes)
-            input_file = f_in.name
+        # PCM 16 bits 16kHz mono: WAV que ya viene así se usa tal cual, el resto pasa por ffmpeg (pipes)
+        pcm = None
+        wav = leer_wav_pcm(audio_bytes)
+        if wav is not None and wav[0] == SAMPLE_RATE and wav[1].ndim == 1 and wav[1].dtype == np.int16:
+            pcm = wav[1]
+        if pcm is None:
+            pcm = decodificar_audio(audio_bytes, SAMPLE_RATE, "s16le")
+        return self.transcribe_pcm(pcm)
+    
+    def transcribe_pcm(self, pcm: np.ndarray) -> dict:
+        """Transcribe PCM mono a 16kHz ya decodificado (int16, o float32 en [-1, 1])"""
+        if pcm.dtype != np.int16:
+            pcm = a_pcm16(pcm)
+        
+        rec = KaldiRecognizer(self.model, SAMPLE_RATE)
+        data = memoryview(np.ascontiguousarray(pcm)).cast("B")
+        step = 4000 * 2
+        
+        result_text = ""
+        for start in range(0, len(data), step):
+            if rec.AcceptWaveform(bytes(data[start:start + step])):
+                result = json.loads(rec.Result())
+                result_text += result.get("text", "")
         
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f_out:
-            output_file = f_out.name
+        final = json.loads(rec.FinalResult())
+        result_text += final.get("text", "")
         
-        try:
-            # Convertir con ffmpeg
-            subprocess.run([
-                'ffmpeg', '-i', input_file,
-                '-ar', '16000',  # 16kHz
-                '-ac', '1',      # Mono
-                '-f', 'wav',
-                '-y',
-                output_file
-            ], check=True, capture_output=True)
-            
-            # Transcribir
-            wf = wave.open(output_file, "rb")
-            rec = KaldiRecognizer(self.model, wf.getframerate())
-            
-            result_text = ""
-            while True:
-                data = wf.readframes(4000)
-                if len(data) == 0:
-                    break
-                if rec.AcceptWaveform(data):
-                    result = json.loads(rec.Result())
-                    result_text += result.get("text", "")
-            
-            final = json.loads(rec.FinalResult())
-            result_text += final.get("text", "")
-            
-            wf.close()
-            
-            return {"text": result_text.strip(), "confidence": 1.0}
-            
-        finally:
-            os.remove(input_file)
-            os.remove(output_file)
+        return {"text": result_text.strip(), "confidence": 1.0}
+    
+    def stream(self, sample_rate: int = SAMPLE_RATE) -> "StreamingTranscription":
+        """Reconocedor incremental para una conexión (WebSocket)"""
+        return StreamingTranscription(self.model, sample_rate)
     
     def map_response_to_score(self, text: str) -> int:
         """Mapea texto a puntuación 0-3"""
@@ -40,6 +40,12 @@ function FaceMonitor({ isActive = true }) {
   const inFlightSinceRef = useRef(0);
   const abortRef = useRef(null);
 
+  // Clave de seguimiento de presencia: una por montaje del monitor (el backend no puede
+  // distinguir clientes por IP detrás del proxy)
+  const sessionKeyRef = useRef(
+    (window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`)
+  );
+
   // ==========================
   // Countdown estable
   // ==========================
@@ -237,6 +243,7 @@ function FaceMonitor({ isActive = true }) {
       const formData = new FormData();
       formData.append('file', blob, 'frame.jpg');
       formData.append('expected_user_id', String(userIdNow));
+      formData.append('session_key', sessionKeyRef.current);
 
       console.log(`📸 FaceMonitor: enviando checkPresence (req=${myRequestId})`);
 
@@ -6,7 +6,7 @@ import FaceMonitor from "../components/FaceMonitor";
 import UnifiedModal from "../components/UnifiedModal";
 
 // ✅ Fallback STT (Vosk en backend)
-import { recordAudioBlob } from "../utils/voskFallback";
+import { recordAudioBlob, streamTranscription } from "../utils/voskFallback";
 
 // ✅ Hook de theme dinámico
 import useDynamicTheme from "../hooks/useDynamicTheme";
@@ -97,21 +97,37 @@ function GAD7() {
       setIsListening(true);
       setShowVoiceConfirm(false);
       setDetectedAnswer(null);
-      setVoiceTranscript("Grabando audio...");
+      let transcript = "";
+      try {
+        // Tiempo real: termina apenas el usuario deja de hablar
+        setVoiceTranscript("Escuchando...");
+        transcript = await streamTranscription({
+          maxSeconds: 8,
+          onPartial: (text) => {
+            if (requestId === activeVoiceRequestIdRef.current) {
+              setVoiceTranscript(`Escuchando: "${text}"`);
+            }
+          },
+        });
+      } catch (streamError) {
+        console.warn("Streaming Vosk no disponible, grabando audio:", streamError);
+        setVoiceTranscript("Grabando audio...");
 
-      const audioBlob = await recordAudioBlob({ seconds: 4 });
-      setVoiceTranscript("Transcribiendo...");
+        const audioBlob = await recordAudioBlob({ seconds: 4 });
+        setVoiceTranscript("Transcribiendo...");
 
-      const fd = new FormData();
-      fd.append("file", audioBlob, "speech.webm");
+        const fd = new FormData();
+        fd.append("file", audioBlob, "speech.webm");
 
-      const tr = await api.post("/voice/transcribe", fd, {
-        headers: { "Content-Type": "multipart/form-data" },
-      });
+        const tr = await api.post("/voice/transcribe", fd, {
+          headers: { "Content-Type": "multipart/form-data" },
+        });
+        transcript = tr.data?.text || "";
+      }
 
       if (requestId !== activeVoiceRequestIdRef.current) return;
 
-      const transcript = (tr.data?.text || "").trim();
+      transcript = transcript.trim();
       if (!transcript) {
         setVoiceTranscript("No entendí. Intenta de nuevo.");
         return;
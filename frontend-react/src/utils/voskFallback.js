@@ -1,5 +1,116 @@
 // Fallback simple para STT usando Vosk en el backend.
-// Graba unos segundos de audio (MediaRecorder) y lo envía a /voice/transcribe.
+// - streamTranscription: envía el audio por WebSocket mientras el usuario habla
+//   (/voice/transcribe/stream) y termina con la primera frase completa.
+// - recordAudioBlob: graba unos segundos (MediaRecorder) para /voice/transcribe.
+
+import { API_BASE_URL } from "../services/api";
+
+const STREAM_TYPES = [
+  ["audio/webm;codecs=opus", "webm"],
+  ["audio/webm", "webm"],
+  ["audio/ogg;codecs=opus", "ogg"],
+  ["audio/ogg", "ogg"],
+];
+
+export async function streamTranscription({ maxSeconds = 8, onPartial } = {}) {
+  if (!navigator?.mediaDevices?.getUserMedia) {
+    throw new Error("getUserMedia no disponible");
+  }
+  if (typeof MediaRecorder === "undefined" || typeof WebSocket === "undefined") {
+    throw new Error("MediaRecorder/WebSocket no disponible");
+  }
+
+  // El backend decodifica en streaming solo WebM/OGG (Safari graba MP4: usar el fallback)
+  const supported = STREAM_TYPES.find(([t]) => MediaRecorder.isTypeSupported?.(t));
+  if (!supported) {
+    throw new Error("Formato de grabación no soportado para streaming");
+  }
+  const [mimeType, format] = supported;
+
+  const wsUrl = `${API_BASE_URL.replace(/^http/i, "ws")}/voice/transcribe/stream?format=${format}&end_on_final=true`;
+  const ws = new WebSocket(wsUrl);
+
+  await new Promise((resolve, reject) => {
+    ws.onopen = resolve;
+    ws.onerror = () => reject(new Error("No se pudo conectar al streaming de voz"));
+  });
+
+  let stream;
+  try {
+    stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+  } catch (e) {
+    ws.close();
+    throw e;
+  }
+  const recorder = new MediaRecorder(stream, { mimeType });
+
+  return await new Promise((resolve, reject) => {
+    let settled = false;
+    let timer;
+
+    const cleanup = () => {
+      window.clearTimeout(timer);
+      try {
+        if (recorder.state !== "inactive") recorder.stop();
+      } catch {
+        // noop
+      }
+      try {
+        stream.getTracks().forEach((t) => t.stop());
+      } catch {
+        // noop
+      }
+    };
+
+    const finish = (fn, value) => {
+      if (settled) return;
+      settled = true;
+      cleanup();
+      try {
+        ws.close();
+      } catch {
+        // noop
+      }
+      fn(value);
+    };
+
+    ws.onmessage = (e) => {
+      let msg;
+      try {
+        msg = JSON.parse(e.data);
+      } catch {
+        return;
+      }
+      if (msg.type === "partial" || msg.type === "final") {
+        onPartial?.(msg.text);
+      } else if (msg.type === "done") {
+        finish(resolve, msg.text || "");
+      } else if (msg.type === "error") {
+        finish(reject, new Error(msg.detail || "Error en la transcripción"));
+      }
+    };
+
+    ws.onerror = () => finish(reject, new Error("Error en el streaming de voz"));
+    ws.onclose = () => finish(reject, new Error("El streaming de voz se cerró"));
+
+    recorder.ondataavailable = (e) => {
+      if (e.data && e.data.size > 0 && ws.readyState === WebSocket.OPEN) ws.send(e.data);
+    };
+
+    recorder.onerror = (e) => finish(reject, e?.error || new Error("Error grabando audio"));
+
+    // Tras el último chunk: el backend cierra la frase en curso y responde "done"
+    recorder.onstop = () => {
+      if (ws.readyState === WebSocket.OPEN) ws.send("end");
+    };
+
+    recorder.start(250);
+
+    timer = window.setTimeout(() => {
+      if (recorder.state !== "inactive") recorder.stop();
+    }, maxSeconds * 1000);
+  });
+}
 
 export async function recordAudioBlob({ seconds = 4 } = {}) {
   if (!navigator?.mediaDevices?.getUserMedia) {